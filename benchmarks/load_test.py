@@ -0,0 +1,269 @@
+""" Load test for the model-chat API against the local chat-completions stub.
+
+Starts benchmarks.stub_server and the API (uvicorn src.agent.main:app) as
+subprocesses, drives /model-chat, /model-chat/history and /model-chat/reset
+with many concurrent simulated users holding conversations of varying
+length, and reports p50/p95/p99 latency, requests/sec and API process RSS.
+
+    python -m benchmarks.load_test --users 200 --min-turns 1 --max-turns 8 --latency 0.2
+    python -m benchmarks.load_test --json results.json
+    python -m benchmarks.load_test --baseline results.json --max-regression 0.15
+
+With --baseline the run exits non-zero when p95 latency or throughput is
+worse than the baseline by more than --max-regression.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.stub_server import add_arguments as add_stub_arguments
+
+CONVERSATION = [
+    "hello",
+    "I run an online shop number {user} and need help with my data",
+    "create a logical data model for orders, customers and products for shop {user}",
+    "add a loyalty_points attribute to the customer entity ({user}-{turn})",
+    "what does the relationship between order and customer mean?",
+    "rename the product entity to catalog_item ({user}-{turn})",
+    "add a shipment entity related to order ({user}-{turn})",
+    "thanks",
+]
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """Resident memory of ``pid`` and its children in bytes (Linux only)."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            if current == pid:
+                return None
+    return total
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.statuses: Dict[int, int] = {}
+
+    def record(self, endpoint: str, elapsed: float, status: Optional[int]):
+        self.latencies.setdefault(endpoint, []).append(elapsed)
+        self.statuses[status or 0] = self.statuses.get(status or 0, 0) + 1
+        if status is None or status >= 400:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+async def timed(client: httpx.AsyncClient, recorder: Recorder, endpoint: str, method: str, url: str, **kwargs):
+    start = time.perf_counter()
+    status = None
+    try:
+        response = await client.request(method, url, **kwargs)
+        await response.aread()
+        status = response.status_code
+    except httpx.HTTPError:
+        pass
+    recorder.record(endpoint, time.perf_counter() - start, status)
+
+
+async def simulate_user(client: httpx.AsyncClient, recorder: Recorder, user: int, turns: int, history_every: int, run_id: str):
+    headers = {"user-id": f"bench-{run_id}-{user}"}
+    for turn in range(turns):
+        query = CONVERSATION[turn % len(CONVERSATION)].format(user=user, turn=turn)
+        await timed(client, recorder, "/model-chat", "POST", "/model-chat", json={"query": query}, headers=headers)
+        if history_every and (turn + 1) % history_every == 0:
+            await timed(client, recorder, "/model-chat/history", "GET", "/model-chat/history", headers=headers)
+    await timed(client, recorder, "/model-chat/reset", "POST", "/model-chat/reset", headers=headers)
+
+
+async def sample_rss(pid: Optional[int], samples: List[int], stop: asyncio.Event, interval: float = 0.25):
+    while pid is not None and not stop.is_set():
+        rss = process_tree_rss(pid)
+        if rss is not None:
+            samples.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_load(args, app_url: str, app_pid: Optional[int]) -> dict:
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    run_id = f"{int(time.time())}"
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    rss_samples: List[int] = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(app_pid, rss_samples, stop))
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def user_task(client, user):
+        async with gate:
+            await simulate_user(client, recorder, user, rng.randint(args.min_turns, args.max_turns), args.history_every, run_id)
+
+    async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=args.timeout) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(user_task(client, user) for user in range(args.users)))
+        duration = time.perf_counter() - start
+    stop.set()
+    await sampler
+
+    total = sum(len(v) for v in recorder.latencies.values())
+    report = {
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "duration_seconds": round(duration, 3),
+        "requests": total,
+        "requests_per_second": round(total / duration, 2) if duration else None,
+        "statuses": {str(k): v for k, v in sorted(recorder.statuses.items())},
+        "endpoints": {},
+        "rss_bytes": {
+            "start": rss_samples[0] if rss_samples else None,
+            "peak": max(rss_samples) if rss_samples else None,
+            "end": rss_samples[-1] if rss_samples else None,
+        },
+    }
+    for endpoint, values in sorted(recorder.latencies.items()):
+        report["endpoints"][endpoint] = {
+            "count": len(values),
+            "errors": recorder.errors.get(endpoint, 0),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        }
+    return report
+
+
+def print_report(report: dict):
+    print(f"{report['requests']} requests from {report['users']} users in {report['duration_seconds']}s "
+          f"({report['requests_per_second']} req/s, concurrency {report['concurrency']})")
+    print(f"{'endpoint':<22}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, stats in report["endpoints"].items():
+        print(f"{endpoint:<22}{stats['count']:>8}{stats['errors']:>8}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    rss = report["rss_bytes"]
+    if rss["peak"] is not None:
+        mb = lambda value: f"{value / 2**20:.1f} MB"
+        print(f"API RSS: start {mb(rss['start'])}, peak {mb(rss['peak'])}, end {mb(rss['end'])}")
+    print(f"statuses: {report['statuses']}")
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> List[str]:
+    """Return the regressions of ``report`` against ``baseline``."""
+    failures = []
+    if baseline.get("requests_per_second") and report["requests_per_second"] < baseline["requests_per_second"] * (1 - max_regression):
+        failures.append(f"throughput {report['requests_per_second']} req/s < baseline {baseline['requests_per_second']} req/s")
+    for endpoint, stats in report["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(endpoint)
+        if base and stats["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+            failures.append(f"{endpoint} p95 {stats['p95_ms']} ms > baseline {base['p95_ms']} ms")
+    return failures
+
+
+async def wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_processes(args):
+    stub_cmd = [sys.executable, "-m", "benchmarks.stub_server", "--port", str(args.stub_port),
+                "--latency", str(args.latency), "--jitter", str(args.jitter),
+                "--tokens-per-second", str(args.tokens_per_second), "--error-rate", str(args.error_rate),
+                "--entities", str(args.entities), "--attributes", str(args.attributes),
+                "--slow-rate", str(args.slow_rate), "--slow-latency", str(args.slow_latency)]
+    if args.seed is not None:
+        stub_cmd += ["--seed", str(args.seed)]
+    stub = subprocess.Popen(stub_cmd)
+    env = dict(os.environ, LMS_BASE_URL=f"http://127.0.0.1:{args.stub_port}/", LOG_LEVEL="WARNING")
+    app_cmd = [sys.executable, "-m", "uvicorn", "src.agent.main:app", "--port", str(args.app_port),
+               "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"]
+    app = subprocess.Popen(app_cmd, env=env)
+    return stub, app
+
+
+async def main_async(args) -> int:
+    processes = []
+    app_pid = None
+    app_url = args.app_url
+    try:
+        if app_url is None:
+            stub, app = start_processes(args)
+            processes = [stub, app]
+            app_pid = app.pid
+            app_url = f"http://127.0.0.1:{args.app_port}"
+            await wait_ready(f"http://127.0.0.1:{args.stub_port}/stats")
+            await wait_ready(f"{app_url}/openapi.json")
+        report = await run_load(args, app_url, app_pid)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare(report, json.load(f), args.max_regression)
+        for failure in failures:
+            print(f"REGRESSION: {failure}")
+        return 1 if failures else 0
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100, help="Simulated users (one conversation each).")
+    parser.add_argument("--concurrency", type=int, default=100, help="Users active at the same time.")
+    parser.add_argument("--min-turns", type=int, default=1)
+    parser.add_argument("--max-turns", type=int, default=8)
+    parser.add_argument("--history-every", type=int, default=3, help="Fetch /model-chat/history after every N turns (0 disables).")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Client timeout per request in seconds.")
+    parser.add_argument("--app-url", default=None, help="Use an already running API instead of starting one (RSS is not reported).")
+    parser.add_argument("--app-port", type=int, default=9200)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the API process.")
+    parser.add_argument("--json", default=None, help="Write the report to this file.")
+    parser.add_argument("--baseline", default=None, help="Compare against a report written with --json.")
+    parser.add_argument("--max-regression", type=float, default=0.15, help="Allowed relative regression against the baseline.")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+""" Local stub of the OpenAI chat-completions API for benchmarks.
+
+Serves canned IntentResponse, LogicalDataModel and ModelPatch payloads with
+configurable latency, token rate, error rate and slow-request tail, so the
+service can be load-tested without the remote language model service. It
+also serves canned source-system metadata for METADATA_BASE_URL (see
+src/api/main.py).
+
+    python -m benchmarks.stub_server --port 9100 --latency 0.3 --tokens-per-second 200
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from src.prompts.main import INTENT_PROMPT
+
+MODEL_WORDS = ("model", "entity", "entities", "attribute", "relationship", "add", "rename", "remove", "table", "schema", "track")
+
+
+class StubConfig:
+    def __init__(self, latency=0.2, jitter=0.05, tokens_per_second=0.0, error_rate=0.0, entities=10, attributes=6, seed=None,
+                 slow_rate=0.0, slow_latency=5.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.entities = entities
+        self.attributes = attributes
+        self.random = random.Random(seed)
+        # A fraction of requests takes slow_latency instead, to exercise tail-latency controls
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+
+
+def canned_model(entities: int, attributes: int) -> dict:
+    """A valid LogicalDataModel with a chain of one-to-many relationships."""
+    model_entities = []
+    for e in range(entities):
+        attrs = [{"id": f"entity_{e}_id", "name": f"entity_{e}_id", "type": "integer", "isPrimaryKey": True, "isForeignKey": False, "classification": None}]
+        if e > 0:
+            attrs.append({"id": f"entity_{e}_entity_{e - 1}_id", "name": f"entity_{e - 1}_id", "type": "integer", "isPrimaryKey": False, "isForeignKey": True, "classification": None})
+        attrs += [
+            {"id": f"entity_{e}_attr_{a}", "name": f"attr_{a}", "type": "string", "isPrimaryKey": False, "isForeignKey": False, "classification": None}
+            for a in range(attributes)
+        ]
+        model_entities.append({"id": f"entity_{e}", "name": f"Entity{e}", "attributes": attrs, "position": None})
+    relationships = [
+        {"id": f"rel_{e}", "fromEntity": f"entity_{e - 1}", "toEntity": f"entity_{e}", "type": "one-to-many", "name": f"has_entity_{e}"}
+        for e in range(1, entities)
+    ]
+    return {"id": "bench_model", "name": "Benchmark Model", "message": "Here is the logical data model.", "entities": model_entities, "relationships": relationships}
+
+
+def canned_system(system_id: str, tables: int = 3, columns: int = 5) -> dict:
+    return {
+        "id": system_id,
+        "name": system_id.upper(),
+        "type": "postgresql",
+        "tables": [
+            {"name": f"{system_id}_table_{t}", "columns": [{"name": f"column_{c}", "type": "varchar" if c else "bigint"} for c in range(columns)]}
+            for t in range(tables)
+        ],
+    }
+
+
+def _last_user_text(body: dict) -> str:
+    for message in reversed(body.get("messages", [])):
+        if message.get("role") == "user" and isinstance(message.get("content"), str):
+            return message["content"].lower()
+    return ""
+
+
+def canned_content(body: dict, config: StubConfig) -> str:
+    schema_name = (body.get("response_format") or {}).get("json_schema", {}).get("name")
+    if schema_name == "IntentResponse":
+        system = body["messages"][0]["content"] if body.get("messages") else ""
+        # Intent classification and conversational replies share the schema; only the former uses INTENT_PROMPT
+        if system == INTENT_PROMPT:
+            text = _last_user_text(body)
+            return json.dumps({"response": "MODEL" if any(w in text for w in MODEL_WORDS) else "CONVO"})
+        return json.dumps({"response": "I can help you design a logical data model. What does your business do?"})
+    if schema_name == "ModelPatch":
+        return json.dumps({
+            "message": "Renamed the attribute.",
+            "operations": [{"op": "replace", "path": "/entities/entity_0/attributes/entity_0_attr_0/name", "value": json.dumps(f"attr_{config.random.randint(0, 10**6)}")}],
+        })
+    return json.dumps(canned_model(config.entities, config.attributes))
+
+
+def create_app(config: StubConfig) -> FastAPI:
+    app = FastAPI(title="OpenAI chat-completions stub")
+    app.state.config = config
+    app.state.requests = 0
+    app.state.metadata_requests = 0
+
+    async def delay(content: str):
+        latency = max(0.0, config.latency + config.random.uniform(-config.jitter, config.jitter))
+        if config.slow_rate and config.random.random() < config.slow_rate:
+            latency = config.slow_latency
+        if config.tokens_per_second:
+            latency += (len(content) / 4) / config.tokens_per_second
+        await asyncio.sleep(latency)
+
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        if config.error_rate and config.random.random() < config.error_rate:
+            await asyncio.sleep(config.latency)
+            return JSONResponse({"error": {"message": "stub injected error", "type": "server_error"}}, status_code=500)
+
+        content = canned_content(body, config)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+        created = int(time.time())
+
+        if body.get("stream"):
+            async def chunks():
+                step = 64
+                per_chunk = (step / 4) / config.tokens_per_second if config.tokens_per_second else 0
+                await asyncio.sleep(config.latency)
+                for i in range(0, len(content), step):
+                    chunk = {"id": "stub", "object": "chat.completion.chunk", "created": created, "model": body["model"],
+                             "choices": [{"index": 0, "delta": {"content": content[i:i + step]}, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    if per_chunk:
+                        await asyncio.sleep(per_chunk)
+                final = {"id": "stub", "object": "chat.completion.chunk", "created": created, "model": body["model"],
+                         "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                         "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}}
+                yield f"data: {json.dumps(final)}\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(chunks(), media_type="text/event-stream")
+
+        await delay(content)
+        return {
+            "id": "stub",
+            "object": "chat.completion",
+            "created": created,
+            "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    @app.get("/environment")
+    async def environment():
+        return {"id": "stub-env"}
+
+    @app.get("/environments/{environment_id}")
+    async def environment_info(environment_id: str):
+        app.state.metadata_requests += 1
+        return {"id": environment_id, "name": "Stub environment", "systems": ["crm", "erp", "billing"]}
+
+    @app.get("/systems/{system_id}")
+    async def system_info(system_id: str):
+        app.state.metadata_requests += 1
+        await asyncio.sleep(config.latency)
+        return canned_system(system_id)
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests, "metadata_requests": app.state.metadata_requests}
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.2, help="Base upstream latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Uniform +/- jitter on the latency in seconds.")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Completion token rate (0 disables the per-token delay).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500.")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fraction of requests answered after --slow-latency instead.")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="Latency of slow requests in seconds.")
+    parser.add_argument("--entities", type=int, default=10, help="Entities in the canned logical data model.")
+    parser.add_argument("--attributes", type=int, default=6, help="Non-key attributes per canned entity.")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args) -> StubConfig:
+    return StubConfig(args.latency, args.jitter, args.tokens_per_second, args.error_rate, args.entities, args.attributes, args.seed,
+                      args.slow_rate, args.slow_latency)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
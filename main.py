@@ -1,6 +1,12 @@
 """ Test Suite """
-#internal 
-from src.agent.main import generate_logical_data
+#internal
+import argparse
+import asyncio
+import json
+import sys
+
+from src.agent.main import agenerate_batch_model, close_clients, generate_logical_data
+from src.agent.batch import BATCH_CONCURRENCY, BATCH_MAX_ATTEMPTS, BATCH_RATE_PER_SECOND, BatchCheckpoint, parse_items, run_batch
 from src.prompts.main import SYSTEM_PROMPT
 
 def main():
@@ -10,12 +16,12 @@ def main():
                 "content": SYSTEM_PROMPT
             },
 ]
-    
+
     while True:
         query = input("Enter your query (or type 'exit' to quit): ")
         if query.lower() == 'exit':
             break
-        
+
         response = generate_logical_data(messages, query)
         print("Generated Logical Data Model:")
         print(response)
@@ -23,5 +29,39 @@ def main():
         print()
 
 
+async def batch(args):
+    """Generate a model per JSONL prompt, writing JSONL results as they finish."""
+    with open(args.input, encoding="utf-8") if args.input != "-" else sys.stdin as f:
+        items = parse_items(f)
+    checkpoint_file = args.checkpoint or (f"{args.output}.checkpoint" if args.output else None)
+    checkpoint = BatchCheckpoint(checkpoint_file) if checkpoint_file else None
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    failed = 0
+    try:
+        async for result in run_batch(items, agenerate_batch_model, args.concurrency, args.rate, args.attempts, checkpoint):
+            failed += result["status"] != "ok"
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            print(f"{result['id']}: {result['status']}", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        await close_clients()
+    print(f"{len(items) - failed}/{len(items)} items succeeded", file=sys.stderr)
+    return 1 if failed else 0
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Logical data modeling assistant. Without a command, starts an interactive session.")
+    commands = parser.add_subparsers(dest="command")
+    batch_parser = commands.add_parser("batch", help="Generate models for a JSONL file of requirement prompts.")
+    batch_parser.add_argument("input", help='JSONL file with one {"id": ..., "prompt": ...} per line, or - for stdin.')
+    batch_parser.add_argument("-o", "--output", default=None, help="Write JSONL results here instead of stdout.")
+    batch_parser.add_argument("--checkpoint", default=None, help="Checkpoint file for resuming (default: <output>.checkpoint when --output is given).")
+    batch_parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Items generated at the same time.")
+    batch_parser.add_argument("--rate", type=float, default=BATCH_RATE_PER_SECOND, help="Upstream requests per second, including retries and repair calls (0 for no limit).")
+    batch_parser.add_argument("--attempts", type=int, default=BATCH_MAX_ATTEMPTS, help="Attempts per item when the service sheds load (429/503); upstream errors are retried per call.")
+    args = parser.parse_args()
+    if args.command == "batch":
+        sys.exit(asyncio.run(batch(args)))
     main()
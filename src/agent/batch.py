@@ -0,0 +1,203 @@
+""" Batch model generation with bounded parallelism, retries and resumable checkpoints. """
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from fastapi import HTTPException
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+from src.agent.limiter import RateLimiter
+from src.agent.upstream import rate_limit
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+# Upstream requests per second across a batch (retries and repair calls included); 0 disables the limit
+BATCH_RATE_PER_SECOND = float(os.getenv("BATCH_RATE_PER_SECOND", "0"))
+BATCH_MAX_ATTEMPTS = int(os.getenv("BATCH_MAX_ATTEMPTS", "4"))
+BATCH_RETRY_INITIAL = float(os.getenv("BATCH_RETRY_INITIAL", "1"))
+BATCH_RETRY_MAX = float(os.getenv("BATCH_RETRY_MAX", "30"))
+BATCH_CHECKPOINT_DIR = os.getenv("BATCH_CHECKPOINT_DIR", "batch_checkpoints")
+
+batch_stats = {"items": 0, "ok": 0, "failed": 0, "retries": 0, "resumed": 0}
+
+
+class BatchItem(NamedTuple):
+    id: str
+    prompt: str
+
+
+def parse_items(lines: Iterable[str]) -> List[BatchItem]:
+    """Parse JSONL requirement prompts.
+
+    Each line is an object with a ``prompt`` and an optional ``id`` (the
+    line number by default), or a bare JSON string. Blank lines are skipped.
+    Raises ValueError naming the first bad line.
+    """
+    items: List[BatchItem] = []
+    seen = set()
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"line {number}: invalid JSON ({exc.msg})") from exc
+        if isinstance(record, str):
+            record = {"prompt": record}
+        prompt = record.get("prompt") if isinstance(record, dict) else None
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise ValueError(f'line {number}: expected an object with a non-empty "prompt"')
+        item_id = str(record.get("id", number))
+        if item_id in seen:
+            raise ValueError(f"line {number}: duplicate id {item_id!r}")
+        seen.add(item_id)
+        items.append(BatchItem(item_id, prompt))
+    return items
+
+
+def _prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class BatchCheckpoint:
+    """Append-only JSONL log of finished items, used to resume an interrupted batch.
+
+    A result is written (and fsynced) before it is emitted, so after a crash
+    every item the caller has seen is skipped on the next run. Entries are
+    tied to the prompt's hash, so an edited prompt under the same id runs again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        finished: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    # Lines cut short by a crash, or otherwise malformed, are skipped
+                    try:
+                        entry = json.loads(line)
+                        item_id, prompt_hash = entry["result"]["id"], entry["hash"]
+                    except (json.JSONDecodeError, KeyError, TypeError):
+                        continue
+                    if isinstance(item_id, str) and isinstance(prompt_hash, str):
+                        finished[item_id] = entry
+        except FileNotFoundError:
+            pass
+        return finished
+
+    def _write(self, line: str):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def record(self, item: BatchItem, result: Dict[str, Any]):
+        line = json.dumps({"hash": _prompt_hash(item.prompt), "result": result}, ensure_ascii=False) + "\n"
+        await asyncio.to_thread(self._write, line)
+
+
+def checkpoint_path(batch_id: str) -> str:
+    return os.path.join(BATCH_CHECKPOINT_DIR, f"{batch_id}.jsonl")
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Errors worth retrying a whole item for: our own 429/503 load shedding.
+
+    Upstream outages and rate limits are already retried per call by
+    acall_llm (see src/agent/upstream.py), so retrying them here as well
+    would multiply the attempts.
+    """
+    return isinstance(exc, HTTPException) and exc.status_code in (429, 503)
+
+
+async def _run_item(
+    item: BatchItem,
+    generate: Callable[[str], Awaitable[Dict[str, Any]]],
+    max_attempts: int,
+) -> Dict[str, Any]:
+    start = time.perf_counter()
+    attempts = 0
+    retrying = AsyncRetrying(
+        stop=stop_after_attempt(max_attempts),
+        wait=wait_exponential_jitter(initial=BATCH_RETRY_INITIAL, max=BATCH_RETRY_MAX),
+        retry=retry_if_exception(is_transient),
+        reraise=True,
+    )
+    try:
+        async for attempt in retrying:
+            with attempt:
+                attempts += 1
+                if attempts > 1:
+                    batch_stats["retries"] += 1
+                model = await generate(item.prompt)
+    except Exception as exc:
+        batch_stats["failed"] += 1
+        detail = exc.detail if isinstance(exc, HTTPException) else str(exc)
+        return {"id": item.id, "status": "error", "error": f"{type(exc).__name__}: {detail}", "attempts": attempts,
+                "elapsed_seconds": round(time.perf_counter() - start, 3)}
+    batch_stats["ok"] += 1
+    return {"id": item.id, "status": "ok", "model": model, "attempts": attempts,
+            "elapsed_seconds": round(time.perf_counter() - start, 3)}
+
+
+async def run_batch(
+    items: List[BatchItem],
+    generate: Callable[[str], Awaitable[Dict[str, Any]]],
+    concurrency: int = BATCH_CONCURRENCY,
+    rate: float = BATCH_RATE_PER_SECOND,
+    max_attempts: int = BATCH_MAX_ATTEMPTS,
+    checkpoint: Optional[BatchCheckpoint] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Run ``generate`` over ``items`` and yield one result dict per item as it finishes.
+
+    Items already finished in ``checkpoint`` are yielded first (marked
+    ``"resumed": true``) without running again. At most ``concurrency``
+    items run at once and, when ``rate`` is set, every upstream request
+    the items make (retries and repair calls included) is spaced to
+    ``rate`` per second; waiting for the rate does not use up an item's
+    request deadline. Upstream errors are retried per call by
+    acall_llm; an item hit by our own load shedding (429/503) is retried with
+    jittered exponential backoff up to ``max_attempts``; an item that still
+    fails yields ``"status": "error"`` and is retried on the next run. If the
+    consumer stops early, unfinished items are cancelled.
+    """
+    finished = await asyncio.to_thread(checkpoint.load) if checkpoint is not None else {}
+    pending = []
+    for item in items:
+        entry = finished.get(item.id)
+        if entry is not None and entry["hash"] == _prompt_hash(item.prompt):
+            batch_stats["resumed"] += 1
+            yield dict(entry["result"], resumed=True)
+        else:
+            pending.append(item)
+
+    batch_stats["items"] += len(pending)
+    gate = asyncio.Semaphore(concurrency)
+    rate_limiter = RateLimiter(rate) if rate > 0 else None
+
+    async def run(item: BatchItem):
+        async with gate:
+            with rate_limit(rate_limiter):
+                result = await _run_item(item, generate, max_attempts)
+        if checkpoint is not None and result["status"] == "ok":
+            await checkpoint.record(item, result)
+        return result
+
+    tasks = [asyncio.create_task(run(item)) for item in pending]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
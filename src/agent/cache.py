@@ -0,0 +1,231 @@
+""" Response cache for LLM calls with single-flight de-duplication. """
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+# Set to a file path to keep cached responses across restarts
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH")
+
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s.!?]+$")
+
+
+def normalize_messages(messages: List[Dict[str, Any]], fold_user_text: bool = False) -> List[List[str]]:
+    """Whitespace-normalize message contents for keying.
+
+    With ``fold_user_text`` user messages are also case-folded and stripped
+    of trailing punctuation, so "Hi!" and "hi" share an entry. That is only
+    safe for call sites whose answer does not depend on exact wording, such
+    as intent classification.
+    """
+    normalized = []
+    for m in messages:
+        content = m["content"] if isinstance(m["content"], str) else json.dumps(m["content"], sort_keys=True)
+        content = _SPACES.sub(" ", content).strip()
+        if fold_user_text and m["role"] == "user":
+            content = _TRAILING_PUNCTUATION.sub("", content.casefold())
+        normalized.append([m["role"], content])
+    return normalized
+
+
+def cache_key(model: str, response_format: type, messages: List[Dict[str, Any]], fold_user_text: bool = False) -> str:
+    payload = json.dumps(
+        {"model": model, "response_format": response_format.__name__, "messages": normalize_messages(messages, fold_user_text)},
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """LRU cache with a size bound and per-entry TTL; values are JSON strings."""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl_seconds: float = LLM_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCacheBackend:
+    """SQLite-backed cache that survives restarts and is shared between workers."""
+
+    def __init__(self, path: str, ttl_seconds: float = LLM_CACHE_TTL_SECONDS, max_entries: int = LLM_CACHE_MAX_ENTRIES * 16):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT value FROM responses WHERE key = ? AND expires >= ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires) VALUES (?, ?, ?)",
+                (key, value, time.time() + self.ttl_seconds),
+            )
+            # Expired rows go first, then the ones closest to expiry
+            conn.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+            conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class ResponseCache:
+    """Caches parsed LLM responses (as plain dicts) by request hash.
+
+    Lookups go to the in-memory LRU first and then, when configured, to the
+    on-disk backend. Concurrent identical requests are coalesced so only
+    one of them goes upstream (single flight). Values are stored as JSON, so
+    every caller gets its own copy and can modify it freely.
+    """
+
+    def __init__(self, memory: MemoryCacheBackend, disk: Optional[DiskCacheBackend] = None, enabled: bool = LLM_CACHE_ENABLED):
+        self.memory = memory
+        self.disk = disk
+        self.enabled = enabled
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _get_raw(self, key: str) -> Optional[str]:
+        raw = self.memory.get(key)
+        if raw is None and self.disk is not None:
+            raw = self.disk.get(key)
+            if raw is not None:
+                self.memory.set(key, raw)
+        if raw is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return raw
+
+    def _set_raw(self, key: str, raw: str):
+        self.memory.set(key, raw)
+        if self.disk is not None:
+            self.disk.set(key, raw)
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        raw = self._get_raw(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any):
+        if self.enabled:
+            self._set_raw(key, json.dumps(value))
+
+    async def get_or_call(self, key: str, call: Callable[[], Awaitable[Any]], store: Optional[Callable[[Any], bool]] = None) -> Any:
+        """Return the cached value for ``key`` or compute it with ``call`` exactly once.
+
+        A computed value for which ``store`` returns False is shared with the
+        callers waiting on it but not cached.
+        """
+        if not self.enabled:
+            return await call()
+        raw = self._get_raw(key)
+        if raw is not None:
+            return json.loads(raw)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            try:
+                return json.loads(await asyncio.shield(inflight))
+            except asyncio.CancelledError:
+                # The leading caller was cancelled (e.g. a discarded speculation); take over
+                if not inflight.cancelled():
+                    raise
+                return await self.get_or_call(key, call, store)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await call()
+        except BaseException as exc:
+            if isinstance(exc, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(exc)
+                # Mark as retrieved so an unawaited failure is not logged twice
+                future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+        raw = json.dumps(value)
+        future.set_result(raw)
+        if store is None or store(value):
+            self._set_raw(key, raw)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "disk_entries": len(self.disk) if self.disk is not None else None,
+        }
+
+
+response_cache = ResponseCache(
+    MemoryCacheBackend(),
+    DiskCacheBackend(LLM_CACHE_PATH) if LLM_CACHE_PATH else None,
+)
@@ -0,0 +1,98 @@
+""" Shared, pooled clients for the in-house language model service. """
+
+import os
+import threading
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, Client
+
+load_dotenv()
+
+DEFAULT_BASE_URL = "https://language-model-service.mangobeach-c18b898d.switzerlandnorth.azurecontainerapps.io/api/v2/openai/text/"
+
+LMS_BASE_URL = os.getenv("LMS_BASE_URL", DEFAULT_BASE_URL)
+LMS_API_KEY = os.getenv("LMS_API_KEY", "LMS_API_KEY")
+LMS_MAX_CONNECTIONS = int(os.getenv("LMS_MAX_CONNECTIONS", "100"))
+LMS_MAX_KEEPALIVE = int(os.getenv("LMS_MAX_KEEPALIVE", "20"))
+LMS_KEEPALIVE_EXPIRY = float(os.getenv("LMS_KEEPALIVE_EXPIRY", "60"))
+LMS_CONNECT_TIMEOUT = float(os.getenv("LMS_CONNECT_TIMEOUT", "5"))
+LMS_TIMEOUT = float(os.getenv("LMS_TIMEOUT", "120"))
+LMS_HTTP2 = os.getenv("LMS_HTTP2", "true").lower() in ("1", "true", "yes")
+
+_client: Client | None = None
+_async_client: AsyncOpenAI | None = None
+_client_lock = threading.Lock()
+
+
+def _http2_available():
+    # httpx only speaks HTTP/2 when the optional `h2` package is installed
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=LMS_MAX_CONNECTIONS,
+        max_keepalive_connections=LMS_MAX_KEEPALIVE,
+        keepalive_expiry=LMS_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout():
+    return httpx.Timeout(LMS_TIMEOUT, connect=LMS_CONNECT_TIMEOUT)
+
+
+def get_client() -> Client:
+    """Return the process-wide LLM client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                http_client = httpx.Client(
+                    http2=LMS_HTTP2 and _http2_available(),
+                    limits=_limits(),
+                    timeout=_timeout(),
+                )
+                _client = Client(
+                    base_url=LMS_BASE_URL,
+                    api_key=LMS_API_KEY,
+                    http_client=http_client,
+                    timeout=_timeout(),
+                )
+    return _client
+
+
+def get_async_client() -> AsyncOpenAI:
+    """Return the process-wide async LLM client, creating it on first use."""
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                http_client = httpx.AsyncClient(
+                    http2=LMS_HTTP2 and _http2_available(),
+                    limits=_limits(),
+                    timeout=_timeout(),
+                )
+                _async_client = AsyncOpenAI(
+                    base_url=LMS_BASE_URL,
+                    api_key=LMS_API_KEY,
+                    http_client=http_client,
+                    timeout=_timeout(),
+                )
+    return _async_client
+
+
+async def close_clients():
+    """Close the pooled connections (used on application shutdown)."""
+    global _client, _async_client
+    with _client_lock:
+        client, _client = _client, None
+        async_client, _async_client = _async_client, None
+    if client is not None:
+        client.close()
+    if async_client is not None:
+        await async_client.close()
@@ -0,0 +1,290 @@
+""" Bounded, pluggable chat-history stores. """
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from src.agent.versions import ModelVersion, ModelVersionStore
+
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "memory")
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", "chat_history.db")
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "200"))
+HISTORY_MAX_USERS = int(os.getenv("HISTORY_MAX_USERS", "10000"))
+HISTORY_TTL_SECONDS = float(os.getenv("HISTORY_TTL_SECONDS", "86400"))
+# Pages are counted in user+assistant pairs
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "100"))
+
+
+def serialize_message(message: Dict[str, Any]) -> str:
+    """Serialize a message once, in the shape of the API's Message model."""
+    return json.dumps(
+        {"role": message["role"], "content": message["content"], "timestamp": message["timestamp"]},
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+
+
+class HistoryPage(NamedTuple):
+    messages: List[str]  # serialized messages, newest pair first
+    next_cursor: Optional[int]  # pass as ``before`` for the next page; None on the last page
+
+
+def _paginate(newest_first: Iterable[Tuple[int, str, str]], limit: int) -> HistoryPage:
+    """Group (seq, role, serialized) records into user+assistant pairs, newest first.
+
+    Only ``limit`` pairs plus one look-ahead record are consumed, so the cost
+    is proportional to the page rather than the history.
+    """
+    records = iter(newest_first)
+    pairs = []
+    pending = next(records, None)
+    while pending is not None and len(pairs) < limit:
+        following = next(records, None)
+        if pending[1] == "assistant" and following is not None and following[1] == "user":
+            pairs.append((following, pending))
+            pending = next(records, None)
+        else:
+            pairs.append((pending,))
+            pending = following
+    messages = [record[2] for pair in pairs for record in pair]
+    next_cursor = pairs[-1][0][0] if pairs and pending is not None else None
+    return HistoryPage(messages, next_cursor)
+
+
+class HistoryStore(ABC):
+    """Append-only per-user log of chat messages (user and assistant only).
+
+    Messages are dicts with ``role``, ``content`` and ``timestamp``; assistant
+    content is either a string or a logical data model dict. Each message gets
+    an increasing sequence number and is serialized once when it is appended;
+    pages are served from those serialized forms. With a ``versions`` store,
+    assistant models are committed to it as they are appended.
+    """
+
+    @abstractmethod
+    def get(self, user_id: str) -> List[Dict[str, Any]]:
+        """Return the user's messages, oldest first."""
+
+    @abstractmethod
+    def append(self, user_id: str, *messages: Dict[str, Any]) -> List[str]:
+        """Append messages to the user's log as one unit and return them serialized."""
+
+    @abstractmethod
+    def page(self, user_id: str, limit: int = HISTORY_PAGE_SIZE, before: Optional[int] = None) -> HistoryPage:
+        """Return up to ``limit`` pairs older than cursor ``before``, newest pair first."""
+
+    @abstractmethod
+    def reset(self, user_id: str) -> None:
+        """Drop the user's history."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Return size information for monitoring."""
+
+
+class MemoryHistoryStore(HistoryStore):
+    """In-process store with an LRU bound on users, a TTL and a per-user message cap.
+
+    With a ``versions`` store, assistant models are not copied into the log:
+    a message holds a :class:`ModelVersion` reference, whose entities and
+    relationships are shared with the version history and with the other
+    turns, next to its serialized form for pages. ``get`` returns the
+    version store's memoized (read-only) models.
+    """
+
+    def __init__(self, max_messages: int = HISTORY_MAX_MESSAGES, max_users: int = HISTORY_MAX_USERS, ttl_seconds: float = HISTORY_TTL_SECONDS,
+                 versions: Optional[ModelVersionStore] = None):
+        self.max_messages = max_messages
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.versions = versions
+        # user_id -> (last access time, (seq, message, serialized) records); most recently used last.
+        # Model messages have a ModelVersion as content
+        self._users: "OrderedDict[str, tuple[float, deque]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def _drop(self, records: Iterable[tuple]):
+        for _, message, _ in records:
+            if isinstance(message["content"], ModelVersion):
+                self.versions.release(message["content"])
+
+    def _resolve(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        if isinstance(message["content"], ModelVersion):
+            return {**message, "content": self.versions.materialize(message["content"])}
+        return message
+
+    def _record(self, user_id: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        if self.versions is not None and message["role"] == "assistant" and isinstance(message["content"], dict):
+            return {**message, "content": self.versions.checkout(user_id, message["content"])}
+        return message
+
+    def _expire(self, now: float):
+        while self._users:
+            user_id, (accessed, records) = next(iter(self._users.items()))
+            if now - accessed <= self.ttl_seconds:
+                break
+            del self._users[user_id]
+            self._drop(records)
+            self.evicted += 1
+
+    def _touch(self, user_id: str, create: bool):
+        now = time.monotonic()
+        self._expire(now)
+        entry = self._users.pop(user_id, None)
+        if entry is None:
+            if not create:
+                return None
+            messages = deque()
+        else:
+            messages = entry[1]
+        self._users[user_id] = (now, messages)
+        while len(self._users) > self.max_users:
+            _, (_, dropped) = self._users.popitem(last=False)
+            self._drop(dropped)
+            self.evicted += 1
+        return messages
+
+    def get(self, user_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            records = self._touch(user_id, create=False)
+            return [self._resolve(message) for _, message, _ in records] if records is not None else []
+
+    def append(self, user_id: str, *messages: Dict[str, Any]) -> List[str]:
+        serialized = [serialize_message(m) for m in messages]
+        with self._lock:
+            records = self._touch(user_id, create=True)
+            seq = records[-1][0] + 1 if records else 1
+            records.extend((seq + i, self._record(user_id, m), raw) for i, (m, raw) in enumerate(zip(messages, serialized)))
+            # Trimmed here rather than by deque(maxlen) so model references are released
+            while len(records) > self.max_messages:
+                self._drop([records.popleft()])
+        return serialized
+
+    def page(self, user_id: str, limit: int = HISTORY_PAGE_SIZE, before: Optional[int] = None) -> HistoryPage:
+        with self._lock:
+            records = self._touch(user_id, create=False)
+            if not records:
+                return HistoryPage([], None)
+            # Sequence numbers are contiguous, so the cursor maps straight to a position
+            end = len(records) if before is None else max(0, min(len(records), before - records[0][0]))
+            newest_first = ((records[i][0], records[i][1]["role"], records[i][2]) for i in range(end - 1, -1, -1))
+            return _paginate(newest_first, limit)
+
+    def reset(self, user_id: str) -> None:
+        with self._lock:
+            entry = self._users.pop(user_id, None)
+            if entry is not None:
+                self._drop(entry[1])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "users": len(self._users),
+                "messages": sum(len(messages) for _, messages in self._users.values()),
+                "evicted_users": self.evicted,
+            }
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """SQLite (WAL) store that can be shared by several worker processes.
+
+    Rows outlive the process and its version store, so models are stored in
+    full here; ``versions`` only receives the commits.
+    """
+
+    def __init__(self, path: str = HISTORY_DB_PATH, max_messages: int = HISTORY_MAX_MESSAGES, versions: Optional[ModelVersionStore] = None):
+        self.path = path
+        self.max_messages = max_messages
+        self.versions = versions
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " user_id TEXT NOT NULL,"
+                " role TEXT NOT NULL,"
+                " content TEXT NOT NULL,"
+                " timestamp TEXT NOT NULL,"
+                " serialized TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS messages_user_id ON messages (user_id, id)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+            if "serialized" not in columns:
+                # Databases created before pagination: add and backfill the column
+                conn.execute("ALTER TABLE messages ADD COLUMN serialized TEXT")
+                rows = conn.execute("SELECT id, role, content, timestamp FROM messages").fetchall()
+                conn.executemany(
+                    "UPDATE messages SET serialized = ? WHERE id = ?",
+                    [(serialize_message({"role": role, "content": json.loads(content), "timestamp": timestamp}), id_)
+                     for id_, role, content, timestamp in rows],
+                )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id: str) -> List[Dict[str, Any]]:
+        rows = self._connect().execute(
+            "SELECT role, content, timestamp FROM messages WHERE user_id = ? ORDER BY id",
+            (user_id,),
+        ).fetchall()
+        return [{"role": role, "content": json.loads(content), "timestamp": timestamp} for role, content, timestamp in rows]
+
+    def append(self, user_id: str, *messages: Dict[str, Any]) -> List[str]:
+        serialized = [serialize_message(m) for m in messages]
+        if self.versions is not None:
+            for m in messages:
+                if m["role"] == "assistant" and isinstance(m["content"], dict):
+                    self.versions.commit(user_id, m["content"])
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO messages (user_id, role, content, timestamp, serialized) VALUES (?, ?, ?, ?, ?)",
+                [(user_id, m["role"], json.dumps(m["content"]), m["timestamp"], raw) for m, raw in zip(messages, serialized)],
+            )
+            # Enforce the per-user cap by trimming the oldest messages
+            conn.execute(
+                "DELETE FROM messages WHERE user_id = ? AND id <= ("
+                " SELECT id FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (user_id, user_id, self.max_messages),
+            )
+        return serialized
+
+    def page(self, user_id: str, limit: int = HISTORY_PAGE_SIZE, before: Optional[int] = None) -> HistoryPage:
+        # Walks the (user_id, id) index backwards; 2 * limit rows always cover
+        # ``limit`` pairs, plus one row to tell whether an older page exists
+        rows = self._connect().execute(
+            "SELECT id, role, serialized FROM messages WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (user_id, before if before is not None else 2**63 - 1, 2 * limit + 1),
+        ).fetchall()
+        return _paginate(rows, limit)
+
+    def reset(self, user_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+
+    def stats(self) -> Dict[str, Any]:
+        users, messages = self._connect().execute(
+            "SELECT COUNT(DISTINCT user_id), COUNT(*) FROM messages"
+        ).fetchone()
+        return {"backend": "sqlite", "users": users, "messages": messages}
+
+
+def create_history_store(backend: str = HISTORY_BACKEND, versions: Optional[ModelVersionStore] = None) -> HistoryStore:
+    if backend == "memory":
+        return MemoryHistoryStore(versions=versions)
+    if backend == "sqlite":
+        return SQLiteHistoryStore(versions=versions)
+    raise ValueError(f"Unknown HISTORY_BACKEND: {backend!r} (expected 'memory' or 'sqlite')")
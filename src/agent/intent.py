@@ -0,0 +1,145 @@
+""" Local fast-path intent classification in front of the intent LLM call. """
+
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Optional
+
+LOCAL_INTENT_MIN_CONFIDENCE = float(os.getenv("LOCAL_INTENT_MIN_CONFIDENCE", "0.8"))
+
+GREETINGS = ["hello", "hi", "hey", "good morning", "good afternoon", "good evening"]
+
+CASUAL_QUERIES = [
+    "what can you do", "who are you", "help", "what is this", "what do you do", "how can you help", "your capabilities"
+]
+
+ACKNOWLEDGEMENTS = ["thanks", "thank you", "thank you so much", "thx", "great thanks", "cheers", "bye", "goodbye"]
+
+_GREETING_SET = frozenset(GREETINGS)
+_CASUAL_SET = frozenset(CASUAL_QUERIES)
+_ACK_SET = frozenset(ACKNOWLEDGEMENTS)
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+_GENERATE = re.compile(r"\b(create|generate|build|design|draft|produce|give me|make)\b")
+_MODEL_NOUN = re.compile(r"\b(data model|logical model|model|schema|erd|er diagram|entities|entity|tables)\b")
+_EDIT = re.compile(r"\b(add|remove|delete|drop|rename|change|update|modify|replace|include|split|merge|make)\b")
+_EDIT_TARGET = re.compile(r"\b(attributes?|columns?|fields?|entit(?:y|ies)|relationships?|primary keys?|foreign keys?|keys?|cardinality|tables?|types?)\b")
+_EDIT_LEAD = re.compile(r"^(please )?(add|remove|delete|drop|rename|change|update|modify|replace)\b")
+_CONFIRM = re.compile(r"^(yes|yep|yeah|sure|ok|okay|go ahead|proceed|do it|please do|sounds good|perfect)\b")
+# A confirmation and nothing else ("yes please", "ok go ahead")
+_BARE_CONFIRM = re.compile(r"^((yes|yep|yeah|sure|ok|okay|go ahead|proceed|do it|please do|please|sounds good|perfect)( |$))+$")
+_QUESTION = re.compile(r"^(what|why|how|who|when|where|which|explain|tell me|describe|is|are|does|do|can you explain)\b")
+
+
+def normalize_text(text: str) -> str:
+    """Lower-case, strip punctuation and collapse whitespace."""
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", text.lower())).strip()
+
+
+def is_greeting(text):
+    return normalize_text(text) in _GREETING_SET
+
+
+def is_casual_query(text):
+    return normalize_text(text) in _CASUAL_SET
+
+
+class IntentPrediction(NamedTuple):
+    intent: Optional[str]
+    confidence: float
+    tier: str
+
+
+def _last_assistant(history: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    for message in reversed(history):
+        if message["role"] == "assistant":
+            return message
+    return None
+
+
+def _has_model(history: List[Dict[str, Any]]) -> bool:
+    return any(m["role"] == "assistant" and isinstance(m["content"], dict) for m in history)
+
+
+class LocalIntentClassifier:
+    """Tiered keyword, pattern and history classifier for the CONVO/MODEL routing decision.
+
+    Tiers run cheapest first and the first confident answer wins:
+
+    * ``keyword``: exact match of the normalized query against known greetings,
+      casual questions and acknowledgements.
+    * ``pattern``: precompiled patterns for explicit generation requests and
+      open questions.
+    * ``history``: edit instructions or confirmations that only make sense
+      given the conversation so far (e.g. a model already exists).
+
+    Anything below ``min_confidence`` is left to the intent LLM (tier ``llm``).
+    """
+
+    TIERS = ("keyword", "pattern", "history", "llm")
+
+    def __init__(self, min_confidence: float = LOCAL_INTENT_MIN_CONFIDENCE):
+        self.min_confidence = min_confidence
+        self.counts = {tier: 0 for tier in self.TIERS}
+
+    def predict(self, query: str, history: List[Dict[str, Any]]) -> IntentPrediction:
+        text = normalize_text(query)
+        if not text:
+            return IntentPrediction("CONVO", 0.9, "keyword")
+        if text in _GREETING_SET or text in _CASUAL_SET or text in _ACK_SET:
+            return IntentPrediction("CONVO", 1.0, "keyword")
+
+        words = text.split(" ")
+        generate = _GENERATE.search(text) is not None and _MODEL_NOUN.search(text) is not None
+        edit = _EDIT.search(text) is not None and _EDIT_TARGET.search(text) is not None
+        question = _QUESTION.match(text) is not None
+
+        if generate and not question:
+            return IntentPrediction("MODEL", 0.9, "pattern")
+        # A short greeting is only small talk when it carries no edit or generation request
+        if len(words) <= 4 and words[0] in _GREETING_SET and not edit:
+            return IntentPrediction("CONVO", 0.9, "pattern")
+
+        has_model = _has_model(history)
+        if edit and not question and has_model:
+            return IntentPrediction("MODEL", 0.9, "history")
+        if has_model and _EDIT_LEAD.match(text):
+            return IntentPrediction("MODEL", 0.85, "history")
+        if _CONFIRM.match(text) and len(words) <= 6:
+            last = _last_assistant(history)
+            # Confirming after a clarifying question is the go-ahead to generate;
+            # anything after the confirmation ("ok thanks", "sure, that is all") goes to the LLM
+            if last is not None and not isinstance(last["content"], dict):
+                if _BARE_CONFIRM.match(text):
+                    return IntentPrediction("MODEL", 0.85, "history")
+                return IntentPrediction("MODEL", 0.5, "history")
+
+        if question and not (generate or edit):
+            return IntentPrediction("CONVO", 0.6, "pattern")
+        if edit:
+            return IntentPrediction("MODEL", 0.6, "pattern")
+        return IntentPrediction(None, 0.0, "llm")
+
+    def classify(self, query: str, history: List[Dict[str, Any]]) -> Optional[str]:
+        """Return the intent when the local tiers are confident, otherwise None.
+
+        ``None`` means the caller should fall back to the intent LLM.
+        """
+        prediction = self.predict(query, history)
+        if prediction.intent is not None and prediction.confidence >= self.min_confidence:
+            self.counts[prediction.tier] += 1
+            return prediction.intent
+        self.counts["llm"] += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        total = sum(self.counts.values())
+        return {
+            "total": total,
+            "counts": dict(self.counts),
+            "hit_rates": {tier: (count / total if total else 0.0) for tier, count in self.counts.items()},
+        }
+
+
+local_intent_classifier = LocalIntentClassifier()
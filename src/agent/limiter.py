@@ -0,0 +1,90 @@
+""" Bounded concurrency and rate limits for upstream LLM calls. """
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import HTTPException
+
+LMS_MAX_CONCURRENCY = int(os.getenv("LMS_MAX_CONCURRENCY", "64"))
+LMS_MAX_QUEUE = int(os.getenv("LMS_MAX_QUEUE", "256"))
+LMS_QUEUE_TIMEOUT = float(os.getenv("LMS_QUEUE_TIMEOUT", "10"))
+
+
+class UpstreamLimiter:
+    """Caps in-flight upstream calls and rejects quickly once the wait queue is full.
+
+    Requests beyond ``max_concurrency`` wait for a slot. When ``max_queue``
+    requests are already waiting the call fails immediately with 429, and a
+    request that waits longer than ``queue_timeout`` seconds (or the
+    ``timeout`` passed to ``slot``, if shorter) fails with 503.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self, timeout: Optional[float] = None):
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise HTTPException(status_code=429, detail="Too many concurrent requests, please retry shortly.", headers={"Retry-After": "1"})
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout if timeout is None else min(self.queue_timeout, timeout))
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail="The language model service is saturated, please retry shortly.", headers={"Retry-After": "2"})
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` acquisitions per second with bursts of up to ``burst``."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """Wait for a token; returns the seconds spent waiting."""
+        start = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return now - start
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+upstream_limiter = UpstreamLimiter(LMS_MAX_CONCURRENCY, LMS_MAX_QUEUE, LMS_QUEUE_TIMEOUT)
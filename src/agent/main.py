@@ -1,30 +1,67 @@
 """ A script to generate logical data using Groq's LLM capabilities. """
 
-from fastapi import FastAPI, Header, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from openai import LengthFinishReasonError
 from typing import List, Dict, Any, Literal, Optional
-from src.prompts.main import SYSTEM_PROMPT, INTENT_PROMPT
-from src.schema.main import LogicalDataModel
-from openai import Client
+from src.prompts.main import SYSTEM_PROMPT, DELTA_PROMPT, REPAIR_PROMPT
+from src.prompts.builder import build_intent_messages, build_model_messages, count_tokens, message_tokens
+from src.schema.main import LogicalDataModel, ModelPatch
+from src.schema.patch import PatchError, apply_patch
+from src.schema.validate import errors, validate_model
+from src.schema.layout import layout_model
+from src.agent.client import get_async_client, close_clients
+from src.agent.limiter import upstream_limiter
+from src.agent.cache import cache_key, response_cache
+from src.agent.upstream import LLM_MAX_TOKENS, REQUEST_DEADLINE_SECONDS, DeadlineMiddleware, acall_llm, call_llm, deadline, plan_call, site_policy, upstream_stats
+from src.agent.metrics import MetricsMiddleware, record_llm_call, registry, stage
+from src.agent.speculation import SPECULATIVE_EXECUTION, discard, predicts_model, speculation_stats
+from src.agent.batch import BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY, BATCH_RATE_PER_SECOND, BatchCheckpoint, batch_stats, checkpoint_path, parse_items, run_batch
+from src.agent.history import HISTORY_MAX_PAGE_SIZE, HISTORY_PAGE_SIZE, create_history_store
+from src.agent.stream import IncrementalModelParser, sse
+from src.agent.versions import model_versions
+from src.api.main import source_context
+# GREETINGS, CASUAL_QUERIES, is_greeting and is_casual_query are re-exported for older callers
+from src.agent.intent import GREETINGS as GREETINGS, CASUAL_QUERIES as CASUAL_QUERIES, is_greeting as is_greeting, is_casual_query as is_casual_query, local_intent_classifier
 from dotenv import load_dotenv
+import asyncio
 import json
+import logging
+import os
+import time
 from datetime import datetime, timezone
 import re
 
 load_dotenv()
 
-# Remove the global client initialization - it's blocking startup
-# client = Client(
-#     base_url="https://language-model-service.mangobeach-c18b898d.switzerlandnorth.azurecontainerapps.io/api/v2/openai/text/",
-#     api_key="LMS_API_KEY"  # Uses default value as per your sample
-# )
+# Debug output (full histories and model responses) is only produced with LOG_LEVEL=DEBUG
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
+logger = logging.getLogger(__name__)
 
-# In-memory chat histories per user (no login, user_id required in header)
-chat_histories: Dict[str, List[Dict[str, Any]]] = {}
+# The LLM client is shared and pooled; get_client() creates it lazily on
+# first use so startup stays fast (see src/agent/client.py)
+
+# Chat histories per user (no login, user_id required in header); the
+# backend is chosen with HISTORY_BACKEND (see src/agent/history.py).
+# Assistant models are committed to model_versions as they are appended
+history_store = create_history_store(versions=model_versions)
 
 DEFAULT_USER_ID = "demo-user"
 
+# Refine existing models with patch operations instead of full regeneration
+MODEL_DELTA_MODE = os.getenv("MODEL_DELTA_MODE", "true").lower() in ("1", "true", "yes")
+delta_stats = {"applied": 0, "fallbacks": 0}
+
+# Validate every generated model locally and send only the findings back for a targeted fix
+MODEL_REPAIR = os.getenv("MODEL_REPAIR", "true").lower() in ("1", "true", "yes")
+validation_stats = {"validated": 0, "invalid": 0, "repaired": 0, "unrepaired": 0}
+
+# Lay out new entities server-side, keeping the positions of existing ones
+MODEL_LAYOUT = os.getenv("MODEL_LAYOUT", "true").lower() in ("1", "true", "yes")
+
 class Message(BaseModel):
     """A single message in the chat between user and assistant."""
     role: Literal["user", "assistant"] = Field(..., description="The role of the message sender: 'user' or 'assistant'.")
@@ -36,38 +73,63 @@ class QueryRequest(BaseModel):
     query: str = Field(..., description="The user's request or instruction for the data modeling assistant.")
 
 class QueryResponse(BaseModel):
-    """Response body for the /model-chat endpoint, containing the user query and the assistant's response."""
-    messages: List[Message] = Field(..., description="The user query and the assistant's response (logical data model).")
+    """Response body for the /model-chat endpoints: messages, newest user+assistant pair first."""
+    messages: List[Message] = Field(..., description="The user query and the assistant's response (logical data model), newest pair first.")
+    next_cursor: Optional[int] = Field(None, description="Pass as `before` to /model-chat/history for the next (older) page; null on the last page.")
 
 class IntentResponse(BaseModel):
     response: str 
 
 
+def _parse(messages, response_format, site, fold_user_text=False):
+    """Run a structured-output completion through the response cache and return it as a dict.
+
+    ``site`` names the call site (intent, model, patch or convo) in the metrics
+    and selects its upstream policy (see src/agent/upstream.py).
+    """
+    policy = site_policy(site)
+    key = cache_key(policy.model, response_format, messages, fold_user_text)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    # Note: messages should contain the full conversation history
+    # with previous assistant responses as JSON objects
+    response_dict, model = call_llm(site, messages, response_format)
+    # Answers from the fallback model are used once but not cached under the primary's key
+    if model == policy.model:
+        response_cache.set(key, response_dict)
+    return response_dict
+
+
+async def _aparse(messages, response_format, site, fold_user_text=False, usage=None):
+    """Async variant of _parse; identical concurrent requests share one upstream call.
+
+    The call runs under the request deadline with the site's retries,
+    hedging and fallback model. When ``usage`` is given it is filled with
+    the completion's token counts (left empty when the response came from
+    the cache).
+    """
+    policy = site_policy(site)
+    key = cache_key(policy.model, response_format, messages, fold_user_text)
+    served = {}
+
+    async def call():
+        response_dict, served["model"] = await acall_llm(site, messages, response_format, usage)
+        return response_dict
+
+    return await response_cache.get_or_call(key, call, store=lambda _: served.get("model") == policy.model)
+
+
 def classify_intent(messages, query):
     messages.append({
         "role": "user",
         "content": query
     })
-    client = Client(
-        base_url="https://language-model-service.mangobeach-c18b898d.switzerlandnorth.azurecontainerapps.io/api/v2/openai/text/",
-        api_key="LMS_API_KEY"
-    )
-    
-    # Call your in-house GPT API
-    # Note: messages should contain the full conversation history
-    # with previous assistant responses as JSON objects
-    chat_completion = client.beta.chat.completions.parse(
-        model="gpt-4o",
-        messages=messages,
-        max_tokens=1000,
-        response_format=IntentResponse
-    )
-    response = chat_completion.choices[0].message.parsed
-
-    # Convert the LogicalDataModel to a dict for storage
-    response_dict = response.model_dump()
+    # Intent does not depend on exact wording, so repeated phrasings share a cache entry
+    response_dict = _parse(messages, IntentResponse, "intent", fold_user_text=True)
 
-    print("response dict from intent classification: ", response_dict)
+    logger.debug("response dict from intent classification: %s", response_dict)
 
     return response_dict['response']
 
@@ -77,25 +139,9 @@ def generate_logical_data(messages, query):
         "role": "user",
         "content": query
     })
-    # Create client only when needed (lazy initialization)
-    client = Client(
-        base_url="https://language-model-service.mangobeach-c18b898d.switzerlandnorth.azurecontainerapps.io/api/v2/openai/text/",
-        api_key="LMS_API_KEY"
-    )
-    
-    # Call your in-house GPT API
-    # Note: messages should contain the full conversation history
-    # with previous assistant responses as JSON objects
-    chat_completion = client.beta.chat.completions.parse(
-        model="gpt-4o",
-        messages=messages,
-        max_tokens=1000,
-        response_format=LogicalDataModel
-    )
-    response = chat_completion.choices[0].message.parsed
-
-    # Convert the LogicalDataModel to a dict for storage
-    response_dict = response.model_dump()
+    previous = latest_model(messages)
+    # The parsed LogicalDataModel comes back as a dict for storage
+    response_dict = apply_layout(repair_model(_parse(messages, LogicalDataModel, "model")), previous)
 
     messages.append(
         {
@@ -106,32 +152,197 @@ def generate_logical_data(messages, query):
 
     return response_dict
 
+def _repair_messages(findings):
+    """Prompt for a repair patch: the stable system prompt plus the findings, without the model."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "system", "content": DELTA_PROMPT},
+        {"role": "system", "content": REPAIR_PROMPT},
+        {"role": "user", "content": json.dumps([f._asdict() for f in findings], separators=(",", ":"))},
+    ]
+
+
+def _check_model(model):
+    """Return the model's error findings, counting the outcome."""
+    with stage("model_validation"):
+        findings = validate_model(model)
+    validation_stats["validated"] += 1
+    problems = errors(findings)
+    if problems:
+        validation_stats["invalid"] += 1
+    return problems
+
+
+def _apply_repair(model, problems, response_dict):
+    """Apply a repair patch, keeping ``model`` when the patch does not remove every error."""
+    try:
+        repaired = apply_patch(model, ModelPatch.model_validate(response_dict).operations)
+    except (PatchError, ValidationError) as exc:
+        logger.warning("model repair patch failed: %s", exc)
+        repaired = None
+    remaining = errors(validate_model(repaired)) if repaired is not None else problems
+    if remaining:
+        validation_stats["unrepaired"] += 1
+        logger.warning("model %s still has %d integrity problems: %s", model.get("id"), len(remaining), remaining)
+        return model
+    validation_stats["repaired"] += 1
+    repaired["message"] = model["message"]
+    return repaired
+
+
+def _repair_failed(model, exc):
+    """Keep the generated model when the repair call itself fails; repair is best-effort."""
+    logger.warning("model repair call failed, keeping the unrepaired model: %s", exc)
+    validation_stats["unrepaired"] += 1
+    return model
+
+
+def repair_model(model):
+    """Validate ``model`` and, when MODEL_REPAIR is on, fix its errors with one patch call.
+
+    Any failure of the repair call (upstream errors, deadlines, load shedding,
+    malformed output) returns the unrepaired model instead of failing the turn.
+    """
+    problems = _check_model(model)
+    if not problems or not MODEL_REPAIR:
+        return model
+    try:
+        response_dict = _parse(_repair_messages(problems), ModelPatch, "repair")
+    except Exception as exc:
+        return _repair_failed(model, exc)
+    return _apply_repair(model, problems, response_dict)
+
+
+async def arepair_model(model):
+    """Async variant of repair_model."""
+    problems = _check_model(model)
+    if not problems or not MODEL_REPAIR:
+        return model
+    try:
+        response_dict = await _aparse(_repair_messages(problems), ModelPatch, "repair")
+    except Exception as exc:
+        return _repair_failed(model, exc)
+    return _apply_repair(model, problems, response_dict)
+
+
+def apply_layout(model, previous=None):
+    """Fill in entity positions when MODEL_LAYOUT is on; entities of ``previous`` keep theirs."""
+    if MODEL_LAYOUT:
+        with stage("layout"):
+            layout_model(model, previous)
+    return model
+
+
 def generate_conversational_response(messages, query):
     messages.append({
         "role": "user",
         "content": query
     })
-    # Create client only when needed (lazy initialization)
-    client = Client(
-        base_url="https://language-model-service.mangobeach-c18b898d.switzerlandnorth.azurecontainerapps.io/api/v2/openai/text/",
-        api_key="LMS_API_KEY"
+    response_dict = _parse(messages, IntentResponse, "convo")
+
+    logger.debug("conversational api call: %s", response_dict["response"])
+
+    messages.append(
+        {
+            "role": "assistant",
+            "content": response_dict["response"],
+        }
     )
-    
-    # Call your in-house GPT API
-    # Note: messages should contain the full conversation history
-    # with previous assistant responses as JSON objects
-    chat_completion = client.beta.chat.completions.parse(
-        model="gpt-4o",
-        messages=messages,
-        max_tokens=1000,
-        response_format=IntentResponse
+
+    return response_dict["response"]
+
+
+async def aclassify_intent(messages, query):
+    """Async variant of classify_intent used by the API endpoints."""
+    messages.append({
+        "role": "user",
+        "content": query
+    })
+    response_dict = await _aparse(messages, IntentResponse, "intent", fold_user_text=True)
+
+    logger.debug("response dict from intent classification: %s", response_dict)
+
+    return response_dict['response']
+
+
+async def agenerate_logical_data(messages, query, usage=None):
+    """Async variant of generate_logical_data used by the API endpoints.
+
+    When ``usage`` is given it is filled with the completion's token counts.
+    """
+    messages.append({
+        "role": "user",
+        "content": query
+    })
+    # The parsed LogicalDataModel comes back as a dict for storage
+    response_dict = await arepair_model(await _aparse(messages, LogicalDataModel, "model", usage=usage))
+
+    messages.append(
+        {
+            "role": "assistant",
+            "content": response_dict,
+        }
     )
-    response = chat_completion.choices[0].message.parsed
 
-    # Convert the LogicalDataModel to a dict for storage
-    response_dict = response.model_dump()
+    return response_dict
+
 
-    print("conversational api call: ", response_dict["response"])
+async def agenerate_model_patch(messages, query, usage=None):
+    """Ask for a compact list of patch operations against the current model.
+
+    ``messages`` must already contain the current model (see
+    build_model_messages); the delta instructions are appended after the
+    history so the system prompt prefix stays unchanged.
+    """
+    messages.append({"role": "system", "content": DELTA_PROMPT})
+    messages.append({
+        "role": "user",
+        "content": query
+    })
+    return ModelPatch.model_validate(await _aparse(messages, ModelPatch, "patch", usage=usage))
+
+
+async def agenerate_model_update(messages, query, current_model=None, usage=None):
+    """Produce the next model, as a patch against ``current_model`` when delta mode allows it.
+
+    Falls back to full regeneration when there is no current model, delta
+    mode is off, or the patch cannot be applied to a valid model.
+    """
+    if MODEL_DELTA_MODE and current_model is not None:
+        try:
+            patch = await agenerate_model_patch(list(messages), query, usage)
+            response_dict = apply_patch(current_model, patch.operations)
+        except (PatchError, ValidationError, LengthFinishReasonError) as exc:
+            delta_stats["fallbacks"] += 1
+            logger.warning("model patch failed, regenerating full model: %s", exc)
+        else:
+            delta_stats["applied"] += 1
+            response_dict["message"] = patch.message
+            response_dict = apply_layout(await arepair_model(response_dict), current_model)
+            messages.append({"role": "user", "content": query})
+            messages.append({"role": "assistant", "content": response_dict})
+            return response_dict
+    return apply_layout(await agenerate_logical_data(messages, query, usage), current_model)
+
+
+async def agenerate_batch_model(prompt):
+    """Generate a laid-out model for one batch prompt, without any chat history.
+
+    Each item (and each of its attempts) gets a fresh request deadline.
+    """
+    with deadline(REQUEST_DEADLINE_SECONDS):
+        return apply_layout(await agenerate_logical_data(build_model_messages([], prompt, context=source_context.text), prompt))
+
+
+async def agenerate_conversational_response(messages, query):
+    """Async variant of generate_conversational_response used by the API endpoints."""
+    messages.append({
+        "role": "user",
+        "content": query
+    })
+    response_dict = await _aparse(messages, IntentResponse, "convo")
+
+    logger.debug("conversational api call: %s", response_dict["response"])
 
     messages.append(
         {
@@ -142,23 +353,60 @@ def generate_conversational_response(messages, query):
 
     return response_dict["response"]
 
-def order_chat_history(history):
-    # Group into pairs: [user, assistant]
-    pairs = []
-    i = 0
-    while i < len(history):
-        if i + 1 < len(history) and history[i]["role"] == "user" and history[i+1]["role"] == "assistant":
-            pairs.append([history[i], history[i+1]])
-            i += 2
-        else:
-            pairs.append([history[i]])
-            i += 1
-    # Reverse pairs if more than one user query
-    if len(pairs) > 1:
-        pairs = list(reversed(pairs))
-    # Flatten back to a single list
-    ordered = [msg for pair in pairs for msg in pair]
-    return ordered
+
+async def astream_logical_data(messages, query, current_model=None):
+    """Streaming variant of agenerate_logical_data.
+
+    Yields ``(event, payload)`` pairs: the conversational ``message`` first,
+    then every ``entity`` and ``relationship`` as soon as its JSON closes in
+    the token stream, and finally the fully validated ``model``, laid out
+    around the positions in ``current_model``.
+    """
+    messages.append({
+        "role": "user",
+        "content": query
+    })
+    client = get_async_client()
+    parser = IncrementalModelParser()
+    # Streams are not retried or hedged, but still respect the deadline and its fallback model
+    policy = site_policy("model_stream")
+    model, timeout = plan_call("model_stream", policy, policy.model)
+
+    async with upstream_limiter.slot(timeout):
+        start = time.perf_counter()
+        async with client.beta.chat.completions.stream(
+            model=model,
+            messages=messages,
+            max_tokens=LLM_MAX_TOKENS,
+            response_format=LogicalDataModel,
+            timeout=timeout,
+        ) as stream:
+            async for event in stream:
+                if event.type == "content.delta":
+                    for item in parser.feed(event.delta):
+                        yield item
+            chat_completion = await stream.get_final_completion()
+        record_llm_call("model_stream", time.perf_counter() - start, chat_completion.usage)
+    response = chat_completion.choices[0].message.parsed
+
+    # Convert the LogicalDataModel to a dict for storage; the final event carries the repaired model
+    response_dict = apply_layout(await arepair_model(response.model_dump()), current_model)
+
+    messages.append(
+        {
+            "role": "assistant",
+            "content": response_dict,
+        }
+    )
+
+    yield "model", response_dict
+
+def latest_model(history):
+    """Return the most recent assistant model in ``history``, if any."""
+    for m in reversed(history):
+        if m["role"] == "assistant" and isinstance(m["content"], dict):
+            return m["content"]
+    return None
 
 def extract_json_from_string(s):
     # Try to extract JSON from a code block
@@ -176,22 +424,31 @@ def extract_json_from_string(s):
         pass
     return s  # Return as-is if not JSON
 
-GREETINGS = ["hello", "hi", "hey", "good morning", "good afternoon", "good evening"]
+def _messages_response(serialized, next_cursor=None):
+    """Assemble a QueryResponse body from messages serialized by the history store."""
+    with stage("response_serialization"):
+        body = '{"messages":[' + ",".join(serialized) + '],"next_cursor":' + json.dumps(next_cursor) + "}"
+    return Response(content=body, media_type="application/json")
 
-def is_greeting(text):
-    return text.strip().lower() in GREETINGS
+def get_utc_timestamp():
+    return datetime.now(timezone.utc).isoformat()
 
-CASUAL_QUERIES = [
-    "what can you do", "who are you", "help", "what is this", "what do you do", "how can you help", "your capabilities"
-]
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Source-system metadata is fetched in the background, never during a chat turn
+    source_context.start()
+    yield
+    # Release pooled upstream connections on shutdown
+    await source_context.stop()
+    await close_clients()
 
-def is_casual_query(text):
-    return text.strip().lower() in CASUAL_QUERIES
+app = FastAPI(title="Logical Data Modeling Assistant API", description="Generate and iteratively refine logical data models via chat.", lifespan=lifespan)
 
-def get_utc_timestamp():
-    return datetime.now(timezone.utc).isoformat()
+# Record latency and payload sizes for every request (see /metrics)
+app.add_middleware(MetricsMiddleware)
 
-app = FastAPI(title="Logical Data Modeling Assistant API", description="Generate and iteratively refine logical data models via chat.")
+# Bound the upstream calls of every request by REQUEST_DEADLINE_SECONDS (or X-Request-Deadline)
+app.add_middleware(DeadlineMiddleware)
 
 # Add CORS middleware to allow all origins (for development; restrict in production)
 app.add_middleware(
@@ -203,54 +460,253 @@ app.add_middleware(
 )
 
 @app.post("/model-chat", response_model=QueryResponse, summary="Chat with the logical data modeling assistant", tags=["Model Chat"])
-def model_chat(request: QueryRequest, user_id: Optional[str] = Header(DEFAULT_USER_ID, include_in_schema=False)) -> QueryResponse:
+async def model_chat(
+    request: QueryRequest,
+    include_history: bool = Query(False, description="Return the first page of the history instead of only the new user+assistant pair."),
+    user_id: Optional[str] = Header(DEFAULT_USER_ID, include_in_schema=False),
+) -> QueryResponse:
     # Use default user_id if not provided
-    # Get or create chat history for this user (user+assistant messages only)
-    history = chat_histories.setdefault(user_id, [])
-    # Add the new user message to the history
-    history.append({"role": "user", "content": request.query, "timestamp": get_utc_timestamp()})
-    # Prepare messages for the LLM (system prompt + full history)
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-    intent_history = [{"role": "system", "content": INTENT_PROMPT}]
-    for m in history:
-        if m["role"] == "assistant" and isinstance(m["content"], dict):
-            # Convert dict to JSON string for LLM
-            messages.append({"role": m["role"], "content": json.dumps(m["content"])} )
-            intent_history.append({"role": m["role"], "content": json.dumps(m["content"])} )
+    # Load the chat history for this user (user+assistant messages only)
+    with stage("history_load"):
+        history = history_store.get(user_id)
+    # The new turn is only written to the store once it has been answered
+    user_message = {"role": "user", "content": request.query, "timestamp": get_utc_timestamp()}
+    assistant_message = None
+    # Prepare messages for the LLM: a stable system prompt and the source-system context,
+    # followed by a compacted, token-budgeted history (the generators append the query themselves)
+    with stage("prompt_build"):
+        messages = build_model_messages(history, request.query, context=source_context.text)
+        intent_history = build_intent_messages(history, request.query)
+
+    current_model = latest_model(history)
+
+    # Obvious cases are routed locally; only ambiguous queries pay for the intent LLM call
+    intent = local_intent_classifier.classify(request.query, history)
+    speculative_model = None
+    if intent is None:
+        speculate = (
+            SPECULATIVE_EXECUTION
+            and upstream_limiter.waiting == 0
+            and predicts_model(history, local_intent_classifier.predict(request.query, history).intent)
+        )
+        if speculate:
+            # Start the likely generator while the classifier runs; it works on a copy
+            # so a wrong guess leaves `messages` untouched for the other branch
+            speculative_usage = {}
+            speculative_task = asyncio.create_task(agenerate_model_update(list(messages), request.query, current_model, speculative_usage))
+            try:
+                with stage("intent_call"):
+                    intent = await aclassify_intent(intent_history, request.query)
+            except Exception:
+                await discard(speculative_task)
+                raise
+            if intent == 'MODEL':
+                speculation_stats.record_hit()
+                with stage("generation_call"):
+                    speculative_model = await speculative_task
+            else:
+                # The generator's prompt is `messages` (still untouched) plus the query
+                prompt_estimate = sum(message_tokens(m) for m in messages) + count_tokens(request.query)
+                speculation_stats.record_miss(speculative_task, speculative_usage, prompt_estimate)
+                await discard(speculative_task)
         else:
-            messages.append({"role": m["role"], "content": m["content"]})
-            intent_history.append({"role": m["role"], "content": m["content"]})
-
-    intent = classify_intent(intent_history, request.query)
+            with stage("intent_call"):
+                intent = await aclassify_intent(intent_history, request.query)
+
+    logger.debug("intent derived: %s", intent)
+
+    if speculative_model is not None:
+        logger.debug("model bot response: %s", speculative_model)
+        assistant_message = {"role": "assistant", "content": speculative_model, "timestamp": get_utc_timestamp()}
+    elif intent == 'CONVO':
+        with stage("generation_call"):
+            response = await agenerate_conversational_response(messages, request.query)
+        logger.debug("convo bot response: %s", response)
+        assistant_message = {"role": "assistant", "content": response, "timestamp": get_utc_timestamp()}
+    elif intent == 'MODEL':
+        with stage("generation_call"):
+            response_dict = await agenerate_model_update(messages, request.query, current_model)
+        logger.debug("model bot response: %s", response_dict)
+        assistant_message = {"role": "assistant", "content": response_dict, "timestamp": get_utc_timestamp()}
+
+    # Save the answered turn as one append
+    new_messages = [user_message] if assistant_message is None else [user_message, assistant_message]
+    with stage("history_append"):
+        serialized = history_store.append(user_id, *new_messages)
+    if include_history:
+        with stage("history_page"):
+            page = history_store.page(user_id, HISTORY_PAGE_SIZE)
+        return _messages_response(page.messages, page.next_cursor)
+    return _messages_response(serialized)
+
+@app.post("/model-chat/stream", summary="Chat with the logical data modeling assistant, streaming the reply as server-sent events", tags=["Model Chat"])
+async def model_chat_stream(request: QueryRequest, user_id: Optional[str] = Header(DEFAULT_USER_ID, include_in_schema=False)) -> StreamingResponse:
+    """
+    Streaming variant of /model-chat.
+
+    Events, in order: `intent`, then `message` (the conversational reply),
+    then for MODEL turns one `entity` / `relationship` event per element as
+    soon as it is complete, and a final `model` event with the validated
+    model. The stream ends with `done`, or `error` if generation failed.
+    """
+    history = history_store.get(user_id)
+    user_message = {"role": "user", "content": request.query, "timestamp": get_utc_timestamp()}
+    messages = build_model_messages(history, request.query, context=source_context.text)
+
+    # Routing happens before the stream opens so saturation still maps to 429/503
+    intent = local_intent_classifier.classify(request.query, history)
+    if intent is None:
+        intent = await aclassify_intent(build_intent_messages(history, request.query), request.query)
+
+    async def events():
+        yield sse("intent", {"intent": intent})
+        try:
+            if intent == 'MODEL':
+                content = None
+                async for event, payload in astream_logical_data(messages, request.query, latest_model(history)):
+                    yield sse(event, payload)
+                    content = payload
+            else:
+                content = await agenerate_conversational_response(messages, request.query)
+                yield sse("message", content)
+        except HTTPException as exc:
+            yield sse("error", {"status_code": exc.status_code, "detail": exc.detail})
+            return
+        except Exception as exc:
+            yield sse("error", {"status_code": 502, "detail": str(exc)})
+            return
+        history_store.append(user_id, user_message, {"role": "assistant", "content": content, "timestamp": get_utc_timestamp()})
+        yield sse("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/model-chat/batch", summary="Generate logical data models for a batch of requirement prompts", tags=["Model Chat"])
+async def model_chat_batch(
+    request: Request,
+    concurrency: int = Query(BATCH_CONCURRENCY, ge=1, le=BATCH_MAX_CONCURRENCY, description="Items generated at the same time."),
+    rate: float = Query(BATCH_RATE_PER_SECOND, ge=0, description="Upstream requests per second, including retries and repair calls; 0 for no limit."),
+    batch_id: Optional[str] = Query(None, pattern=r"^[A-Za-z0-9_-]{1,64}$", description="Checkpoint name; re-posting the same batch with the same id skips items that already finished."),
+) -> StreamingResponse:
+    """
+    The request body is JSONL: one `{"id": ..., "prompt": ...}` object per
+    line (`id` defaults to the line number). Each prompt is generated
+    independently, without chat history. The response streams one JSONL
+    result per item as soon as it finishes: `{"id", "status": "ok", "model",
+    "attempts", "elapsed_seconds"}` or `{"id", "status": "error", "error",
+    "attempts", "elapsed_seconds"}`; results restored from the checkpoint
+    carry `"resumed": true`.
+    """
+    try:
+        items = parse_items((await request.body()).decode("utf-8").splitlines())
+    except (UnicodeDecodeError, ValueError) as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid batch: {exc}")
+    checkpoint = BatchCheckpoint(checkpoint_path(batch_id)) if batch_id else None
 
-    print('intent derived: ', intent)
+    async def results():
+        async for result in run_batch(items, agenerate_batch_model, concurrency, rate, checkpoint=checkpoint):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
 
-    if intent == 'CONVO':
-        response = generate_conversational_response(messages, request.query)
-        print("convo bot response: ", response)
-        history.append({"role": "assistant", "content": response, "timestamp": get_utc_timestamp()})
-    elif intent == 'MODEL':
-        response_dict = generate_logical_data(messages, request.query)
-        print("model bot response: ", response_dict)
-        history.append({"role": "assistant", "content": response_dict, "timestamp": get_utc_timestamp()})
-
-    print(history)
-    # Generate assistant response (returns dict)
-    #response_dict = generate_logical_data(messages, request.query)
-    # Add the assistant's response to the history
-    #history.append({"role": "assistant", "content": response_dict, "timestamp": get_utc_timestamp()})
-    # Save updated history
-    chat_histories[user_id] = history
-    # Return messages in standard order (most recent user+assistant pair first)
-    # Convert history to Message objects with timestamps
-    return QueryResponse(messages=[Message(**msg) for msg in order_chat_history(history)])
+    return StreamingResponse(results(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/model-chat/reset", summary="Reset the chat history", tags=["Model Chat"])
-def reset_chat(user_id: Optional[str] = Header(DEFAULT_USER_ID, include_in_schema=False)) -> Dict[str, str]:
-    chat_histories[user_id] = []
+async def reset_chat(user_id: Optional[str] = Header(DEFAULT_USER_ID, include_in_schema=False)) -> Dict[str, str]:
+    history_store.reset(user_id)
+    model_versions.reset(user_id)
     return {"message": "Chat history has been reset."}
 
-@app.get("/model-chat/history", response_model=QueryResponse, summary="Get the current chat history", tags=["Model Chat"])
-def get_chat_history(user_id: Optional[str] = Header(DEFAULT_USER_ID, include_in_schema=False)) -> QueryResponse:
-    # Convert history to Message objects with timestamps
-    return QueryResponse(messages=[Message(**msg) for msg in order_chat_history(chat_histories.get(user_id, []))])
\ No newline at end of file
+@app.post("/model-chat/undo", response_model=QueryResponse, summary="Revert the current model to its previous version", tags=["Model Versions"])
+async def undo_model(user_id: Optional[str] = Header(DEFAULT_USER_ID, include_in_schema=False)) -> QueryResponse:
+    """
+    Restores the version the current model was derived from and appends it
+    to the chat as an assistant message, so the next refinement starts from
+    it. Repeated undos keep walking back.
+    """
+    current = latest_model(history_store.get(user_id))
+    reverted = model_versions.revert(user_id, current["id"]) if current is not None else None
+    if reverted is None:
+        raise HTTPException(status_code=409, detail="There is no earlier model version to revert to.")
+    _, model = reverted
+    serialized = history_store.append(user_id, {"role": "assistant", "content": model, "timestamp": get_utc_timestamp()})
+    return _messages_response(serialized)
+
+@app.get("/model-chat/models/{model_id}/versions", summary="List the kept versions of a model", tags=["Model Versions"])
+async def list_model_versions(model_id: str, user_id: Optional[str] = Header(DEFAULT_USER_ID, include_in_schema=False)) -> List[Dict[str, Any]]:
+    versions = model_versions.versions(user_id, model_id)
+    if not versions:
+        raise HTTPException(status_code=404, detail=f"No versions of model {model_id!r}.")
+    return versions
+
+@app.get("/model-chat/models/{model_id}/versions/{version}", response_model=LogicalDataModel, summary="Get a model version", tags=["Model Versions"])
+async def get_model_version(model_id: str, version: int, user_id: Optional[str] = Header(DEFAULT_USER_ID, include_in_schema=False)) -> LogicalDataModel:
+    model = model_versions.get(user_id, model_id, version)
+    if model is None:
+        raise HTTPException(status_code=404, detail=f"Version {version} of model {model_id!r} is not available.")
+    return model
+
+@app.get("/model-chat/models/{model_id}/diff", summary="Structural diff between two model versions", tags=["Model Versions"])
+async def diff_model_versions(
+    model_id: str,
+    old: Optional[int] = Query(None, alias="from", description="Base version; defaults to the one before `to`."),
+    new: Optional[int] = Query(None, alias="to", description="Target version; defaults to the latest."),
+    user_id: Optional[str] = Header(DEFAULT_USER_ID, include_in_schema=False),
+) -> Dict[str, Any]:
+    """
+    Lists added, removed and changed entities, attributes and relationships
+    (by id, with the names of changed fields). Unchanged subtrees are
+    skipped by comparing content hashes.
+    """
+    if new is None:
+        new = model_versions.latest_version(user_id, model_id)
+    if old is None and new is not None:
+        old = new - 1
+    diff = model_versions.diff(user_id, model_id, old, new) if new is not None else None
+    if diff is None:
+        raise HTTPException(status_code=404, detail=f"Versions {old} and {new} of model {model_id!r} are not both available.")
+    return diff
+
+@app.get("/model-chat/history", response_model=QueryResponse, summary="Get the chat history, one page at a time", tags=["Model Chat"])
+async def get_chat_history(
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE, description="Maximum number of user+assistant pairs to return."),
+    before: Optional[int] = Query(None, description="The `next_cursor` of the previous page; omit for the newest page."),
+    user_id: Optional[str] = Header(DEFAULT_USER_ID, include_in_schema=False),
+) -> QueryResponse:
+    with stage("history_page"):
+        page = history_store.page(user_id, limit, before)
+    return _messages_response(page.messages, page.next_cursor)
+
+def chat_stats() -> Dict[str, Any]:
+    return {
+        "intent": local_intent_classifier.stats(),
+        "upstream": upstream_limiter.stats(),
+        "resilience": dict(upstream_stats),
+        "speculation": speculation_stats.stats(),
+        "history": history_store.stats(),
+        "delta": dict(delta_stats),
+        "validation": dict(validation_stats),
+        "batch": dict(batch_stats),
+        "versions": model_versions.stats(),
+        "metadata": source_context.stats(),
+        "cache": response_cache.stats(),
+    }
+
+@registry.collector
+def _chat_stats_metrics():
+    # Export the numeric component stats as gauges, e.g. model_chat_cache_hits
+    for section, values in chat_stats().items():
+        for key, value in values.items():
+            name = f"model_chat_{section}_{key}"
+            if isinstance(value, dict):
+                samples = [({"key": k}, float(v)) for k, v in value.items() if isinstance(v, (int, float))]
+            elif isinstance(value, (int, float)):
+                samples = [({}, float(value))]
+            else:
+                continue
+            yield name, "gauge", f"{section} {key}", samples
+
+@app.get("/model-chat/stats", summary="Get routing, upstream and history statistics", tags=["Model Chat"])
+async def get_chat_stats() -> Dict[str, Any]:
+    return chat_stats()
+
+@app.get("/metrics", summary="Prometheus metrics", tags=["Monitoring"], response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
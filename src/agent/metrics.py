@@ -0,0 +1,243 @@
+""" Per-stage latency, token and payload instrumentation in Prometheus text format. """
+
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Adds a Server-Timing header with the stage timings to every response
+REQUEST_TIMING_HEADER = os.getenv("REQUEST_TIMING_HEADER", "false").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        # label values -> (per-bucket counts, sum, count)
+        self._series: Dict[LabelValues, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def quantile(self, q: float, *labels: str) -> Optional[float]:
+        """Estimate a quantile from the bucket counts (upper bucket bound)."""
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None or series[2] == 0:
+                return None
+            target = q * series[2]
+            seen = 0
+            for i, count in enumerate(series[0][:-1]):
+                seen += count
+                if seen >= target:
+                    return self.buckets[i]
+            return self.buckets[-1]
+
+    def count(self, *labels: str) -> int:
+        with self._lock:
+            series = self._series.get(labels)
+            return series[2] if series is not None else 0
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {count}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Registry:
+    """Holds the metrics and the collectors that export other components' stats."""
+
+    def __init__(self):
+        self._metrics: List = []
+        # Collectors return (name, type, help, [(labels dict, value), ...]) at scrape time
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]] = []
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        self._collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, kind, help, samples in collect():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram("model_chat_stage_seconds", "Wall time of each request stage.", LATENCY_BUCKETS, ("stage",))
+llm_call_seconds = registry.histogram("llm_call_seconds", "Wall time of upstream LLM calls (cache misses only).", LATENCY_BUCKETS, ("site",))
+llm_prompt_tokens = registry.histogram("llm_prompt_tokens", "Prompt tokens per upstream LLM call.", TOKEN_BUCKETS, ("site",))
+llm_completion_tokens = registry.histogram("llm_completion_tokens", "Completion tokens per upstream LLM call.", TOKEN_BUCKETS, ("site",))
+llm_retries = registry.counter("llm_retries_total", "Upstream LLM calls retried after a transient error.", ("site",))
+llm_hedges = registry.counter("llm_hedged_requests_total", "Hedged second requests sent, and which request answered first.", ("site", "outcome"))
+llm_fallbacks = registry.counter("llm_fallbacks_total", "Upstream LLM calls sent to the fallback model.", ("site", "reason"))
+llm_deadline_exceeded = registry.counter("llm_deadline_exceeded_total", "Upstream LLM calls abandoned because the request deadline passed.", ("site",))
+http_request_seconds = registry.histogram("http_request_seconds", "Wall time of HTTP requests.", LATENCY_BUCKETS, ("method", "route", "status"))
+http_request_bytes = registry.histogram("http_request_bytes", "HTTP request body size.", BYTE_BUCKETS, ("route",))
+http_response_bytes = registry.histogram("http_response_bytes", "HTTP response body size.", BYTE_BUCKETS, ("route",))
+
+# Per-request stage timings, read by MetricsMiddleware for the Server-Timing header
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as request stage ``name``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def record_llm_call(site: str, elapsed: float, usage):
+    llm_call_seconds.observe(elapsed, site)
+    if usage is not None:
+        llm_prompt_tokens.observe(usage.prompt_tokens, site)
+        llm_completion_tokens.observe(usage.completion_tokens, site)
+
+
+def process_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+@registry.collector
+def _process_metrics():
+    rss = process_rss_bytes()
+    if rss is not None:
+        yield "process_resident_memory_bytes", "gauge", "Resident memory size in bytes.", [({}, rss)]
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency and payload sizes.
+
+    With REQUEST_TIMING_HEADER enabled it also adds a ``Server-Timing``
+    header listing the stages recorded while handling the request.
+    """
+
+    def __init__(self, app, timing_header: bool = REQUEST_TIMING_HEADER):
+        self.app = app
+        self.timing_header = timing_header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        state = {"status": 500, "request_bytes": 0, "response_bytes": 0}
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["request_bytes"] += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                if self.timing_header:
+                    total = (time.perf_counter() - start) * 1000
+                    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+                    entries.append(f"total;dur={total:.1f}")
+                    message = dict(message)
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", ", ".join(entries).encode("latin-1"))]
+            elif message["type"] == "http.response.body":
+                state["response_bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            _request_timings.reset(token)
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            http_request_seconds.observe(time.perf_counter() - start, scope["method"], route, str(state["status"]))
+            http_request_bytes.observe(state["request_bytes"], route)
+            http_response_bytes.observe(state["response_bytes"], route)
@@ -0,0 +1,73 @@
+""" Speculative execution of the model generator alongside intent classification. """
+
+import asyncio
+import os
+from typing import Any, Dict, List
+
+SPECULATIVE_EXECUTION = os.getenv("SPECULATIVE_EXECUTION", "false").lower() in ("1", "true", "yes")
+
+
+class SpeculationStats:
+    """Counters used to tune speculative generation."""
+
+    def __init__(self):
+        self.attempts = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.wasted_prompt_tokens = 0
+        self.wasted_completion_tokens = 0
+
+    def record_hit(self):
+        self.attempts += 1
+        self.hits += 1
+
+    def record_miss(self, task: asyncio.Task, usage: Dict[str, int], prompt_estimate: int = 0):
+        """Record a wrong guess.
+
+        ``usage`` is only filled if the generator had finished; a task that is
+        still running has usually sent its prompt already, so ``prompt_estimate``
+        is counted for it instead.
+        """
+        self.attempts += 1
+        self.misses += 1
+        if not task.done():
+            self.cancelled += 1
+            self.wasted_prompt_tokens += prompt_estimate
+        self.wasted_prompt_tokens += usage.get("prompt_tokens", 0)
+        self.wasted_completion_tokens += usage.get("completion_tokens", 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": SPECULATIVE_EXECUTION,
+            "attempts": self.attempts,
+            "hits": self.hits,
+            "misses": self.misses,
+            "cancelled": self.cancelled,
+            "hit_rate": self.hits / self.attempts if self.attempts else 0.0,
+            "wasted_tokens": self.wasted_prompt_tokens + self.wasted_completion_tokens,
+            "wasted_prompt_tokens": self.wasted_prompt_tokens,
+            "wasted_completion_tokens": self.wasted_completion_tokens,
+        }
+
+
+def predicts_model(history: List[Dict[str, Any]], local_intent) -> bool:
+    """Guess MODEL when the previous turn produced a model or the local heuristics lean that way."""
+    for message in reversed(history):
+        if message["role"] == "assistant":
+            if isinstance(message["content"], dict):
+                return True
+            break
+    return local_intent == "MODEL"
+
+
+async def discard(task: asyncio.Task):
+    """Cancel a speculative task and swallow whatever it ended with."""
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+
+
+speculation_stats = SpeculationStats()
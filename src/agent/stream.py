@@ -0,0 +1,94 @@
+""" Incremental parsing of a streamed LogicalDataModel and server-sent event helpers. """
+
+import json
+from typing import Any, List, Tuple
+
+from pydantic import ValidationError
+
+from src.schema.main import Entity, Relationship
+
+_ITEM_SCHEMAS = {"entities": ("entity", Entity), "relationships": ("relationship", Relationship)}
+
+
+class IncrementalModelParser:
+    """Scans LogicalDataModel JSON as it streams in and reports completed pieces.
+
+    ``feed`` returns ``(event, payload)`` tuples as soon as they are complete
+    in the token stream:
+
+    * ``("message", str)`` once the top-level ``message`` string closes.
+    * ``("entity", dict)`` / ``("relationship", dict)`` for every element of
+      the top-level ``entities`` / ``relationships`` arrays whose object
+      closes and validates against the schema.
+
+    Each character is looked at once, so the total cost is linear in the
+    size of the response however it is chunked.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        # Frames are [kind, start, key, expecting_key]; for arrays `key` is the
+        # key of the enclosing object the array is the value of
+        self._stack: List[list] = []
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self.invalid = 0
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self.buffer += chunk
+        events = []
+        buffer, stack = self.buffer, self._stack
+        for pos in range(self._pos, len(buffer)):
+            char = buffer[pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    self._close_string(buffer[self._string_start:pos + 1], events)
+                continue
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif char == "{" or char == "[":
+                parent_key = stack[-1][2] if stack else None
+                stack.append([char, pos, parent_key if char == "[" else None, char == "{"])
+            elif char == "}" or char == "]":
+                kind, start, _, _ = stack.pop()
+                if kind == "{" and len(stack) == 2 and stack[0][0] == "{" and stack[1][0] == "[":
+                    self._close_item(stack[1][2], buffer[start:pos + 1], events)
+            elif char == ":" and stack and stack[-1][0] == "{":
+                stack[-1][3] = False
+            elif char == "," and stack and stack[-1][0] == "{":
+                stack[-1][3] = True
+        self._pos = len(buffer)
+        return events
+
+    def _close_string(self, raw: str, events: List[Tuple[str, Any]]):
+        if not self._stack or self._stack[-1][0] != "{":
+            return
+        frame = self._stack[-1]
+        if frame[3]:
+            frame[2] = json.loads(raw)
+        elif len(self._stack) == 1 and frame[2] == "message":
+            events.append(("message", json.loads(raw)))
+
+    def _close_item(self, key: str, raw: str, events: List[Tuple[str, Any]]):
+        if key not in _ITEM_SCHEMAS:
+            return
+        event, schema = _ITEM_SCHEMAS[key]
+        try:
+            item = schema.model_validate_json(raw)
+        except ValidationError:
+            self.invalid += 1
+            return
+        events.append((event, item.model_dump()))
+
+
+def sse(event: str, data: Any) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
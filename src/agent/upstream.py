@@ -0,0 +1,375 @@
+""" Upstream LLM calls with per-request deadlines, jittered retries, hedged requests and fallback models. """
+
+import asyncio
+import contextvars
+import functools
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import openai
+from fastapi import HTTPException
+from openai import ContentFilterFinishReasonError, LengthFinishReasonError, pydantic_function_tool
+from openai.types.chat import ChatCompletion
+
+from src.agent.client import get_async_client, get_client
+from src.agent.limiter import RateLimiter, upstream_limiter
+from src.agent.metrics import llm_call_seconds, llm_deadline_exceeded, llm_fallbacks, llm_hedges, llm_retries, record_llm_call
+
+# Time budget for all upstream calls made while serving one request; clients
+# may ask for less with an X-Request-Deadline header (seconds)
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "1000"))
+LLM_RETRY_INITIAL = float(os.getenv("LLM_RETRY_INITIAL", "0.5"))
+LLM_RETRY_MAX = float(os.getenv("LLM_RETRY_MAX", "4"))
+# Latency samples a call site needs before its quantile is trusted as a hedge delay
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# Call site settings are read from LLM_<SITE>_<SETTING>, then LLM_<SETTING>,
+# then the site defaults below. An empty FALLBACK_MODEL disables the fallback
+# and a HEDGE_QUANTILE of 0 disables hedging.
+_DEFAULTS = {
+    "MODEL": "gpt-4o",
+    "FALLBACK_MODEL": "",
+    # Per attempt, in seconds; the request deadline can only shorten it
+    "TIMEOUT": "60",
+    "MAX_ATTEMPTS": "3",
+    "HEDGE_QUANTILE": "0",
+    "HEDGE_MIN_DELAY": "0.5",
+    # Seconds of deadline kept for the fallback model; below it the fallback is called directly
+    "FALLBACK_MARGIN": "10",
+}
+_SITE_DEFAULTS = {
+    "intent": {"FALLBACK_MODEL": "gpt-4o-mini", "TIMEOUT": "10", "HEDGE_QUANTILE": "0.95", "FALLBACK_MARGIN": "4"},
+    "model": {"FALLBACK_MODEL": "gpt-4o-mini", "FALLBACK_MARGIN": "20"},
+    "model_stream": {"FALLBACK_MODEL": "gpt-4o-mini", "FALLBACK_MARGIN": "20", "TIMEOUT": "90"},
+    "convo": {"TIMEOUT": "30"},
+}
+
+upstream_stats = {"calls": 0, "retries": 0, "hedged": 0, "hedge_wins": 0, "fallbacks": 0, "deadline_exceeded": 0}
+
+
+class CallPolicy(NamedTuple):
+    model: str
+    fallback_model: Optional[str]
+    timeout: float
+    max_attempts: int
+    hedge_quantile: float
+    hedge_min_delay: float
+    fallback_margin: float
+
+
+def _setting(site: str, name: str) -> str:
+    value = os.getenv(f"LLM_{site.upper()}_{name}")
+    if value is None:
+        value = os.getenv(f"LLM_{name}")
+    if value is None:
+        value = _SITE_DEFAULTS.get(site, {}).get(name, _DEFAULTS[name])
+    return value
+
+
+@functools.lru_cache(maxsize=None)
+def site_policy(site: str) -> CallPolicy:
+    """Upstream settings for a call site (intent, model, patch, convo, repair or model_stream)."""
+    return CallPolicy(
+        model=_setting(site, "MODEL"),
+        fallback_model=_setting(site, "FALLBACK_MODEL") or None,
+        timeout=float(_setting(site, "TIMEOUT")),
+        max_attempts=max(1, int(_setting(site, "MAX_ATTEMPTS"))),
+        hedge_quantile=float(_setting(site, "HEDGE_QUANTILE")),
+        hedge_min_delay=float(_setting(site, "HEDGE_MIN_DELAY")),
+        fallback_margin=float(_setting(site, "FALLBACK_MARGIN")),
+    )
+
+
+class Deadline:
+    """Monotonic time by which a request's upstream calls must finish.
+
+    Shared by reference with the tasks the request starts, so time spent
+    waiting for a batch rate-limit token can push it back for all of them.
+    """
+
+    __slots__ = ("expires",)
+
+    def __init__(self, expires: float):
+        self.expires = expires
+
+
+_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("llm_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: Optional[float]):
+    """Bound every upstream call made in the block (and in tasks it starts) to ``seconds`` from now."""
+    token = _deadline.set(Deadline(time.monotonic() + seconds) if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+# Token bucket spacing the upstream calls made in a block (e.g. one batch); None for no limit
+_rate_limiter: contextvars.ContextVar[Optional[RateLimiter]] = contextvars.ContextVar("llm_rate_limiter", default=None)
+
+
+@contextmanager
+def rate_limit(limiter: Optional[RateLimiter]):
+    """Take a ``limiter`` token before every upstream request made in the block, retries included.
+
+    The wait for a token does not count against the attempt timeout or the
+    request deadline, and no hedges are sent: they would spend the rate on duplicates.
+    """
+    token = _rate_limiter.set(limiter)
+    try:
+        yield
+    finally:
+        _rate_limiter.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None without one."""
+    current = _deadline.get()
+    return None if current is None else current.expires - time.monotonic()
+
+
+class DeadlineMiddleware:
+    """ASGI middleware giving every HTTP request an upstream deadline.
+
+    The budget is REQUEST_DEADLINE_SECONDS, or less when the client sends a
+    smaller ``X-Request-Deadline`` in seconds. It also covers streamed bodies.
+    """
+
+    def __init__(self, app, seconds: float = REQUEST_DEADLINE_SECONDS):
+        self.app = app
+        self.seconds = seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        seconds = self.seconds
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-deadline":
+                try:
+                    requested = float(value)
+                except ValueError:
+                    break
+                if requested > 0:
+                    seconds = min(seconds, requested) if seconds else requested
+                break
+        with deadline(seconds):
+            await self.app(scope, receive, send)
+
+
+def _deadline_exceeded(site: str) -> HTTPException:
+    llm_deadline_exceeded.inc(site)
+    upstream_stats["deadline_exceeded"] += 1
+    return HTTPException(status_code=504, detail="The language model service did not answer within the request deadline.")
+
+
+def _fall_back(site: str, policy: CallPolicy, reason: str) -> str:
+    llm_fallbacks.inc(site, reason)
+    upstream_stats["fallbacks"] += 1
+    return policy.fallback_model
+
+
+def plan_call(site: str, policy: CallPolicy, model: str) -> Tuple[str, float]:
+    """Pick the model and attempt timeout for the next call at ``site`` under the current deadline.
+
+    Calls for the primary model stop early enough to leave FALLBACK_MARGIN
+    seconds for the fallback; once less than that remains the fallback is
+    used directly. Raises 504 when the deadline has passed.
+    """
+    left = remaining()
+    if left is None:
+        return model, policy.timeout
+    if policy.fallback_model and model != policy.fallback_model:
+        if left > policy.fallback_margin:
+            return model, min(policy.timeout, left - policy.fallback_margin)
+        model = _fall_back(site, policy, "deadline")
+    if left <= 0:
+        raise _deadline_exceeded(site)
+    return model, min(policy.timeout, left)
+
+
+@functools.lru_cache(maxsize=None)
+def response_format_param(response_format: type) -> Dict[str, Any]:
+    """Strict JSON-schema response format for a pydantic model, built once per type.
+
+    Equivalent to what ``beta.chat.completions.parse`` sends, without
+    regenerating the schema and re-validating the request on every call.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": response_format.__name__,
+            "schema": pydantic_function_tool(response_format)["function"]["parameters"],
+            "strict": True,
+        },
+    }
+
+
+def _body(model: str, messages: List[Dict[str, Any]], response_format: type) -> Dict[str, Any]:
+    return {"model": model, "messages": messages, "max_tokens": LLM_MAX_TOKENS, "response_format": response_format_param(response_format)}
+
+
+def parse_completion(completion: ChatCompletion, response_format: type) -> Dict[str, Any]:
+    """Validate a structured-output completion against ``response_format`` and return it as a dict."""
+    choice = completion.choices[0]
+    if choice.finish_reason == "length":
+        raise LengthFinishReasonError(completion=completion)
+    if choice.finish_reason == "content_filter":
+        raise ContentFilterFinishReasonError()
+    return response_format.model_validate_json(choice.message.content or "").model_dump()
+
+
+def _retryable(exc: BaseException) -> bool:
+    # Timeouts are connection errors; our own 429/503 from the limiter are load shedding and not retried here
+    return isinstance(exc, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError))
+
+
+def _backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff before retry number ``attempt``."""
+    return random.uniform(0, min(LLM_RETRY_MAX, LLM_RETRY_INITIAL * 2 ** (attempt - 1)))
+
+
+def call_llm(site: str, messages: List[Dict[str, Any]], response_format: type) -> Tuple[Dict[str, Any], str]:
+    """Blocking structured-output call for ``site``; returns (response dict, model used).
+
+    Used by the command line, which has no request deadline or concurrent
+    callers, so there is no hedging; the SDK's own retries apply.
+    """
+    policy = site_policy(site)
+    model, timeout = plan_call(site, policy, policy.model)
+    upstream_stats["calls"] += 1
+    start = time.perf_counter()
+    completion = get_client().post("/chat/completions", cast_to=ChatCompletion, body=_body(model, messages, response_format), options={"timeout": timeout})
+    record_llm_call(site, time.perf_counter() - start, completion.usage)
+    return parse_completion(completion, response_format), model
+
+
+async def _attempt(site: str, model: str, messages: List[Dict[str, Any]], response_format: type, timeout: float):
+    limiter = _rate_limiter.get()
+    if limiter is not None:
+        waited = await limiter.acquire()
+        # Queueing for our own rate limit is not the upstream's time; attempts of
+        # a request never wait in parallel (no hedges under a rate limit), so this is exact
+        current = _deadline.get()
+        if current is not None:
+            current.expires += waited
+    expires = time.monotonic() + timeout
+    # Bounded so a burst of chats cannot pile up on the upstream service
+    async with upstream_limiter.slot(timeout):
+        start = time.perf_counter()
+        completion = await get_async_client().post(
+            "/chat/completions",
+            cast_to=ChatCompletion,
+            body=_body(model, messages, response_format),
+            # Retries are ours, so they can respect the deadline
+            options={"timeout": max(expires - time.monotonic(), 0.001), "max_retries": 0},
+        )
+    record_llm_call(site, time.perf_counter() - start, completion.usage)
+    return parse_completion(completion, response_format), completion.usage
+
+
+def _hedge_delay(site: str, policy: CallPolicy, timeout: float) -> Optional[float]:
+    if policy.hedge_quantile <= 0 or llm_call_seconds.count(site) < LLM_HEDGE_MIN_SAMPLES:
+        return None
+    delay = max(llm_call_seconds.quantile(policy.hedge_quantile, site), policy.hedge_min_delay)
+    return delay if delay < timeout else None
+
+
+def _observe(task: asyncio.Task):
+    # Losing attempts may fail after the winner returned; retrieve their errors so they are not logged
+    if not task.cancelled():
+        task.exception()
+
+
+async def _hedged(site: str, policy: CallPolicy, model: str, messages: List[Dict[str, Any]], response_format: type, timeout: float):
+    """One attempt, plus a second identical request if the first is still running after the hedge delay.
+
+    The delay is the site's HEDGE_QUANTILE latency, so only the slowest
+    calls are duplicated. No hedge is sent while calls are queueing for the
+    limiter or under a batch rate limit. The first successful answer wins and
+    the other request is cancelled.
+    """
+    delay = _hedge_delay(site, policy, timeout)
+    if delay is None or _rate_limiter.get() is not None:
+        return await _attempt(site, model, messages, response_format, timeout)
+    tasks = [asyncio.create_task(_attempt(site, model, messages, response_format, timeout))]
+    tasks[0].add_done_callback(_observe)
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or upstream_limiter.waiting:
+            return await tasks[0]
+        llm_hedges.inc(site, "sent")
+        upstream_stats["hedged"] += 1
+        tasks.append(asyncio.create_task(_attempt(site, model, messages, response_format, timeout - delay)))
+        tasks[1].add_done_callback(_observe)
+        pending, error = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is tasks[1]:
+                        llm_hedges.inc(site, "hedge_won")
+                        upstream_stats["hedge_wins"] += 1
+                    else:
+                        llm_hedges.inc(site, "primary_won")
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def acall_llm(
+    site: str, messages: List[Dict[str, Any]], response_format: type, usage: Optional[Dict[str, int]] = None
+) -> Tuple[Dict[str, Any], str]:
+    """Structured-output call for ``site`` under the current deadline; returns (response dict, model used).
+
+    Transient upstream errors are retried with jittered exponential backoff
+    up to MAX_ATTEMPTS, as long as the deadline allows. When the deadline
+    gets close, or the primary model keeps failing, the site's fallback
+    model answers instead. Raises 504 once the deadline has passed. When
+    ``usage`` is given it is filled with the winning completion's token counts.
+    """
+    policy = site_policy(site)
+    model = policy.model
+    attempt = 0
+    upstream_stats["calls"] += 1
+    while True:
+        planned, timeout = plan_call(site, policy, model)
+        # Each model gets its own MAX_ATTEMPTS, however the switch happened
+        if planned != model:
+            model, attempt = planned, 0
+        attempt += 1
+        try:
+            response_dict, completion_usage = await _hedged(site, policy, model, messages, response_format, timeout)
+            break
+        except Exception as exc:
+            if not _retryable(exc):
+                raise
+            left = remaining()
+            if left is not None and left <= 0:
+                raise _deadline_exceeded(site) from exc
+            if policy.fallback_model and model != policy.fallback_model and left is not None and left <= policy.fallback_margin:
+                # The primary model's share of the deadline is used up; the fallback goes next without a pause
+                continue
+            if attempt >= policy.max_attempts:
+                if not policy.fallback_model or model == policy.fallback_model:
+                    raise
+                model, attempt = _fall_back(site, policy, "errors"), 0
+                continue
+            delay = _backoff(attempt)
+            if left is not None and delay >= left:
+                raise _deadline_exceeded(site) from exc
+            llm_retries.inc(site)
+            upstream_stats["retries"] += 1
+            await asyncio.sleep(delay)
+    if usage is not None and completion_usage is not None:
+        usage["prompt_tokens"] = completion_usage.prompt_tokens
+        usage["completion_tokens"] = completion_usage.completion_tokens
+    return response_dict, model
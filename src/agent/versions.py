@@ -0,0 +1,330 @@
+""" Model version history with content-addressed structural sharing. """
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+VERSION_MAX_PER_MODEL = int(os.getenv("VERSION_MAX_PER_MODEL", "50"))
+VERSION_MAX_MODELS = int(os.getenv("VERSION_MAX_MODELS", "10000"))
+# Materialized models kept for materialize(), by content hash
+VERSION_CACHE_SIZE = int(os.getenv("VERSION_CACHE_SIZE", "256"))
+
+
+def _hash(value: Any) -> str:
+    payload = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class _Blobs:
+    """Reference-counted hash -> value store."""
+
+    def __init__(self):
+        self._entries: Dict[str, list] = {}
+
+    def add(self, key: str, value: Any) -> bool:
+        """Store ``value`` under ``key`` or add a reference; True when it was new."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = [value, 1]
+            return True
+        entry[1] += 1
+        return False
+
+    def retain(self, key: str):
+        self._entries[key][1] += 1
+
+    def __getitem__(self, key: str) -> Any:
+        return self._entries[key][0]
+
+    def release(self, key: str) -> Optional[Any]:
+        """Drop one reference; return the value when it was the last one."""
+        entry = self._entries[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._entries[key]
+            return entry[0]
+        return None
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ModelVersion(NamedTuple):
+    version: int
+    hash: str
+    # Model fields other than entities and relationships (id, name, message)
+    fields: Dict[str, Any]
+    entities: Tuple[str, ...]
+    relationships: Tuple[str, ...]
+    # Version this one was derived from; undo goes back to it
+    parent: Optional[int]
+    created: float
+
+
+def _changed_fields(old: Dict[str, Any], new: Dict[str, Any], skip: str = "") -> List[str]:
+    return sorted(k for k in old.keys() | new.keys() if k != skip and old.get(k) != new.get(k))
+
+
+def _diff_ids(old: Dict[str, str], new: Dict[str, str]) -> Tuple[List[str], List[str], List[str]]:
+    """Split ids into added, removed and changed; ids with equal hashes are skipped."""
+    added = [i for i in new if i not in old]
+    removed = [i for i in old if i not in new]
+    changed = [i for i in new if i in old and old[i] != new[i]]
+    return added, removed, changed
+
+
+class ModelVersionStore:
+    """Per-user version history of logical data models, keyed by model id.
+
+    Attributes, entities and relationships are stored once under their
+    content hash and shared by every version (and every user) that contains
+    them; an entity's hash covers its attribute hashes, so a version costs
+    one tuple of hashes plus whatever actually changed. Unchanged subtrees
+    have equal hashes, which lets diffs skip them without looking inside.
+    History is kept per process and bounded by ``max_versions`` per model
+    and an LRU over ``max_models`` models.
+
+    Other holders (the in-memory chat history) keep versions as
+    :class:`ModelVersion` references from :meth:`checkout`; their blobs stay
+    alive until :meth:`release`, even once the version has been trimmed.
+    The ``cache_size`` most recently materialized references are memoized.
+    """
+
+    def __init__(self, max_versions: int = VERSION_MAX_PER_MODEL, max_models: int = VERSION_MAX_MODELS, cache_size: int = VERSION_CACHE_SIZE):
+        self.max_versions = max_versions
+        self.max_models = max_models
+        self.cache_size = cache_size
+        # model hash -> materialized model, shared by materialize() callers; most recently used last
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # (user_id, model_id) -> versions, oldest first; most recently used last
+        self._models: "OrderedDict[Tuple[str, str], List[ModelVersion]]" = OrderedDict()
+        self._attributes = _Blobs()
+        # entity hash -> (fields with an "attributes" placeholder, attribute hashes)
+        self._entities = _Blobs()
+        self._relationships = _Blobs()
+        self._lock = threading.Lock()
+
+    def _store_entity(self, entity: Dict[str, Any]) -> str:
+        attribute_hashes = tuple(_hash(a) for a in entity.get("attributes") or [])
+        fields = {k: (None if k == "attributes" else v) for k, v in entity.items()}
+        key = _hash([fields, attribute_hashes])
+        if self._entities.add(key, (fields, attribute_hashes)):
+            for attribute, attribute_hash in zip(entity.get("attributes") or [], attribute_hashes):
+                self._attributes.add(attribute_hash, dict(attribute))
+        return key
+
+    def _retain(self, version: ModelVersion):
+        for key in version.entities:
+            self._entities.retain(key)
+        for key in version.relationships:
+            self._relationships.retain(key)
+
+    def _release(self, version: ModelVersion):
+        for key in version.entities:
+            entity = self._entities.release(key)
+            if entity is not None:
+                for attribute_hash in entity[1]:
+                    self._attributes.release(attribute_hash)
+        for key in version.relationships:
+            self._relationships.release(key)
+
+    def _commit(self, user_id: str, model: Dict[str, Any]) -> ModelVersion:
+        key = (user_id, model["id"])
+        versions = self._models.pop(key, [])
+        self._models[key] = versions
+        entities = tuple(self._store_entity(e) for e in model.get("entities") or [])
+        relationships = []
+        for relationship in model.get("relationships") or []:
+            relationship_hash = _hash(relationship)
+            self._relationships.add(relationship_hash, dict(relationship))
+            relationships.append(relationship_hash)
+        fields = {k: v for k, v in model.items() if k not in ("entities", "relationships")}
+        model_hash = _hash([fields, entities, relationships])
+        version = ModelVersion(
+            versions[-1].version + 1 if versions else 1, model_hash, fields, entities, tuple(relationships),
+            versions[-1].version if versions else None, time.time(),
+        )
+        if versions and versions[-1].hash == model_hash:
+            self._release(version)
+            return versions[-1]
+        versions.append(version)
+        self._trim(key)
+        return version
+
+    def commit(self, user_id: str, model: Dict[str, Any]) -> int:
+        """Record ``model`` as the newest version of its id and return the version number.
+
+        Committing content identical to the newest version returns that version.
+        """
+        with self._lock:
+            return self._commit(user_id, model).version
+
+    def checkout(self, user_id: str, model: Dict[str, Any]) -> ModelVersion:
+        """Commit ``model`` and return a reference to its version that is kept until :meth:`release`."""
+        with self._lock:
+            version = self._commit(user_id, model)
+            self._retain(version)
+            return version
+
+    def materialize(self, ref: ModelVersion) -> Dict[str, Any]:
+        """Return the model behind a reference from :meth:`checkout`.
+
+        The dict is memoized and shared with other callers, so treat it as read-only.
+        """
+        with self._lock:
+            model = self._cache.get(ref.hash)
+            if model is not None:
+                self._cache.move_to_end(ref.hash)
+                return model
+            model = self._cache[ref.hash] = self._materialize(ref)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return model
+
+    def release(self, ref: ModelVersion):
+        """Drop a reference from :meth:`checkout`."""
+        with self._lock:
+            self._release(ref)
+
+    def revert(self, user_id: str, model_id: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """Undo: make the parent of the newest version the newest version again.
+
+        The new version reuses the parent's hashes, so nothing is copied.
+        Returns (new version number, model), or None when there is nothing to undo.
+        """
+        with self._lock:
+            versions = self._models.get((user_id, model_id))
+            if not versions or versions[-1].parent is None:
+                return None
+            target = next((v for v in versions if v.version == versions[-1].parent), None)
+            if target is None:
+                return None
+            self._retain(target)
+            version = target._replace(version=versions[-1].version + 1, created=time.time())
+            versions.append(version)
+            self._trim((user_id, model_id))
+            return version.version, self._materialize(version)
+
+    def _trim(self, key: Tuple[str, str]):
+        versions = self._models[key]
+        while len(versions) > self.max_versions:
+            self._release(versions.pop(0))
+        while len(self._models) > self.max_models:
+            _, dropped = self._models.popitem(last=False)
+            for version in dropped:
+                self._release(version)
+
+    def _find(self, user_id: str, model_id: str, version: int) -> Optional[ModelVersion]:
+        for v in self._models.get((user_id, model_id), []):
+            if v.version == version:
+                return v
+        return None
+
+    def _materialize(self, version: ModelVersion) -> Dict[str, Any]:
+        entities = []
+        for key in version.entities:
+            fields, attribute_hashes = self._entities[key]
+            attributes = [dict(self._attributes[h]) for h in attribute_hashes]
+            entities.append({k: (attributes if k == "attributes" else v) for k, v in fields.items()})
+        model = dict(version.fields)
+        model["entities"] = entities
+        model["relationships"] = [dict(self._relationships[h]) for h in version.relationships]
+        return model
+
+    def versions(self, user_id: str, model_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {"version": v.version, "hash": v.hash, "name": v.fields.get("name"), "parent": v.parent,
+                 "entities": len(v.entities), "relationships": len(v.relationships), "created": v.created}
+                for v in self._models.get((user_id, model_id), [])
+            ]
+
+    def latest_version(self, user_id: str, model_id: str) -> Optional[int]:
+        with self._lock:
+            versions = self._models.get((user_id, model_id))
+            return versions[-1].version if versions else None
+
+    def get(self, user_id: str, model_id: str, version: int) -> Optional[Dict[str, Any]]:
+        """Return a fresh copy of the model at ``version``, or None if it is not kept."""
+        with self._lock:
+            found = self._find(user_id, model_id, version)
+            return self._materialize(found) if found is not None else None
+
+    def diff(self, user_id: str, model_id: str, old: int, new: int) -> Optional[Dict[str, Any]]:
+        """Structural diff from version ``old`` to ``new``, or None if either is not kept.
+
+        Entities and relationships are matched by id; those whose hashes are
+        equal are skipped, and attributes are only compared inside entities
+        whose hash changed.
+        """
+        with self._lock:
+            a, b = self._find(user_id, model_id, old), self._find(user_id, model_id, new)
+            if a is None or b is None:
+                return None
+            result = {
+                "model_id": model_id,
+                "from": old,
+                "to": new,
+                "changed_fields": _changed_fields(a.fields, b.fields),
+                "entities": {"added": [], "removed": [], "changed": []},
+                "relationships": {"added": [], "removed": [], "changed": []},
+            }
+            if a.hash == b.hash:
+                return result
+
+            entities_a = {self._entities[k][0]["id"]: k for k in a.entities}
+            entities_b = {self._entities[k][0]["id"]: k for k in b.entities}
+            added, removed, changed = _diff_ids(entities_a, entities_b)
+            result["entities"]["added"], result["entities"]["removed"] = added, removed
+            for entity_id in changed:
+                fields_a, attributes_a = self._entities[entities_a[entity_id]]
+                fields_b, attributes_b = self._entities[entities_b[entity_id]]
+                by_id_a = {self._attributes[h]["id"]: h for h in attributes_a}
+                by_id_b = {self._attributes[h]["id"]: h for h in attributes_b}
+                attributes_added, attributes_removed, attributes_changed = _diff_ids(by_id_a, by_id_b)
+                result["entities"]["changed"].append({
+                    "id": entity_id,
+                    "fields": _changed_fields(fields_a, fields_b, skip="attributes"),
+                    "attributes": {
+                        "added": attributes_added,
+                        "removed": attributes_removed,
+                        "changed": [
+                            {"id": i, "fields": _changed_fields(self._attributes[by_id_a[i]], self._attributes[by_id_b[i]])}
+                            for i in attributes_changed
+                        ],
+                    },
+                })
+
+            relationships_a = {self._relationships[k]["id"]: k for k in a.relationships}
+            relationships_b = {self._relationships[k]["id"]: k for k in b.relationships}
+            added, removed, changed = _diff_ids(relationships_a, relationships_b)
+            result["relationships"]["added"], result["relationships"]["removed"] = added, removed
+            result["relationships"]["changed"] = [
+                {"id": i, "fields": _changed_fields(self._relationships[relationships_a[i]], self._relationships[relationships_b[i]])}
+                for i in changed
+            ]
+            return result
+
+    def reset(self, user_id: str):
+        with self._lock:
+            for key in [k for k in self._models if k[0] == user_id]:
+                for version in self._models.pop(key):
+                    self._release(version)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "models": len(self._models),
+                "versions": sum(len(v) for v in self._models.values()),
+                "entity_blobs": len(self._entities),
+                "attribute_blobs": len(self._attributes),
+                "relationship_blobs": len(self._relationships),
+                "cached_models": len(self._cache),
+            }
+
+
+model_versions = ModelVersionStore()
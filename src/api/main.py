@@ -1,11 +1,239 @@
-import requests as re 
+""" Source-system metadata: a pooled async client with a TTL cache, and prompt context refreshed in the background.
 
+The metadata service is expected to expose:
 
-def get_systems_info():
-    pass 
+    GET /environment                  -> {"id": ...}               (the current environment)
+    GET /environments/{environment_id} -> {"id", "name", "systems": [system id or {"id": ...}, ...]}
+    GET /systems/{system_id}          -> {"id", "name", "type", "tables": [{"name", "columns": [{"name", "type"}, ...]}, ...]}
 
-def get_environment_id():
-    pass 
+Point METADATA_BASE_URL at it (or at benchmarks/stub_server.py, which serves
+canned metadata); leaving it empty turns the feature off.
+"""
 
-def get_environment_info():
-    pass
\ No newline at end of file
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from src.agent.cache import MemoryCacheBackend, ResponseCache
+from src.prompts.main import SOURCE_CONTEXT_PROMPT
+
+logger = logging.getLogger(__name__)
+
+METADATA_BASE_URL = os.getenv("METADATA_BASE_URL", "")
+METADATA_API_KEY = os.getenv("METADATA_API_KEY")
+# Skips the GET /environment lookup when set
+METADATA_ENVIRONMENT_ID = os.getenv("METADATA_ENVIRONMENT_ID")
+METADATA_TTL_SECONDS = float(os.getenv("METADATA_TTL_SECONDS", "300"))
+# How often the prompt context is rebuilt; not shorter than the TTL, or refreshes only see cached data
+METADATA_REFRESH_SECONDS = float(os.getenv("METADATA_REFRESH_SECONDS", "300"))
+METADATA_TIMEOUT = float(os.getenv("METADATA_TIMEOUT", "10"))
+METADATA_MAX_CONNECTIONS = int(os.getenv("METADATA_MAX_CONNECTIONS", "20"))
+# System fetches running at the same time
+METADATA_CONCURRENCY = int(os.getenv("METADATA_CONCURRENCY", "8"))
+# Size limits of the compact prompt context
+METADATA_CONTEXT_CHARS = int(os.getenv("METADATA_CONTEXT_CHARS", "4000"))
+METADATA_MAX_COLUMNS = int(os.getenv("METADATA_MAX_COLUMNS", "12"))
+
+
+class MetadataClient:
+    """Async client for the metadata service over one pooled connection set.
+
+    Responses are cached for ``ttl_seconds`` and concurrent requests for
+    the same path share one fetch (single flight), so any number of chats
+    asking for the same metadata cause at most one request per TTL.
+    """
+
+    def __init__(self, base_url: str, api_key: Optional[str] = None, ttl_seconds: float = METADATA_TTL_SECONDS,
+                 timeout: float = METADATA_TIMEOUT, max_connections: int = METADATA_MAX_CONNECTIONS,
+                 concurrency: int = METADATA_CONCURRENCY):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.concurrency = concurrency
+        self.cache = ResponseCache(MemoryCacheBackend(ttl_seconds=ttl_seconds), enabled=True)
+        self.fetches = 0
+        self.errors = 0
+        self._http: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.base_url)
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            with self._lock:
+                if self._http is None:
+                    self._http = httpx.AsyncClient(
+                        base_url=self.base_url,
+                        headers={"Authorization": f"Bearer {self.api_key}"} if self.api_key else None,
+                        limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                        timeout=httpx.Timeout(self.timeout),
+                    )
+        return self._http
+
+    async def get_json(self, path: str) -> Any:
+        """GET ``path`` as JSON through the cache; raises httpx errors on failure."""
+
+        async def fetch():
+            self.fetches += 1
+            try:
+                response = await self._client().get(path)
+                response.raise_for_status()
+                return response.json()
+            except Exception:
+                self.errors += 1
+                raise
+
+        return await self.cache.get_or_call(path, fetch)
+
+    async def get_environment_id(self) -> str:
+        return str((await self.get_json("/environment"))["id"])
+
+    async def get_environment_info(self, environment_id: str) -> Dict[str, Any]:
+        return await self.get_json(f"/environments/{environment_id}")
+
+    async def get_systems_info(self, system_ids: List[str]) -> List[Dict[str, Any]]:
+        """Fetch several systems concurrently; systems that fail are logged and left out."""
+        gate = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(system_id: str):
+            async with gate:
+                return await self.get_json(f"/systems/{system_id}")
+
+        results = await asyncio.gather(*(fetch(s) for s in system_ids), return_exceptions=True)
+        systems = []
+        for system_id, result in zip(system_ids, results):
+            if isinstance(result, BaseException):
+                logger.warning("metadata for system %s unavailable: %s", system_id, result)
+            else:
+                systems.append(result)
+        return systems
+
+    async def close(self):
+        with self._lock:
+            http, self._http = self._http, None
+        if http is not None:
+            await http.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        cache = self.cache.stats()
+        return {"fetches": self.fetches, "errors": self.errors, "cache_hits": cache["hits"], "coalesced": cache["coalesced"]}
+
+
+def _system_ids(environment: Dict[str, Any]) -> List[str]:
+    return [str(s["id"] if isinstance(s, dict) else s) for s in environment.get("systems") or []]
+
+
+def compact_systems(systems: List[Dict[str, Any]], limit: int = METADATA_CONTEXT_CHARS, max_columns: int = METADATA_MAX_COLUMNS) -> str:
+    """One line per system, ``name (type): table(column:type, ...); ...``, cut off at ``limit`` characters."""
+    lines = []
+    size = 0
+    for system in systems:
+        tables = []
+        for table in system.get("tables") or []:
+            columns = [f"{c['name']}:{c['type']}" if c.get("type") else c["name"] for c in (table.get("columns") or [])[:max_columns]]
+            if len(table.get("columns") or []) > max_columns:
+                columns.append("...")
+            tables.append(f"{table['name']}({', '.join(columns)})")
+        kind = f" ({system['type']})" if system.get("type") else ""
+        line = f"{system.get('name') or system.get('id')}{kind}: {'; '.join(tables) or 'no tables'}"
+        if size + len(line) > limit:
+            if size + 4 <= limit:
+                lines.append("...")
+            break
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)
+
+
+class SourceContext:
+    """Compact source-system context for the generator prompt, rebuilt in the background.
+
+    Chat turns read ``text`` without any HTTP request; a background task
+    refreshes it every ``refresh_seconds``. When a refresh fails the previous
+    context is kept.
+    """
+
+    def __init__(self, client: MetadataClient, environment_id: Optional[str] = METADATA_ENVIRONMENT_ID,
+                 refresh_seconds: float = METADATA_REFRESH_SECONDS):
+        self.client = client
+        self.environment_id = environment_id
+        self.refresh_seconds = refresh_seconds
+        self.text: Optional[str] = None
+        self.systems = 0
+        self.updated: Optional[float] = None
+        self.refreshes = 0
+        self.failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh(self) -> Optional[str]:
+        environment_id = self.environment_id or await self.client.get_environment_id()
+        environment = await self.client.get_environment_info(environment_id)
+        systems = await self.client.get_systems_info(_system_ids(environment))
+        compact = compact_systems(systems)
+        self.text = SOURCE_CONTEXT_PROMPT + compact if compact else None
+        self.systems = len(systems)
+        self.updated = time.time()
+        self.refreshes += 1
+        return self.text
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as exc:
+                self.failures += 1
+                logger.warning("source system metadata refresh failed: %s", exc)
+            await asyncio.sleep(self.refresh_seconds)
+
+    def start(self):
+        """Start refreshing in the background (no-op when the metadata service is not configured)."""
+        if self.client.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.client.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.client.enabled,
+            "systems": self.systems,
+            "context_chars": len(self.text or ""),
+            "age_seconds": time.time() - self.updated if self.updated is not None else None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            **self.client.stats(),
+        }
+
+
+metadata_client = MetadataClient(METADATA_BASE_URL, METADATA_API_KEY)
+source_context = SourceContext(metadata_client)
+
+
+async def get_environment_id() -> str:
+    return METADATA_ENVIRONMENT_ID or await metadata_client.get_environment_id()
+
+
+async def get_environment_info(environment_id: Optional[str] = None) -> Dict[str, Any]:
+    return await metadata_client.get_environment_info(environment_id or await get_environment_id())
+
+
+async def get_systems_info(system_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Metadata for ``system_ids``, by default every system of the current environment."""
+    if system_ids is None:
+        system_ids = _system_ids(await get_environment_info())
+    return await metadata_client.get_systems_info(system_ids)
@@ -0,0 +1,138 @@
+""" Token-budgeted prompt assembly with history compaction. """
+
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from src.prompts.main import SYSTEM_PROMPT, INTENT_PROMPT
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "12000"))
+INTENT_TOKEN_BUDGET = int(os.getenv("INTENT_TOKEN_BUDGET", "1500"))
+PROMPT_RECENT_MESSAGES = int(os.getenv("PROMPT_RECENT_MESSAGES", "6"))
+INTENT_RECENT_MESSAGES = int(os.getenv("INTENT_RECENT_MESSAGES", "4"))
+SUMMARY_CHARS = int(os.getenv("PROMPT_SUMMARY_CHARS", "200"))
+
+# Per-message overhead of the chat format (role markers etc.)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken is optional; fall back to a character estimate
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken when installed, otherwise estimate ~4 characters per token."""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def dump_model(model: Dict[str, Any]) -> str:
+    """Compact JSON for a model; key order is kept so identical models serialize identically.
+
+    Entity positions are left out: layout happens server-side after
+    generation and would only cost prompt tokens.
+    """
+    model = dict(model, entities=[{k: v for k, v in e.items() if k != "position"} for e in model.get("entities") or []])
+    return json.dumps(model, separators=(",", ":"))
+
+
+def summarize_model(model: Dict[str, Any], label: str = "Superseded model") -> str:
+    entities = model.get("entities") or []
+    names = ", ".join(e.get("name", "?") for e in entities[:12])
+    if len(entities) > 12:
+        names += f", ... (+{len(entities) - 12} more)"
+    return (
+        f"[{label} '{model.get('name')}' (id {model.get('id')}): "
+        f"{len(entities)} entities ({names}), {len(model.get('relationships') or [])} relationships]"
+    )
+
+
+def summarize_text(text: str, limit: int = SUMMARY_CHARS) -> str:
+    if len(text) <= limit:
+        return text
+    return text[:limit].rstrip() + " ..."
+
+
+def _latest_model_index(history: List[Dict[str, Any]]) -> int:
+    for i in range(len(history) - 1, -1, -1):
+        if history[i]["role"] == "assistant" and isinstance(history[i]["content"], dict):
+            return i
+    return -1
+
+
+def _fit(prefix: List[Dict[str, str]], body: List[Dict[str, str]], pinned: int, budget: int, reserve: int) -> List[Dict[str, str]]:
+    """Drop the oldest body messages (never ``pinned``) until the prompt fits ``budget``."""
+    sizes = [message_tokens(m) for m in body]
+    total = sum(message_tokens(m) for m in prefix) + sum(sizes) + reserve
+    keep = [True] * len(body)
+    for i in range(len(body)):
+        if total <= budget:
+            break
+        if i == pinned:
+            continue
+        keep[i] = False
+        total -= sizes[i]
+    return prefix + [m for m, k in zip(body, keep) if k]
+
+
+def build_model_messages(
+    history: List[Dict[str, Any]],
+    query: str,
+    budget: int = PROMPT_TOKEN_BUDGET,
+    recent: int = PROMPT_RECENT_MESSAGES,
+    context: Optional[str] = None,
+) -> List[Dict[str, str]]:
+    """Build the generator prompt for ``query`` from the stored ``history``.
+
+    ``SYSTEM_PROMPT`` always comes first and unchanged so upstream prompt
+    caching can reuse it; ``context`` (e.g. source-system metadata), which
+    changes rarely, follows as a second system message. Only the latest logical model is sent in full;
+    superseded models become one-line summaries and conversational turns
+    older than the last ``recent`` messages are truncated. The oldest
+    messages are then dropped until the prompt (including ``query``, which
+    the generator appends) fits ``budget`` tokens.
+    """
+    latest = _latest_model_index(history)
+    cutoff = len(history) - recent
+    body = []
+    for i, m in enumerate(history):
+        content = m["content"]
+        if isinstance(content, dict):
+            content = dump_model(content) if i == latest else summarize_model(content)
+        elif i < cutoff:
+            content = summarize_text(content)
+        body.append({"role": m["role"], "content": content})
+    prefix = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if context:
+        prefix.append({"role": "system", "content": context})
+    reserve = count_tokens(query) + MESSAGE_OVERHEAD_TOKENS
+    return _fit(prefix, body, latest, budget, reserve)
+
+
+def build_intent_messages(history: List[Dict[str, Any]], query: str, budget: int = INTENT_TOKEN_BUDGET, recent: int = INTENT_RECENT_MESSAGES) -> List[Dict[str, str]]:
+    """Build the much smaller intent-classifier prompt.
+
+    The classifier only needs to know what was said recently and whether a
+    model exists, so every model is replaced by its summary and only the
+    last ``recent`` messages are kept.
+    """
+    latest = _latest_model_index(history)
+    start = max(len(history) - recent, 0)
+    body = []
+    for i in range(start, len(history)):
+        content = history[i]["content"]
+        if isinstance(content, dict):
+            content = summarize_model(content, "Current model" if i == latest else "Superseded model")
+        else:
+            content = summarize_text(content)
+        body.append({"role": history[i]["role"], "content": content})
+    prefix = [{"role": "system", "content": INTENT_PROMPT}]
+    reserve = count_tokens(query) + MESSAGE_OVERHEAD_TOKENS
+    return _fit(prefix, body, -1, budget, reserve)
@@ -80,4 +80,52 @@ YOU ONLY HAVE TWO APPRIOPRAITE RESPONSES
 2. MODEL 
 
 based on the intent you classified 
-"""
\ No newline at end of file
+"""
+
+DELTA_PROMPT = """
+DELTA UPDATE MODE:
+For this turn only, do NOT return the complete model. The most recent assistant model message is the current logical data model. Return only the
+changes needed to satisfy the user's request as a JSON object containing:
+  - A `message` being your conversational response to the user
+  - A list of `operations`, each with:
+    - `op`: one of "add", "remove" or "replace"
+    - `path`: a JSON pointer that addresses entities, attributes and relationships by their `id`, not by position:
+      - /name
+      - /entities/- (add a new entity)
+      - /entities/<entity_id> (remove or replace an entity)
+      - /entities/<entity_id>/name
+      - /entities/<entity_id>/attributes/- (add a new attribute)
+      - /entities/<entity_id>/attributes/<attribute_id> (remove or replace an attribute)
+      - /entities/<entity_id>/attributes/<attribute_id>/<field> (e.g. name, type, isPrimaryKey, isForeignKey)
+      - /relationships/- (add a new relationship)
+      - /relationships/<relationship_id> (remove or replace a relationship)
+      - /relationships/<relationship_id>/<field> (e.g. name, type, fromEntity, toEntity)
+    - `value`: for "add" and "replace", the new value encoded as a JSON string (e.g. "\\"customer_email\\"", "true", or a full entity object);
+      omit it for "remove"
+- New entities, attributes and relationships must follow the same structure and naming convention as the existing model.
+- Keep referential consistency: when removing an entity, also remove its relationships and foreign keys.
+- Return only the operations required; never restate unchanged parts of the model.
+"""
+
+REPAIR_PROMPT = """
+REPAIR MODE:
+A local validator found referential-integrity problems in the current logical data model. The model itself is not repeated here; the user message
+is a JSON list of findings, each with:
+  - `rule`: the problem (duplicate_entity_id, duplicate_attribute_id, duplicate_relationship_id, unknown_entity, missing_primary_key,
+    orphan_foreign_key, unrelated_foreign_key)
+  - `path`: the id-addressed path of the offending element, in the same format as patch operation paths
+  - `message`: a description naming the ids, names and attributes involved
+Return patch operations in the DELTA UPDATE MODE format that fix exactly these findings, for example:
+  - missing_primary_key: add a primary key attribute at /entities/<entity_id>/attributes/-
+  - unknown_entity: replace the relationship endpoint with an existing entity id, or remove the relationship
+  - orphan_foreign_key / unrelated_foreign_key: add the missing relationship at /relationships/-, or clear isForeignKey
+  - duplicate ids: replace the id of the later element
+Do not touch anything the findings do not mention. Set `message` to a one-sentence summary of the fixes.
+"""
+
+SOURCE_CONTEXT_PROMPT = """
+SOURCE SYSTEMS:
+The organisation's existing source systems are listed below, one per line, as `system (type): table(column:type, ...); ...`.
+Where the user's requirements cover data held in these systems, reuse their table and column names and types for the matching
+entities and attributes. Do not add entities for source tables the requirements do not call for.
+"""
@@ -0,0 +1,276 @@
+""" Incremental diagram layout (layered and force-directed) for logical data models. """
+
+import math
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# Diagram metrics in pixels; an entity box grows with its attribute count
+ENTITY_WIDTH = 240
+HEADER_HEIGHT = 40
+ROW_HEIGHT = 24
+# Preferred gap between the boxes of related entities
+EDGE_GAP = 100.0
+LAYOUT_ITERATIONS = 40
+MARGIN = 40
+# Above this many new entities the pairwise settling pass costs more than it is
+# worth; they are laid out in layers beside the existing diagram instead
+INCREMENTAL_LIMIT = 100
+
+_GOLDEN_ANGLE = math.pi * (3 - math.sqrt(5))
+
+
+def entity_size(entity: Dict[str, Any]) -> tuple:
+    return ENTITY_WIDTH, HEADER_HEIGHT + ROW_HEIGHT * len(entity.get("attributes") or [])
+
+
+def _position(entity: Optional[Dict[str, Any]]):
+    position = entity.get("position") if entity else None
+    if position is None:
+        return None
+    return (position["x"], position["y"]) if isinstance(position, dict) else (position.x, position.y)
+
+
+def _neighbours(n: int, edges: List[tuple]) -> List[List[int]]:
+    neighbours: List[List[int]] = [[] for _ in range(n)]
+    for a, b in edges:
+        neighbours[a].append(b)
+        neighbours[b].append(a)
+    return neighbours
+
+
+def _seed(centers: np.ndarray, placed: np.ndarray, neighbours: List[List[int]], cell: float):
+    """Give every unplaced entity a starting point next to its placed neighbours.
+
+    Entities are visited breadth-first from the placed ones, so a chain of new
+    entities grows outwards from the part of the diagram it attaches to.
+    Entities with no placed neighbour start a new cluster on a grid to the
+    right of everything placed so far.
+    """
+    n = len(centers)
+    pending = [i for i in range(n) if not placed[i]]
+    if placed.any():
+        origin_x = centers[placed, 0].max() + cell
+        origin_y = centers[placed, 1].min()
+    else:
+        origin_x = origin_y = 0.0
+    columns = max(1, math.ceil(math.sqrt(len(pending))))
+    clusters = 0
+    queue = deque(i for i in range(n) if placed[i])
+    seen = placed.copy()
+
+    def place(i: int, step: int):
+        anchors = [j for j in neighbours[i] if placed[j]]
+        if anchors:
+            angle = _GOLDEN_ANGLE * step
+            centers[i] = centers[anchors].mean(axis=0) + cell * np.array([math.cos(angle), math.sin(angle)])
+        else:
+            nonlocal clusters
+            centers[i] = (origin_x + (clusters % columns) * cell * 2, origin_y + (clusters // columns) * cell * 2)
+            clusters += 1
+        placed[i] = True
+
+    step = 0
+    for root in pending + [None]:
+        while queue:
+            current = queue.popleft()
+            for j in neighbours[current]:
+                if not seen[j]:
+                    seen[j] = True
+                    step += 1
+                    place(j, step)
+                    queue.append(j)
+        if root is not None and not seen[root]:
+            seen[root] = True
+            place(root, step)
+            queue.append(root)
+
+
+def _layered(sizes: np.ndarray, edges: List[tuple]) -> np.ndarray:
+    """Left-to-right layered placement used when nothing is placed yet.
+
+    Layers are breadth-first depths along relationship direction; entities in
+    a layer are ordered by the barycentre of their neighbours in the previous
+    layer and stacked by height. Layers taller than the target diagram height
+    wrap into extra columns so star-shaped models stay roughly square.
+    """
+    n = len(sizes)
+    neighbours = _neighbours(n, edges)
+    children: List[List[int]] = [[] for _ in range(n)]
+    has_parent = np.zeros(n, dtype=bool)
+    for a, b in edges:
+        children[a].append(b)
+        has_parent[b] = True
+
+    depth = np.full(n, -1, dtype=np.intp)
+    queue = deque()
+    for root in [i for i in range(n) if not has_parent[i]] + list(range(n)):
+        if depth[root] < 0:
+            depth[root] = 0
+            queue.append(root)
+        while queue:
+            current = queue.popleft()
+            for j in children[current]:
+                if depth[j] < 0:
+                    depth[j] = depth[current] + 1
+                    queue.append(j)
+
+    layers: List[List[int]] = [[] for _ in range(int(depth.max()) + 1)]
+    for i in range(n):
+        layers[depth[i]].append(i)
+    rank = np.zeros(n, dtype=np.float32)
+    for layer in layers:
+        for r, i in enumerate(layer):
+            rank[i] = r
+    for d in range(1, len(layers)):
+        def barycentre(i: int) -> float:
+            above = [rank[j] for j in neighbours[i] if depth[j] == d - 1]
+            return sum(above) / len(above) if above else rank[i]
+        layers[d].sort(key=barycentre)
+        for r, i in enumerate(layers[d]):
+            rank[i] = r
+
+    column_width = ENTITY_WIDTH + EDGE_GAP
+    area = float(((sizes[:, 0] + EDGE_GAP) * (sizes[:, 1] + EDGE_GAP / 2)).sum())
+    max_height = max(float(sizes[:, 1].max()), math.sqrt(area))
+    centers = np.zeros((n, 2), dtype=np.float32)
+    column = 0
+    for layer in layers:
+        y = 0.0
+        for i in layer:
+            if y > 0 and y + sizes[i, 1] > max_height:
+                column += 1
+                y = 0.0
+            centers[i] = (column * column_width + sizes[i, 0] / 2, y + sizes[i, 1] / 2)
+            y += sizes[i, 1] + EDGE_GAP / 2
+        column += 1
+    return centers
+
+
+def layout_model(model: Dict[str, Any], previous: Optional[Dict[str, Any]] = None, iterations: int = LAYOUT_ITERATIONS) -> Dict[str, Any]:
+    """Fill in ``position`` for every entity of ``model`` (in place) and return it.
+
+    Entities that already have a position, in ``model`` or under the same id
+    in ``previous``, keep it; only the others are placed. A model with no
+    positions at all gets a layered layout, and so do more than
+    INCREMENTAL_LIMIT new entities (beside the existing diagram). Otherwise
+    new entities are seeded next to their related entities and settled with
+    a vectorized Fruchterman-Reingold pass in which box sizes count towards
+    the distance between entities, so large entities get more room.
+    """
+    entities = model.get("entities") or []
+    n = len(entities)
+    if n == 0:
+        return model
+    earlier = {e["id"]: e for e in (previous or {}).get("entities") or []}
+    index = {e["id"]: i for i, e in enumerate(entities)}
+
+    sizes = np.array([entity_size(e) for e in entities], dtype=np.float32)
+    centers = np.zeros((n, 2), dtype=np.float32)
+    pinned = np.zeros(n, dtype=bool)
+    for i, entity in enumerate(entities):
+        position = _position(entity) or _position(earlier.get(entity["id"]))
+        if position is not None:
+            pinned[i] = True
+            centers[i] = (position[0] + sizes[i, 0] / 2, position[1] + sizes[i, 1] / 2)
+
+    edges = [
+        (index[r["fromEntity"]], index[r["toEntity"]])
+        for r in model.get("relationships") or []
+        if r.get("fromEntity") in index and r.get("toEntity") in index and r["fromEntity"] != r["toEntity"]
+    ]
+
+    movable = np.flatnonzero(~pinned)
+    if not pinned.any():
+        centers = _layered(sizes, edges) + MARGIN
+    elif len(movable) > INCREMENTAL_LIMIT:
+        local = {int(i): j for j, i in enumerate(movable)}
+        local_edges = [(local[a], local[b]) for a, b in edges if a in local and b in local]
+        offset = (
+            (centers[pinned, 0] + sizes[pinned, 0] / 2).max() + EDGE_GAP,
+            (centers[pinned, 1] - sizes[pinned, 1] / 2).min(),
+        )
+        centers[movable] = _layered(sizes[movable], local_edges) + np.array(offset, dtype=np.float32)
+    elif len(movable):
+        radius = np.hypot(sizes[:, 0], sizes[:, 1]) / 2
+        _seed(centers, pinned.copy(), _neighbours(n, edges), float(EDGE_GAP + 2 * radius.mean()))
+        _settle(centers, movable, radius, np.array(edges, dtype=np.intp).reshape(-1, 2), iterations)
+        _resolve_overlaps(centers, sizes, pinned, movable)
+    for i, entity in enumerate(entities):
+        if entity.get("position") is None:
+            entity["position"] = {"x": int(round(centers[i, 0] - sizes[i, 0] / 2)), "y": int(round(centers[i, 1] - sizes[i, 1] / 2))}
+    return model
+
+
+def _settle(centers: np.ndarray, movable: np.ndarray, radius: np.ndarray, edges: np.ndarray, iterations: int):
+    """Move the ``movable`` rows of ``centers`` towards a force equilibrium.
+
+    Distances are measured between box boundaries (centre distance minus
+    both radii), so repulsion k^2/d and attraction d^2/k balance when related
+    boxes are EDGE_GAP apart. Only rows for movable entities are computed,
+    which makes small refinements of large models cheap.
+    """
+    n = len(centers)
+    k = np.float32(EDGE_GAP)
+    is_movable = np.zeros(n, dtype=bool)
+    is_movable[movable] = True
+    edges = edges[is_movable[edges[:, 0]] | is_movable[edges[:, 1]]]
+    reach = radius[movable, None] + radius[None, :]
+    temperature = np.linspace(2 * k, k / 20, iterations, dtype=np.float32)
+
+    for t in temperature:
+        dx = centers[movable, None, 0] - centers[None, :, 0]
+        dy = centers[movable, None, 1] - centers[None, :, 1]
+        distance = np.maximum(np.sqrt(dx * dx + dy * dy), 1e-3)
+        # Repulsion k^2 / gap, pointing away from every other entity
+        scale = k * k / (np.maximum(distance - reach, 1.0) * distance)
+        force = np.zeros((n, 2), dtype=np.float32)
+        force[movable, 0] = (dx * scale).sum(axis=1)
+        force[movable, 1] = (dy * scale).sum(axis=1)
+
+        if len(edges):
+            # Attraction gap^2 / k along relationships
+            ex = centers[edges[:, 1], 0] - centers[edges[:, 0], 0]
+            ey = centers[edges[:, 1], 1] - centers[edges[:, 0], 1]
+            length = np.maximum(np.sqrt(ex * ex + ey * ey), 1e-3)
+            gap = np.maximum(length - radius[edges[:, 0]] - radius[edges[:, 1]], 0.0)
+            pull = gap * gap / (k * length)
+            for axis, component in ((0, ex * pull), (1, ey * pull)):
+                force[:, axis] += np.bincount(edges[:, 0], component, minlength=n)
+                force[:, axis] -= np.bincount(edges[:, 1], component, minlength=n)
+
+        step = force[movable]
+        norm = np.maximum(np.hypot(step[:, 0], step[:, 1]), 1e-3)
+        centers[movable] += step * (np.minimum(norm, t) / norm)[:, None]
+
+
+def _resolve_overlaps(centers: np.ndarray, sizes: np.ndarray, pinned: np.ndarray, movable: np.ndarray, attempts: int = 85):
+    """Move each new entity to the first point on a spiral where its box clears every placed box.
+
+    Candidates are tested in growing chunks (the current spot alone first)
+    against the placed boxes within the spiral's reach. When the
+    neighbourhood is packed, the entity goes just right of the diagram at
+    its current height instead.
+    """
+    clearance = EDGE_GAP / 4
+    steps = np.arange(attempts, dtype=np.float32)
+    spiral = (2 * clearance * np.sqrt(steps))[:, None] * np.stack([np.cos(_GOLDEN_ANGLE * steps), np.sin(_GOLDEN_ANGLE * steps)], axis=1)
+    spiral_radius = float(np.abs(spiral).max())
+    placed = pinned.copy()
+    for i in movable:
+        reach = (sizes[placed] + sizes[i]) / 2 + clearance
+        near = (np.abs(centers[placed] - centers[i]) < reach + spiral_radius).all(axis=1)
+        others, reach = centers[placed][near], reach[near]
+        offset, chunk = 0, 1
+        while offset < attempts:
+            candidates = centers[i] + spiral[offset:offset + chunk]
+            blocked = (np.abs(candidates[:, None, :] - others[None, :, :]) < reach[None, :, :]).all(axis=2).any(axis=1)
+            free = np.flatnonzero(~blocked)
+            if len(free):
+                centers[i] = candidates[free[0]]
+                break
+            offset, chunk = offset + chunk, chunk * 4
+        else:
+            centers[i, 0] = (centers[placed, 0] + sizes[placed, 0] / 2).max() + EDGE_GAP + sizes[i, 0] / 2
+        placed[i] = True
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Literal
 
 class Attribute(BaseModel):
     id: str
@@ -33,4 +33,11 @@ class LogicalDataModel(BaseModel):
     entities: List[Entity]
     relationships: List[Relationship]
 
-    
\ No newline at end of file
+class PatchOperation(BaseModel):
+    op: Literal["add", "remove", "replace"]
+    path: str = Field(..., description="Id-addressed JSON pointer, e.g. /entities/customer/attributes/customer_email/name or /entities/- to append.")
+    value: Optional[str] = Field(None, description="JSON-encoded value for add and replace operations.")
+
+class ModelPatch(BaseModel):
+    message: str
+    operations: List[PatchOperation]
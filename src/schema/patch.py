@@ -0,0 +1,104 @@
+""" Apply RFC 6902-style patches to a LogicalDataModel. """
+
+import json
+from typing import Any, Dict, List
+
+from pydantic import ValidationError
+
+from src.schema.main import LogicalDataModel, PatchOperation
+
+
+class PatchError(ValueError):
+    """Raised when a patch cannot be applied or yields an invalid model."""
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def _index(items: List[Any], item_id: str, path: str) -> int:
+    for i, item in enumerate(items):
+        if isinstance(item, dict) and item.get("id") == item_id:
+            return i
+    raise PatchError(f"{path}: no element with id {item_id!r}")
+
+
+def _get(node: Any, token: str, path: str) -> Any:
+    if isinstance(node, list):
+        return node[_index(node, token, path)]
+    if isinstance(node, dict) and token in node:
+        return node[token]
+    raise PatchError(f"{path}: {token!r} does not exist")
+
+
+def _set(node: Any, token: str, value: Any, path: str):
+    if isinstance(node, list):
+        node[_index(node, token, path)] = value
+    else:
+        node[token] = value
+
+
+def _copy(node: Any) -> Any:
+    return list(node) if isinstance(node, list) else dict(node) if isinstance(node, dict) else node
+
+
+def _apply(root: Dict[str, Any], operation: PatchOperation):
+    path = operation.path
+    if not path.startswith("/") or path == "/":
+        raise PatchError(f"{path}: paths must start with '/' and name a member")
+    tokens = [_unescape(t) for t in path[1:].split("/")]
+
+    # Copy only the containers along the path so the input model is never mutated
+    node = root
+    for token in tokens[:-1]:
+        child = _copy(_get(node, token, path))
+        _set(node, token, child, path)
+        node = child
+    last = tokens[-1]
+
+    value = None
+    if operation.op in ("add", "replace"):
+        if operation.value is None:
+            raise PatchError(f"{path}: {operation.op} requires a value")
+        try:
+            value = json.loads(operation.value)
+        except json.JSONDecodeError as exc:
+            raise PatchError(f"{path}: value is not valid JSON ({exc})") from exc
+
+    if operation.op == "add":
+        if isinstance(node, list):
+            if last != "-":
+                raise PatchError(f"{path}: add to a list must use '-'")
+            if isinstance(value, dict) and any(isinstance(i, dict) and i.get("id") == value.get("id") for i in node):
+                raise PatchError(f"{path}: id {value.get('id')!r} already exists")
+            node.append(value)
+        elif isinstance(node, dict):
+            node[last] = value
+        else:
+            raise PatchError(f"{path}: cannot add to a scalar")
+    elif operation.op == "remove":
+        if isinstance(node, list):
+            del node[_index(node, last, path)]
+        elif isinstance(node, dict) and last in node:
+            del node[last]
+        else:
+            raise PatchError(f"{path}: {last!r} does not exist")
+    else:
+        _get(node, last, path)
+        _set(node, last, value, path)
+
+
+def apply_patch(model: Dict[str, Any], operations: List[PatchOperation]) -> Dict[str, Any]:
+    """Apply ``operations`` to ``model`` and return the validated result.
+
+    Paths address list elements by their ``id`` rather than by position
+    (``/entities/customer/attributes/customer_email/name``), and ``-``
+    appends (``/entities/-``). The input model is left untouched.
+    """
+    result = dict(model)
+    for operation in operations:
+        _apply(result, operation)
+    try:
+        return LogicalDataModel.model_validate(result).model_dump()
+    except ValidationError as exc:
+        raise PatchError(f"patched model is invalid: {exc}") from exc
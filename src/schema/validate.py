@@ -0,0 +1,148 @@
+""" Referential-integrity checks for logical data models. """
+
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+ERROR = "error"
+WARNING = "warning"
+
+
+class Finding(NamedTuple):
+    rule: str
+    severity: str
+    # Id-addressed pointer in the same format as patch operation paths
+    path: str
+    message: str
+
+
+def _pointer(*tokens: str) -> str:
+    return "".join("/" + str(t).replace("~", "~0").replace("/", "~1") for t in tokens)
+
+
+def _key_name(name: str) -> str:
+    return str(name).strip().lower().replace(" ", "_").replace("-", "_")
+
+
+class ModelIndex:
+    """Hash indexes and an adjacency graph over a model dict, built in one pass.
+
+    ``entities`` and ``relationships`` map ids to the objects, ``attributes``
+    maps entity id -> attribute id -> attribute, and ``adjacency`` maps every
+    entity id to the ids it is related to (in either direction). Duplicate ids
+    are kept out of the indexes and reported as findings instead.
+    """
+
+    def __init__(self, model: Dict[str, Any]):
+        self.entities: Dict[str, Dict[str, Any]] = {}
+        self.attributes: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.relationships: Dict[str, Dict[str, Any]] = {}
+        self.adjacency: Dict[str, Set[str]] = {}
+        # Names a foreign key may use to refer to an entity -> entity ids
+        self.key_names: Dict[str, Set[str]] = {}
+        self.findings: List[Finding] = []
+
+        for entity in model.get("entities", []):
+            entity_id = entity["id"]
+            if entity_id in self.entities:
+                self.findings.append(Finding("duplicate_entity_id", ERROR, _pointer("entities", entity_id), f"entity id {entity_id!r} is used more than once"))
+                continue
+            self.entities[entity_id] = entity
+            self.adjacency[entity_id] = set()
+            attributes = self.attributes[entity_id] = {}
+            names = {_key_name(entity_id), _key_name(entity["name"])}
+            for attribute in entity.get("attributes", []):
+                attribute_id = attribute["id"]
+                if attribute_id in attributes:
+                    self.findings.append(Finding(
+                        "duplicate_attribute_id", ERROR, _pointer("entities", entity_id, "attributes", attribute_id),
+                        f"attribute id {attribute_id!r} is used more than once in entity {entity_id!r}",
+                    ))
+                    continue
+                attributes[attribute_id] = attribute
+                if attribute.get("isPrimaryKey"):
+                    names.add(_key_name(attribute["name"]))
+            for name in names:
+                self.key_names.setdefault(name, set()).add(entity_id)
+
+        for relationship in model.get("relationships", []):
+            relationship_id = relationship["id"]
+            if relationship_id in self.relationships:
+                self.findings.append(Finding(
+                    "duplicate_relationship_id", ERROR, _pointer("relationships", relationship_id),
+                    f"relationship id {relationship_id!r} is used more than once",
+                ))
+                continue
+            self.relationships[relationship_id] = relationship
+            source, target = relationship["fromEntity"], relationship["toEntity"]
+            if source in self.adjacency and target in self.adjacency:
+                self.adjacency[source].add(target)
+                self.adjacency[target].add(source)
+
+    def referenced_entities(self, attribute_name: str) -> Set[str]:
+        """Entities a foreign key called ``attribute_name`` plausibly points at."""
+        name = _key_name(attribute_name)
+        candidates = {name}
+        for suffix in ("_id", "id"):
+            if name.endswith(suffix) and len(name) > len(suffix):
+                candidates.add(name[: -len(suffix)].rstrip("_"))
+        found: Set[str] = set()
+        for candidate in candidates:
+            entity_ids = self.key_names.get(candidate)
+            if entity_ids:
+                found.update(entity_ids)
+        return found
+
+
+def validate_model(model: Dict[str, Any], index: Optional[ModelIndex] = None) -> List[Finding]:
+    """Check ``model`` for referential-integrity problems.
+
+    Rules: ids are unique, relationships connect existing entities, every
+    entity has a primary key, and every ``isForeignKey`` attribute belongs
+    to an entity that takes part in a relationship with the entity it names.
+    Runs in O(entities + attributes + relationships).
+    """
+    index = index or ModelIndex(model)
+    findings = list(index.findings)
+
+    for relationship_id, relationship in index.relationships.items():
+        for field in ("fromEntity", "toEntity"):
+            if relationship[field] not in index.entities:
+                findings.append(Finding(
+                    "unknown_entity", ERROR, _pointer("relationships", relationship_id, field),
+                    f"relationship {relationship_id!r} {field} references unknown entity {relationship[field]!r}",
+                ))
+
+    for entity_id, attributes in index.attributes.items():
+        entity = index.entities[entity_id]
+        if not any(a.get("isPrimaryKey") for a in attributes.values()):
+            names = ", ".join(a["name"] for a in attributes.values()) or "none"
+            findings.append(Finding(
+                "missing_primary_key", ERROR, _pointer("entities", entity_id),
+                f"entity {entity_id!r} ({entity['name']}) has no primary key attribute; attributes: {names}",
+            ))
+        neighbours = index.adjacency[entity_id]
+        for attribute_id, attribute in attributes.items():
+            if not attribute.get("isForeignKey"):
+                continue
+            if not neighbours:
+                findings.append(Finding(
+                    "orphan_foreign_key", ERROR, _pointer("entities", entity_id, "attributes", attribute_id),
+                    f"foreign key {attribute['name']!r} of entity {entity_id!r} has no relationship; entity {entity_id!r} is not related to any entity",
+                ))
+                continue
+            referenced = index.referenced_entities(attribute["name"])
+            if referenced and referenced.isdisjoint(neighbours):
+                findings.append(Finding(
+                    "unrelated_foreign_key", ERROR, _pointer("entities", entity_id, "attributes", attribute_id),
+                    f"foreign key {attribute['name']!r} of entity {entity_id!r} refers to {', '.join(sorted(referenced))} "
+                    f"but no relationship connects {entity_id!r} to it",
+                ))
+            elif not referenced:
+                findings.append(Finding(
+                    "unmatched_foreign_key", WARNING, _pointer("entities", entity_id, "attributes", attribute_id),
+                    f"foreign key {attribute['name']!r} of entity {entity_id!r} does not name a related entity or its primary key",
+                ))
+    return findings
+
+
+def errors(findings: List[Finding]) -> List[Finding]:
+    return [f for f in findings if f.severity == ERROR]
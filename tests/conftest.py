@@ -0,0 +1,85 @@
+import asyncio
+from typing import List, Optional
+
+import httpx
+import openai
+import pytest
+from openai.types.chat import ChatCompletion
+from pydantic import BaseModel
+
+from src.agent import upstream
+
+
+class Answer(BaseModel):
+    text: str
+
+
+def completion(model: str, text: str = "ok") -> ChatCompletion:
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": Answer(text=text).model_dump_json()}}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    })
+
+
+def server_error() -> openai.InternalServerError:
+    request = httpx.Request("POST", "https://llm.test/chat/completions")
+    return openai.InternalServerError("upstream failed", response=httpx.Response(500, request=request), body=None)
+
+
+class FakeClock:
+    """Controllable stand-in for ``time.monotonic``."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class FakeAsyncClient:
+    """Stands in for AsyncOpenAI: answers ``post`` after ``latency`` seconds and honours the request timeout.
+
+    ``script`` holds one entry per call: an exception to raise, a latency in
+    seconds, or None for the default latency. Calls past the script succeed.
+    With a ``clock`` the latency advances it instead of sleeping.
+    """
+
+    def __init__(self, latency: float = 0.0, script: Optional[list] = None, clock: Optional[FakeClock] = None):
+        self.latency = latency
+        self.script = list(script or [])
+        self.clock = clock
+        self.calls: List[dict] = []
+        self.cancelled = 0
+
+    async def post(self, path, cast_to, body, options):
+        self.calls.append({"model": body["model"], "timeout": options["timeout"]})
+        step = self.script.pop(0) if self.script else None
+        if isinstance(step, BaseException):
+            raise step
+        latency = self.latency if step is None else step
+        try:
+            if self.clock is not None:
+                self.clock.advance(min(latency, options["timeout"]))
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(min(latency, options["timeout"]))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if latency > options["timeout"]:
+            raise openai.APITimeoutError(request=httpx.Request("POST", "https://llm.test" + path))
+        return completion(body["model"], f"answer {len(self.calls)}")
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    client = FakeAsyncClient()
+    monkeypatch.setattr(upstream, "get_async_client", lambda: client)
+    return client
@@ -0,0 +1,152 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from conftest import Answer
+from src.agent import batch
+from src.agent.batch import BatchCheckpoint, BatchItem, parse_items, run_batch
+from src.agent.upstream import acall_llm, deadline
+
+
+def collect(items, generate, **kwargs):
+    async def main():
+        return [result async for result in run_batch(items, generate, **kwargs)]
+
+    return asyncio.run(main())
+
+
+def items(count):
+    return [BatchItem(str(i), f"prompt {i}") for i in range(count)]
+
+
+def test_rate_wait_does_not_use_up_the_deadline(fake_client):
+    # 8 items started together at 20 requests/s: the last one waits 0.35 s for
+    # its token, longer than its whole 0.25 s deadline
+    fake_client.latency = 0.02
+
+    async def generate(prompt):
+        with deadline(0.25):
+            response, _ = await acall_llm("batch_test", [{"role": "user", "content": prompt}], Answer)
+            return response
+
+    results = collect(items(8), generate, concurrency=8, rate=20)
+    assert [r["status"] for r in results] == ["ok"] * 8
+    assert all(r["attempts"] == 1 for r in results)
+    assert len(fake_client.calls) == 8
+    assert all(call["timeout"] > 0.2 for call in fake_client.calls)
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(batch, "BATCH_RETRY_INITIAL", 0.001)
+    monkeypatch.setattr(batch, "BATCH_RETRY_MAX", 0.002)
+
+
+def recording(outcomes=None):
+    """A generate function that fails with the queued exceptions of each prompt, then answers."""
+    calls = []
+    outcomes = {prompt: list(errors) for prompt, errors in (outcomes or {}).items()}
+
+    async def generate(prompt):
+        calls.append(prompt)
+        await asyncio.sleep(0)
+        errors = outcomes.get(prompt)
+        if errors:
+            raise errors.pop(0)
+        return {"prompt": prompt}
+
+    return generate, calls
+
+
+def test_parse_items():
+    assert parse_items(['{"id": "a", "prompt": "x"}', "", '"y"', '{"prompt": "z"}']) == [
+        BatchItem("a", "x"), BatchItem("3", "y"), BatchItem("4", "z"),
+    ]
+    with pytest.raises(ValueError, match="line 2: duplicate id 'a'"):
+        parse_items(['{"id": "a", "prompt": "x"}', '{"id": "a", "prompt": "y"}'])
+    with pytest.raises(ValueError, match="line 1: invalid JSON"):
+        parse_items(["{"])
+
+
+def test_retries_only_load_shedding():
+    generate, calls = recording({
+        "prompt 0": [HTTPException(503), HTTPException(429)],
+        "prompt 1": [HTTPException(504)],
+        "prompt 2": [ValueError("invalid model")],
+    })
+    results = {r["id"]: r for r in collect(items(3), generate, max_attempts=4)}
+    assert (results["0"]["status"], results["0"]["attempts"]) == ("ok", 3)
+    assert (results["1"]["status"], results["1"]["attempts"]) == ("error", 1)
+    assert results["1"]["error"].startswith("HTTPException")
+    assert (results["2"]["status"], results["2"]["attempts"]) == ("error", 1)
+    assert results["2"]["error"] == "ValueError: invalid model"
+    assert calls.count("prompt 0") == 3
+
+
+def test_retries_stop_at_max_attempts():
+    generate, calls = recording({"prompt 0": [HTTPException(503)] * 5})
+    [result] = collect(items(1), generate, max_attempts=2)
+    assert (result["status"], result["attempts"]) == ("error", 2)
+
+
+def test_resume_from_checkpoint(tmp_path):
+    checkpoint = BatchCheckpoint(str(tmp_path / "run.jsonl"))
+    generate, calls = recording({"prompt 1": [ValueError("boom")]})
+    first = collect(items(3), generate, checkpoint=checkpoint)
+    assert sorted(r["status"] for r in first) == ["error", "ok", "ok"]
+
+    # Finished items come back from the checkpoint; the failed one runs again
+    generate, calls = recording()
+    second = collect(items(3), generate, checkpoint=checkpoint)
+    assert calls == ["prompt 1"]
+    resumed = [r for r in second if r.get("resumed")]
+    assert sorted(r["id"] for r in resumed) == ["0", "2"]
+    assert all(r["model"] == {"prompt": f"prompt {r['id']}"} for r in resumed)
+
+    # An edited prompt under the same id is generated again
+    generate, calls = recording()
+    collect([BatchItem("0", "edited prompt"), BatchItem("2", "prompt 2")], generate, checkpoint=checkpoint)
+    assert calls == ["edited prompt"]
+
+
+def test_resume_skips_malformed_checkpoint_lines(tmp_path):
+    path = tmp_path / "run.jsonl"
+    checkpoint = BatchCheckpoint(str(path))
+    generate, _ = recording()
+    collect(items(1), generate, checkpoint=checkpoint)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"hash": "abc"}) + "\n")
+        f.write("[1, 2]\n")
+        f.write(json.dumps({"hash": "abc", "result": "done"}) + "\n")
+        f.write(json.dumps({"result": {"id": "1"}}) + "\n")
+        f.write('{"hash": "abc", "result": {"id": "1", "sta')
+    assert list(checkpoint.load()) == ["0"]
+
+    generate, calls = recording()
+    results = collect(items(2), generate, checkpoint=checkpoint)
+    assert calls == ["prompt 1"]
+    assert [r.get("resumed", False) for r in results] == [True, False]
+
+
+def test_stopping_early_cancels_unfinished_items():
+    cancelled = []
+
+    async def generate(prompt):
+        if prompt != "prompt 0":
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(prompt)
+                raise
+        return {"prompt": prompt}
+
+    async def main():
+        results = run_batch(items(4), generate, concurrency=4)
+        first = await anext(results)
+        await results.aclose()
+        return first
+
+    assert asyncio.run(main())["id"] == "0"
+    assert sorted(cancelled) == ["prompt 1", "prompt 2", "prompt 3"]
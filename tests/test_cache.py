@@ -0,0 +1,166 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import Answer, FakeClock
+from src.agent import cache
+from src.agent.cache import DiskCacheBackend, MemoryCacheBackend, ResponseCache, cache_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=clock, time=clock))
+    return clock
+
+
+def counting(value, delay=0.0, error=None):
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return value
+
+    return call, calls
+
+
+def test_cache_key_normalization():
+    messages = [{"role": "system", "content": "Classify  the\n intent"}, {"role": "user", "content": "Hi there!"}]
+    spaced = [{"role": "system", "content": "Classify the intent "}, {"role": "user", "content": "hi there"}]
+    assert cache_key("m", Answer, messages) != cache_key("m", Answer, spaced)
+    assert cache_key("m", Answer, messages, fold_user_text=True) == cache_key("m", Answer, spaced, fold_user_text=True)
+    assert cache_key("m", Answer, messages) != cache_key("other", Answer, messages)
+
+
+def test_single_flight_coalesces_concurrent_callers():
+    responses = ResponseCache(MemoryCacheBackend(), enabled=True)
+    call, calls = counting({"entities": []}, delay=0.02)
+
+    async def main():
+        return await asyncio.gather(*(responses.get_or_call("k", call) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(r == {"entities": []} for r in results)
+    # Every caller gets its own copy
+    results[1]["entities"].append("x")
+    assert results[2] == {"entities": []}
+    assert responses.stats()["coalesced"] == 4
+    assert asyncio.run(responses.get_or_call("k", call)) == {"entities": []}
+    assert len(calls) == 1
+
+
+def test_follower_takes_over_when_the_leader_is_cancelled():
+    responses = ResponseCache(MemoryCacheBackend(), enabled=True)
+    call, calls = counting({"ok": True}, delay=0.02)
+
+    async def main():
+        leader = asyncio.create_task(responses.get_or_call("k", call))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(responses.get_or_call("k", call))
+        await asyncio.sleep(0.005)
+        leader.cancel()
+        result = await follower
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return result
+
+    assert asyncio.run(main()) == {"ok": True}
+    assert len(calls) == 2
+    assert responses.get("k") == {"ok": True}
+
+
+def test_cancelled_follower_does_not_cancel_the_leader():
+    responses = ResponseCache(MemoryCacheBackend(), enabled=True)
+    call, calls = counting({"ok": True}, delay=0.02)
+
+    async def main():
+        leader = asyncio.create_task(responses.get_or_call("k", call))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(responses.get_or_call("k", call))
+        await asyncio.sleep(0.005)
+        follower.cancel()
+        return await leader
+
+    assert asyncio.run(main()) == {"ok": True}
+    assert len(calls) == 1
+
+
+def test_failures_reach_followers_and_are_not_cached():
+    responses = ResponseCache(MemoryCacheBackend(), enabled=True)
+    call, calls = counting(None, delay=0.01, error=RuntimeError("upstream down"))
+
+    async def main():
+        return await asyncio.gather(*(responses.get_or_call("k", call) for _ in range(3)), return_exceptions=True)
+
+    assert [type(r) for r in asyncio.run(main())] == [RuntimeError] * 3
+    assert len(calls) == 1
+    assert responses.get("k") is None
+
+
+def test_store_predicate_skips_caching_but_shares_the_value():
+    responses = ResponseCache(MemoryCacheBackend(), enabled=True)
+    call, calls = counting({"repaired": False}, delay=0.01)
+
+    def store(value):
+        return value["repaired"]
+
+    async def main():
+        return await asyncio.gather(*(responses.get_or_call("k", call, store) for _ in range(3)))
+
+    assert asyncio.run(main()) == [{"repaired": False}] * 3
+    assert len(calls) == 1
+    assert responses.get("k") is None
+    asyncio.run(responses.get_or_call("k", call, store))
+    assert len(calls) == 2
+
+
+def test_disabled_cache_always_calls():
+    responses = ResponseCache(MemoryCacheBackend(), enabled=False)
+    call, calls = counting(1)
+    asyncio.run(responses.get_or_call("k", call))
+    asyncio.run(responses.get_or_call("k", call))
+    assert len(calls) == 2
+    assert responses.get("k") is None
+
+
+def test_memory_ttl(clock):
+    backend = MemoryCacheBackend(max_entries=10, ttl_seconds=60)
+    backend.set("k", "v")
+    clock.advance(59)
+    assert backend.get("k") == "v"
+    clock.advance(2)
+    assert backend.get("k") is None
+    assert len(backend) == 0
+
+
+def test_memory_lru_evicts_least_recently_used(clock):
+    backend = MemoryCacheBackend(max_entries=2, ttl_seconds=60)
+    backend.set("a", "1")
+    backend.set("b", "2")
+    assert backend.get("a") == "1"
+    backend.set("c", "3")
+    assert (backend.get("a"), backend.get("b"), backend.get("c")) == ("1", None, "3")
+
+
+def test_disk_backend_ttl_bound_and_memory_refill(tmp_path, clock):
+    disk = DiskCacheBackend(str(tmp_path / "cache.db"), ttl_seconds=60, max_entries=2)
+    responses = ResponseCache(MemoryCacheBackend(ttl_seconds=60), disk, enabled=True)
+    responses.set("a", {"n": 1})
+    clock.advance(1)
+    responses.set("b", {"n": 2})
+    clock.advance(1)
+    responses.set("c", {"n": 3})
+    assert len(disk) == 2 and disk.get("a") is None
+
+    # A fresh process sees the disk entries and copies them into memory
+    restarted = ResponseCache(MemoryCacheBackend(ttl_seconds=60), DiskCacheBackend(disk.path, ttl_seconds=60), enabled=True)
+    assert restarted.get("c") == {"n": 3}
+    assert len(restarted.memory) == 1
+    clock.advance(60)
+    assert restarted.disk.get("b") is None
+    assert restarted.stats()["hits"] == 1
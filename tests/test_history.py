@@ -0,0 +1,147 @@
+import json
+import sqlite3
+
+import pytest
+
+from src.agent.history import MemoryHistoryStore, SQLiteHistoryStore, _paginate
+from src.agent.versions import ModelVersionStore
+
+
+def message(role, content):
+    return {"role": role, "content": content, "timestamp": "2024-01-01T00:00:00Z"}
+
+
+def model(n):
+    return {"id": "shop", "name": "Shop", "message": f"v{n}", "entities": [
+        {"id": f"e{i}", "name": f"E{i}", "attributes": [{"id": "id", "name": "id", "type": "int"}]} for i in range(n)
+    ], "relationships": []}
+
+
+def contents(messages):
+    return [json.loads(m)["content"] for m in messages]
+
+
+@pytest.fixture(params=["memory", "memory+versions", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryHistoryStore()
+    if request.param == "memory+versions":
+        return MemoryHistoryStore(versions=ModelVersionStore(max_versions=1))
+    return SQLiteHistoryStore(str(tmp_path / "history.db"), versions=ModelVersionStore())
+
+
+def fill(store):
+    # q2 was never answered and the undo's model has no user message
+    store.append("u", message("user", "q1"), message("assistant", "a1"))
+    store.append("u", message("user", "q2"))
+    store.append("u", message("user", "q3"), message("assistant", model(3)))
+    store.append("u", message("assistant", model(2)))
+    store.append("u", message("user", "q4"), message("assistant", "a4"))
+
+
+def walk(store, limit):
+    pages, before = [], None
+    while True:
+        page = store.page("u", limit, before)
+        pages.append(contents(page.messages))
+        if page.next_cursor is None:
+            return pages
+        before = page.next_cursor
+
+
+def test_paginate_pairs_newest_first():
+    records = [(6, "assistant", "a4"), (5, "user", "q4"), (4, "user", "q3"), (3, "assistant", "a2"), (2, "user", "q2"), (1, "user", "q1")]
+    assert _paginate(records, 2) == (["q4", "a4", "q3"], 4)
+    assert _paginate(records[3:], 2) == (["q2", "a2", "q1"], None)
+
+
+def test_paginate_unpaired_messages():
+    records = [(4, "assistant", "a3"), (3, "assistant", "a2"), (2, "user", "q1"), (1, "user", "q0")]
+    assert _paginate(records, 10) == (["a3", "q1", "a2", "q0"], None)
+    assert _paginate(records, 1) == (["a3"], 4)
+
+
+def test_paginate_reads_only_the_page():
+    consumed = []
+
+    def records():
+        for seq in range(1000, 0, -1):
+            consumed.append(seq)
+            yield seq, "assistant" if seq % 2 == 0 else "user", str(seq)
+
+    page = _paginate(records(), 3)
+    assert page == (["999", "1000", "997", "998", "995", "996"], 995)
+    assert len(consumed) == 7
+
+
+def test_paginate_empty():
+    assert _paginate([], 5) == ([], None)
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 10])
+def test_pages_cover_history_once(store, limit):
+    fill(store)
+    pages = walk(store, limit)
+    assert all(len(page) <= 2 * limit for page in pages)
+    assert [m for page in pages for m in page] == ["q4", "a4", model(2), "q3", model(3), "q2", "q1", "a1"]
+
+
+def test_pages_keep_pairs_together(store):
+    fill(store)
+    assert walk(store, 2) == [["q4", "a4", model(2)], ["q3", model(3), "q2"], ["q1", "a1"]]
+
+
+def test_page_matches_append_and_get(store):
+    serialized = store.append("u", message("user", "q"), message("assistant", model(3)))
+    assert store.page("u").messages == serialized
+    assert [m["content"] for m in store.get("u")] == ["q", model(3)]
+
+
+def test_empty_and_exhausted_cursor(store):
+    assert store.page("nobody") == ([], None)
+    fill(store)
+    assert store.page("u", 5, before=1) == ([], None)
+
+
+def test_message_cap_trims_oldest(tmp_path):
+    versions = ModelVersionStore()
+    for store in (MemoryHistoryStore(max_messages=3, versions=versions), SQLiteHistoryStore(str(tmp_path / "capped.db"), max_messages=3)):
+        fill(store)
+        assert [m["content"] for m in store.get("u")] == [model(2), "q4", "a4"]
+        assert walk(store, 5) == [["q4", "a4", model(2)]]
+
+
+def test_model_references_outlive_trimmed_versions():
+    versions = ModelVersionStore(max_versions=1)
+    store = MemoryHistoryStore(versions=versions)
+    fill(store)
+    assert [v["version"] for v in versions.versions("u", "shop")] == [2]
+    assert [m["content"] for m in store.get("u")][4:6] == [model(3), model(2)]
+    store.reset("u")
+    versions.reset("u")
+    assert versions.stats()["entity_blobs"] == 0
+
+
+def test_sqlite_backfills_serialized_column(tmp_path):
+    path = str(tmp_path / "old.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL,"
+                     " role TEXT NOT NULL, content TEXT NOT NULL, timestamp TEXT NOT NULL)")
+        conn.executemany("INSERT INTO messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                         [("u", "user", json.dumps("q1"), "t1"), ("u", "assistant", json.dumps(model(1)), "t2")])
+    assert contents(SQLiteHistoryStore(path).page("u").messages) == ["q1", model(1)]
+
+
+def test_models_are_serialized_once_and_materialized_once(monkeypatch):
+    versions = ModelVersionStore(max_versions=1)
+    store = MemoryHistoryStore(versions=versions)
+    fill(store)
+    calls = []
+    monkeypatch.setattr("src.agent.history.serialize_message", lambda m: calls.append(m) or "")
+    monkeypatch.setattr(versions, "_materialize", lambda ref, inner=versions._materialize: calls.append(ref) or inner(ref))
+    assert walk(store, 2)[0][:2] == ["q4", "a4"]
+    first = store.get("u")
+    assert first[4]["content"] == model(3)
+    assert store.get("u")[4]["content"] is first[4]["content"]
+    assert len(calls) == 2  # one materialization per model, no serialization
+    assert versions.stats()["cached_models"] == 2
@@ -0,0 +1,84 @@
+import pytest
+
+from src.agent.intent import LocalIntentClassifier, is_casual_query, is_greeting, normalize_text
+
+MODEL = {"id": "shop", "name": "Shop", "message": "", "entities": [], "relationships": []}
+AFTER_QUESTION = [
+    {"role": "user", "content": "I need a model for a shop"},
+    {"role": "assistant", "content": "Should orders have line items?"},
+]
+AFTER_MODEL = [{"role": "user", "content": "create a shop model"}, {"role": "assistant", "content": MODEL}]
+
+
+@pytest.fixture
+def classifier():
+    return LocalIntentClassifier(min_confidence=0.8)
+
+
+def test_normalize_text():
+    assert normalize_text("  Hello,   THERE! ") == "hello there"
+    assert is_greeting("Hi!") and not is_greeting("hi there")
+    assert is_casual_query("What can you do?")
+
+
+@pytest.mark.parametrize("query", ["hello", "Good morning!", "what can you do?", "thanks", "bye", "", "?!"])
+def test_keyword_tier(classifier, query):
+    assert classifier.classify(query, AFTER_MODEL) == "CONVO"
+
+
+@pytest.mark.parametrize("query, intent", [
+    ("hey there, how are you", None),
+    ("hi there!", "CONVO"),
+    ("hi, add an email attribute to customer", "MODEL"),
+    ("create a data model for a library", "MODEL"),
+    ("hello, generate a schema for payroll", "MODEL"),
+])
+def test_greeting_prefix(classifier, query, intent):
+    assert classifier.classify(query, AFTER_MODEL) == intent
+
+
+@pytest.mark.parametrize("query", [
+    "add an email attribute to customer",
+    "rename the order entity to purchase",
+    "please remove the address table",
+    "delete it",
+])
+def test_edit_verbs_with_a_model(classifier, query):
+    prediction = classifier.predict(query, AFTER_MODEL)
+    assert (prediction.intent, prediction.tier) == ("MODEL", "history")
+    assert classifier.classify(query, AFTER_MODEL) == "MODEL"
+
+
+def test_edit_verbs_without_a_model_go_to_the_llm(classifier):
+    assert classifier.classify("add an email attribute to customer", []) is None
+
+
+@pytest.mark.parametrize("query", ["yes", "ok", "Sure!", "yes please", "ok, go ahead", "sounds good", "perfect"])
+def test_bare_confirmation_after_a_question(classifier, query):
+    assert classifier.classify(query, AFTER_QUESTION) == "MODEL"
+
+
+@pytest.mark.parametrize("query", ["ok thanks", "perfect, thank you!", "ok got it", "okay bye", "sure, that is all for now"])
+def test_confirmation_with_more_goes_to_the_llm(classifier, query):
+    assert classifier.predict(query, AFTER_QUESTION).confidence < classifier.min_confidence
+    assert classifier.classify(query, AFTER_QUESTION) is None
+
+
+def test_confirmation_after_a_model_goes_to_the_llm(classifier):
+    assert classifier.classify("yes", AFTER_MODEL) is None
+
+
+@pytest.mark.parametrize("query", ["what is a foreign key", "explain the cardinality", "the weather is nice today"])
+def test_fallback_tier(classifier, query):
+    assert classifier.classify(query, AFTER_MODEL) is None
+
+
+def test_stats_count_tiers(classifier):
+    classifier.classify("hello", [])
+    classifier.classify("create a data model for a library", [])
+    classifier.classify("add a status field", AFTER_MODEL)
+    classifier.classify("what is a foreign key", [])
+    stats = classifier.stats()
+    assert stats["total"] == 4
+    assert stats["counts"] == {"keyword": 1, "pattern": 1, "history": 1, "llm": 1}
+    assert stats["hit_rates"]["llm"] == 0.25
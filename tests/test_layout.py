@@ -0,0 +1,144 @@
+import copy
+import random
+import time
+
+import pytest
+
+from src.schema.layout import ENTITY_WIDTH, INCREMENTAL_LIMIT, entity_size, layout_model
+
+
+def entity(entity_id, attributes=2, position=None):
+    result = {"id": entity_id, "name": entity_id, "attributes": [
+        {"id": f"{entity_id}_{i}", "name": f"a{i}", "type": "string"} for i in range(attributes)
+    ]}
+    if position is not None:
+        result["position"] = {"x": position[0], "y": position[1]}
+    return result
+
+
+def relationship(source, target):
+    return {"id": f"{source}_{target}", "fromEntity": source, "toEntity": target, "type": "one-to-many", "name": "has"}
+
+
+def model(entities, relationships=()):
+    return {"id": "m", "name": "M", "message": "", "entities": entities, "relationships": list(relationships)}
+
+
+def boxes(result):
+    return {e["id"]: (e["position"]["x"], e["position"]["y"], *entity_size(e)) for e in result["entities"]}
+
+
+def assert_no_overlaps(result):
+    placed = list(boxes(result).items())
+    for i, (a, (ax, ay, aw, ah)) in enumerate(placed):
+        for b, (bx, by, bw, bh) in placed[i + 1:]:
+            assert ax + aw <= bx or bx + bw <= ax or ay + ah <= by or by + bh <= ay, f"{a} overlaps {b}"
+
+
+def random_model(count, seed, prefix="e", extra_edges=0.3):
+    rng = random.Random(seed)
+    entities = [entity(f"{prefix}{i}", rng.randrange(1, 12)) for i in range(count)]
+    relationships = [relationship(f"{prefix}{rng.randrange(i)}", f"{prefix}{i}") for i in range(1, count)]
+    relationships += [relationship(f"{prefix}{rng.randrange(count)}", f"{prefix}{rng.randrange(count)}") for _ in range(int(count * extra_edges))]
+    return model(entities, relationships)
+
+
+def test_empty_model():
+    assert layout_model(model([])) == model([])
+
+
+def test_acyclic_model_is_layered_left_to_right():
+    # customer -> order -> line, order -> payment; product -> line
+    result = layout_model(model(
+        [entity("customer"), entity("order", 5), entity("line"), entity("payment"), entity("product")],
+        [relationship("customer", "order"), relationship("order", "line"), relationship("order", "payment"), relationship("product", "line")],
+    ))
+    x = {entity_id: box[0] for entity_id, box in boxes(result).items()}
+    assert x["customer"] == x["product"]
+    assert x["customer"] < x["order"] < x["line"]
+    assert x["line"] == x["payment"]
+    assert x["order"] - x["customer"] >= ENTITY_WIDTH
+    assert_no_overlaps(result)
+
+
+def test_cycles_and_self_references_are_laid_out():
+    result = layout_model(model(
+        [entity("a"), entity("b"), entity("c")],
+        [relationship("a", "b"), relationship("b", "c"), relationship("c", "a"), relationship("a", "a")],
+    ))
+    assert all(e["position"] is not None for e in result["entities"])
+    assert_no_overlaps(result)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_fresh_layout_has_no_overlaps(seed):
+    assert_no_overlaps(layout_model(random_model(60, seed)))
+
+
+def test_existing_positions_are_kept():
+    result = layout_model(model(
+        [entity("customer", position=(500, 300)), entity("order")],
+        [relationship("customer", "order")],
+    ))
+    assert result["entities"][0]["position"] == {"x": 500, "y": 300}
+    assert_no_overlaps(result)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_previous_positions_stay_pinned(seed):
+    previous = layout_model(random_model(40, seed))
+    before = boxes(previous)
+
+    updated = copy.deepcopy(previous)
+    for e in updated["entities"]:
+        del e["position"]
+    new = random_model(8, seed + 100, prefix="n")
+    updated["entities"] += new["entities"]
+    updated["relationships"] += new["relationships"] + [relationship("e0", "n0"), relationship("e5", "n3")]
+
+    result = layout_model(updated, previous)
+    after = boxes(result)
+    assert {k: after[k] for k in before} == before
+    assert_no_overlaps(result)
+
+
+def test_new_entities_are_placed_near_their_neighbours():
+    previous = layout_model(random_model(30, 7))
+    updated = copy.deepcopy(previous)
+    updated["entities"].append(entity("child"))
+    updated["relationships"].append(relationship("e10", "child"))
+    after = boxes(layout_model(updated, previous))
+    anchor, child = after["e10"], after["child"]
+    spread = max(x for x, *_ in after.values()) - min(x for x, *_ in after.values())
+    assert abs(child[0] - anchor[0]) + abs(child[1] - anchor[1]) < spread
+
+
+def test_many_new_entities_fall_back_to_layers_beside_the_diagram():
+    previous = layout_model(random_model(20, 3))
+    before = boxes(previous)
+    updated = copy.deepcopy(previous)
+    new = random_model(INCREMENTAL_LIMIT + 20, 4, prefix="n", extra_edges=0)
+    updated["entities"] += new["entities"]
+    updated["relationships"] += new["relationships"]
+
+    after = boxes(layout_model(updated, previous))
+    assert {k: after[k] for k in before} == before
+    right_edge = max(x + w for x, _, w, _ in before.values())
+    assert all(after[e["id"]][0] > right_edge for e in new["entities"])
+    # The tree of new entities is layered: each child sits right of its parent
+    for r in new["relationships"]:
+        assert after[r["fromEntity"]][0] < after[r["toEntity"]][0]
+    assert_no_overlaps({"entities": updated["entities"]})
+
+
+def test_large_model_refinement_is_fast():
+    previous = layout_model(random_model(500, 11))
+    updated = copy.deepcopy(previous)
+    new = random_model(10, 12, prefix="n")
+    updated["entities"] += new["entities"]
+    updated["relationships"] += new["relationships"] + [relationship("e1", "n0")]
+    start = time.perf_counter()
+    layout_model(updated, previous)
+    # About 10 ms on a laptop; the bound only catches a return to quadratic work in Python
+    assert time.perf_counter() - start < 1.0
+    assert_no_overlaps(updated)
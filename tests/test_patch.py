@@ -0,0 +1,107 @@
+import copy
+import json
+
+import pytest
+
+from src.schema.main import PatchOperation
+from src.schema.patch import PatchError, apply_patch
+
+
+def make_model():
+    return {
+        "id": "shop",
+        "name": "Shop",
+        "message": "initial",
+        "entities": [
+            {"id": "customer", "name": "Customer", "attributes": [
+                {"id": "customer_id", "name": "customer_id", "type": "int", "isPrimaryKey": True},
+                {"id": "customer_email", "name": "email", "type": "string"},
+            ]},
+            {"id": "order", "name": "Order", "attributes": [
+                {"id": "order_id", "name": "order_id", "type": "int", "isPrimaryKey": True},
+            ]},
+        ],
+        "relationships": [
+            {"id": "places", "fromEntity": "customer", "toEntity": "order", "type": "one-to-many", "name": "places"},
+        ],
+    }
+
+
+def op(op, path, value=None):
+    return PatchOperation(op=op, path=path, value=None if value is None else json.dumps(value))
+
+
+def entity(model, entity_id):
+    return next(e for e in model["entities"] if e["id"] == entity_id)
+
+
+def test_replace_addresses_list_elements_by_id():
+    result = apply_patch(make_model(), [op("replace", "/entities/customer/attributes/customer_email/name", "email_address")])
+    attributes = entity(result, "customer")["attributes"]
+    assert [a["name"] for a in attributes] == ["customer_id", "email_address"]
+
+
+def test_add_appends_with_dash():
+    product = {"id": "product", "name": "Product", "attributes": [{"id": "sku", "name": "sku", "type": "string", "isPrimaryKey": True}]}
+    result = apply_patch(make_model(), [op("add", "/entities/-", product)])
+    assert [e["id"] for e in result["entities"]] == ["customer", "order", "product"]
+    assert entity(result, "product")["attributes"][0]["isForeignKey"] is False
+
+
+def test_add_sets_member_of_object():
+    result = apply_patch(make_model(), [op("add", "/entities/customer/attributes/customer_email/classification", "PII")])
+    assert entity(result, "customer")["attributes"][1]["classification"] == "PII"
+
+
+def test_remove_by_id():
+    result = apply_patch(make_model(), [op("remove", "/relationships/places"), op("remove", "/entities/order")])
+    assert result["relationships"] == []
+    assert [e["id"] for e in result["entities"]] == ["customer"]
+
+
+def test_operations_apply_in_order():
+    result = apply_patch(make_model(), [
+        op("add", "/entities/order/attributes/-", {"id": "order_total", "name": "total", "type": "decimal"}),
+        op("replace", "/entities/order/attributes/order_total/type", "money"),
+    ])
+    assert entity(result, "order")["attributes"][-1]["type"] == "money"
+
+
+def test_input_model_is_not_mutated():
+    model = make_model()
+    before = copy.deepcopy(model)
+    apply_patch(model, [
+        op("replace", "/entities/customer/attributes/customer_email/name", "mail"),
+        op("remove", "/entities/order/attributes/order_id"),
+        op("add", "/entities/-", {"id": "x", "name": "X", "attributes": []}),
+    ])
+    assert model == before
+
+
+def test_path_tokens_are_unescaped():
+    model = make_model()
+    entity(model, "customer")["attributes"][1]["id"] = "a/b~c"
+    result = apply_patch(model, [op("replace", "/entities/customer/attributes/a~1b~0c/name", "escaped")])
+    assert entity(result, "customer")["attributes"][1]["name"] == "escaped"
+
+
+@pytest.mark.parametrize("operation, message", [
+    (op("replace", "/entities/missing/name", "X"), "no element with id 'missing'"),
+    (op("remove", "/entities/customer/nickname"), "'nickname' does not exist"),
+    (op("replace", "/entities/customer/nickname", "X"), "'nickname' does not exist"),
+    (op("add", "/entities/order", {"id": "order"}), "add to a list must use '-'"),
+    (op("add", "/entities/-", {"id": "order", "name": "Order", "attributes": []}), "id 'order' already exists"),
+    (op("add", "/entities/customer/name/x", "X"), "cannot add to a scalar"),
+    (op("replace", "/name"), "replace requires a value"),
+    (PatchOperation(op="replace", path="/name", value="{not json"), "value is not valid JSON"),
+    (op("replace", "name", "X"), "paths must start with '/'"),
+    (op("remove", "/"), "paths must start with '/'"),
+])
+def test_invalid_operations_raise(operation, message):
+    with pytest.raises(PatchError, match=message):
+        apply_patch(make_model(), [operation])
+
+
+def test_result_must_be_a_valid_model():
+    with pytest.raises(PatchError, match="patched model is invalid"):
+        apply_patch(make_model(), [op("remove", "/entities/customer/attributes/customer_id/type")])
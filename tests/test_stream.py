@@ -0,0 +1,88 @@
+import json
+import random
+
+import pytest
+
+from src.agent.stream import IncrementalModelParser, sse
+
+MODEL = {
+    "id": "shop",
+    "name": "Shop {v2}",
+    "message": "Added \"Order\" and a [relationship]: {customer} -> order \\ done",
+    "entities": [
+        {"id": "customer", "name": "Customer } ]", "attributes": [
+            {"id": "customer_id", "name": "customer_id", "type": "int", "isPrimaryKey": True, "isForeignKey": False, "classification": None},
+            {"id": "note", "name": "message", "type": "{\"json\": [1, 2]}", "isPrimaryKey": False, "isForeignKey": False, "classification": "é ✓"},
+        ], "position": {"x": 0, "y": 10}},
+        {"id": "order", "name": "Order", "attributes": [], "position": None},
+    ],
+    "relationships": [
+        {"id": "places", "fromEntity": "customer", "toEntity": "order", "type": "one-to-many", "name": "relationships"},
+    ],
+}
+
+EXPECTED = (
+    [("message", MODEL["message"])]
+    + [("entity", e) for e in MODEL["entities"]]
+    + [("relationship", r) for r in MODEL["relationships"]]
+)
+
+
+def feed_all(chunks):
+    parser = IncrementalModelParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return parser, events
+
+
+def split(text, cuts):
+    cuts = sorted(set(cuts))
+    return [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_whole_document(indent):
+    _, events = feed_all([json.dumps(MODEL, indent=indent, ensure_ascii=False)])
+    assert events == EXPECTED
+
+
+def test_one_character_at_a_time():
+    text = json.dumps(MODEL)
+    _, events = feed_all(list(text))
+    assert events == EXPECTED
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_chunking(seed):
+    rng = random.Random(seed)
+    text = json.dumps(MODEL, indent=rng.choice([None, 1]), ensure_ascii=rng.random() < 0.5)
+    cuts = [rng.randrange(1, len(text)) for _ in range(rng.randrange(1, 60))]
+    _, events = feed_all(split(text, cuts))
+    assert events == EXPECTED
+
+
+def test_events_arrive_as_soon_as_items_close():
+    text = json.dumps(MODEL)
+    first_entity_end = text.index('"position": {"x": 0, "y": 10}}') + len('"position": {"x": 0, "y": 10}}')
+    parser = IncrementalModelParser()
+    events = parser.feed(text[:first_entity_end])
+    assert [event for event, _ in events] == ["message", "entity"]
+    assert parser.feed("") == []
+
+
+def test_message_after_the_arrays():
+    model = {key: MODEL[key] for key in ("id", "entities", "relationships", "name", "message")}
+    _, events = feed_all(split(json.dumps(model), [7, 50, 51, 300]))
+    assert [event for event, _ in events] == ["entity", "entity", "relationship", "message"]
+
+
+def test_invalid_items_are_skipped_and_counted():
+    model = dict(MODEL, entities=[{"id": "broken"}, MODEL["entities"][1]])
+    parser, events = feed_all(split(json.dumps(model), [33, 90]))
+    assert [payload["id"] for event, payload in events if event == "entity"] == ["order"]
+    assert parser.invalid == 1
+
+
+def test_sse():
+    assert sse("entity", {"id": "a"}) == 'event: entity\ndata: {"id": "a"}\n\n'
@@ -0,0 +1,227 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from conftest import Answer, FakeAsyncClient, FakeClock, server_error
+from src.agent import upstream
+from src.agent.limiter import RateLimiter
+from src.agent.upstream import CallPolicy, acall_llm, deadline, plan_call, rate_limit
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def policy(**overrides):
+    settings = dict(model="primary", fallback_model="fallback", timeout=60.0, max_attempts=2,
+                    hedge_quantile=0.0, hedge_min_delay=0.5, fallback_margin=20.0)
+    settings.update(overrides)
+    return CallPolicy(**settings)
+
+
+@pytest.fixture
+def setup(monkeypatch):
+    """Fake client, fake clock and recorded backoff bounds for the ``test`` call site."""
+    clock = FakeClock()
+    client = FakeAsyncClient(clock=clock)
+    backoffs = []
+    env = SimpleNamespace(client=client, clock=clock, backoffs=backoffs, policy=policy(), jitter=lambda low, high: 0.0)
+
+    def uniform(low, high):
+        backoffs.append(high)
+        return env.jitter(low, high)
+
+    monkeypatch.setattr(upstream, "get_async_client", lambda: client)
+    monkeypatch.setattr(upstream, "time", SimpleNamespace(monotonic=clock, perf_counter=time.perf_counter))
+    monkeypatch.setattr(upstream, "random", SimpleNamespace(uniform=uniform))
+    monkeypatch.setattr(upstream, "site_policy", lambda site: env.policy)
+    monkeypatch.setattr(upstream, "_hedge_delay", lambda site, policy, timeout: None)
+    return env
+
+
+def call(seconds=None):
+    async def main():
+        with deadline(seconds):
+            return await acall_llm("test", MESSAGES, Answer)
+
+    return asyncio.run(main())
+
+
+def models(client):
+    return [c["model"] for c in client.calls]
+
+
+def test_plan_call_without_deadline(setup):
+    assert plan_call("test", setup.policy, "primary") == ("primary", 60.0)
+
+
+def test_plan_call_keeps_the_fallback_margin(setup):
+    with deadline(50):
+        assert plan_call("test", setup.policy, "primary") == ("primary", 30.0)
+        setup.clock.advance(35)
+        assert plan_call("test", setup.policy, "primary") == ("fallback", 15.0)
+        setup.clock.advance(20)
+        with pytest.raises(HTTPException) as raised:
+            plan_call("test", setup.policy, "primary")
+    assert raised.value.status_code == 504
+
+
+def test_retries_with_jittered_exponential_backoff(setup):
+    setup.policy = policy(max_attempts=4)
+    setup.client.script = [server_error(), server_error(), server_error()]
+    response, model = call()
+    assert (response, model) == ({"text": "answer 4"}, "primary")
+    assert models(setup.client) == ["primary"] * 4
+    assert setup.backoffs == [0.5, 1.0, 2.0]
+
+
+def test_non_retryable_errors_are_raised(setup):
+    setup.client.script = [ValueError("bad request")]
+    with pytest.raises(ValueError):
+        call()
+    assert len(setup.client.calls) == 1
+
+
+def test_fallback_gets_its_own_attempts_after_errors(setup):
+    setup.client.script = [server_error(), server_error(), server_error()]
+    _, model = call()
+    assert model == "fallback"
+    assert models(setup.client) == ["primary", "primary", "fallback", "fallback"]
+
+
+def test_fallback_errors_are_raised_after_its_attempts(setup):
+    setup.client.script = [server_error()] * 4
+    with pytest.raises(type(server_error())):
+        call()
+    assert models(setup.client) == ["primary", "primary", "fallback", "fallback"]
+
+
+def test_switch_to_fallback_when_the_deadline_gets_close(setup):
+    # The primary times out at its 10 s share, leaving the 20 s margin for the fallback
+    setup.client.script = [15.0]
+    _, model = call(30)
+    assert model == "fallback"
+    assert [(c["model"], c["timeout"]) for c in setup.client.calls] == [("primary", 10.0), ("fallback", 20.0)]
+    assert setup.backoffs == []
+
+
+def test_fallback_directly_with_little_deadline_left(setup):
+    _, model = call(5)
+    assert model == "fallback"
+    assert [(c["model"], c["timeout"]) for c in setup.client.calls] == [("fallback", 5.0)]
+
+
+def test_attempts_reset_when_the_deadline_switches_model(setup):
+    setup.client.script = [server_error(), 15.0, server_error()]
+    _, model = call(32)
+    assert models(setup.client) == ["primary", "primary", "fallback", "fallback"]
+    assert model == "fallback"
+
+
+def test_deadline_exceeded_when_the_backoff_does_not_fit(setup):
+    setup.policy = policy(fallback_model=None, max_attempts=5)
+    setup.jitter = lambda low, high: high
+    setup.client.script = [server_error()]
+    with pytest.raises(HTTPException) as raised:
+        call(0.4)
+    assert raised.value.status_code == 504
+    assert len(setup.client.calls) == 1
+    assert setup.backoffs == [0.5]
+
+
+def test_deadline_exceeded_after_a_timeout(setup):
+    setup.policy = policy(fallback_model=None)
+    setup.client.script = [15.0]
+    with pytest.raises(HTTPException) as raised:
+        call(10)
+    assert raised.value.status_code == 504
+
+
+def test_usage_is_filled():
+    client = FakeAsyncClient()
+    usage = {}
+
+    async def main():
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr(upstream, "get_async_client", lambda: client)
+            mp.setattr(upstream, "site_policy", lambda site: policy())
+            return await acall_llm("test", MESSAGES, Answer, usage)
+
+    asyncio.run(main())
+    assert usage == {"prompt_tokens": 10, "completion_tokens": 5}
+
+
+@pytest.fixture
+def hedging(monkeypatch):
+    client = FakeAsyncClient()
+    monkeypatch.setattr(upstream, "get_async_client", lambda: client)
+    monkeypatch.setattr(upstream, "site_policy", lambda site: policy(hedge_quantile=0.95))
+    monkeypatch.setattr(upstream, "_hedge_delay", lambda site, policy, timeout: 0.05)
+    return client
+
+
+def hedged_call():
+    async def main():
+        result = await acall_llm("test", MESSAGES, Answer)
+        # Let the cancelled loser unwind
+        await asyncio.sleep(0.01)
+        return result
+
+    return asyncio.run(main())
+
+
+def test_hedge_wins_and_the_slow_primary_is_cancelled(hedging):
+    hedging.script = [1.0, 0.01]
+    wins = upstream.upstream_stats["hedge_wins"]
+    response, _ = hedged_call()
+    assert response == {"text": "answer 2"}
+    assert len(hedging.calls) == 2
+    assert hedging.cancelled == 1
+    assert upstream.upstream_stats["hedge_wins"] == wins + 1
+
+
+def test_no_hedge_for_a_fast_primary(hedging):
+    hedging.script = [0.01]
+    hedged_call()
+    assert len(hedging.calls) == 1
+
+
+def test_primary_answers_while_the_hedge_is_in_flight(hedging):
+    hedging.script = [0.08, 1.0]
+    response, _ = hedged_call()
+    assert response == {"text": "answer 2"}
+    assert len(hedging.calls) == 2
+    assert hedging.cancelled == 1
+
+
+def test_hedge_covers_a_failing_primary(hedging):
+    async def failing_later():
+        await asyncio.sleep(0.08)
+        raise server_error()
+
+    original = hedging.post
+    calls = []
+
+    async def post(path, cast_to, body, options):
+        calls.append(body["model"])
+        if len(calls) == 1:
+            await failing_later()
+        return await original(path, cast_to, body, options)
+
+    hedging.post = post
+    hedging.script = [0.01]
+    response, _ = hedged_call()
+    assert response == {"text": "answer 1"}
+    assert calls == ["primary", "primary"]
+
+
+def test_no_hedge_under_a_rate_limit(hedging):
+    hedging.script = [0.1]
+
+    async def main():
+        with rate_limit(RateLimiter(1000, burst=10)):
+            return await acall_llm("test", MESSAGES, Answer)
+
+    asyncio.run(main())
+    assert len(hedging.calls) == 1
@@ -0,0 +1,105 @@
+from src.schema.validate import ERROR, WARNING, ModelIndex, errors, validate_model
+
+
+def attribute(attribute_id, name=None, primary=False, foreign=False):
+    return {"id": attribute_id, "name": name or attribute_id, "type": "string", "isPrimaryKey": primary, "isForeignKey": foreign}
+
+
+def make_model():
+    return {
+        "id": "shop",
+        "name": "Shop",
+        "message": "",
+        "entities": [
+            {"id": "customer", "name": "Customer", "attributes": [attribute("customer_id", primary=True), attribute("email")]},
+            {"id": "order", "name": "Order", "attributes": [
+                attribute("order_id", primary=True),
+                attribute("order_customer", "customer_id", foreign=True),
+            ]},
+            {"id": "product", "name": "Product", "attributes": [attribute("sku", primary=True)]},
+        ],
+        "relationships": [
+            {"id": "places", "fromEntity": "customer", "toEntity": "order", "type": "one-to-many", "name": "places"},
+        ],
+    }
+
+
+def rules(findings):
+    return sorted((f.rule, f.path) for f in findings)
+
+
+def test_valid_model_has_no_findings():
+    assert validate_model(make_model()) == []
+
+
+def test_duplicate_ids():
+    model = make_model()
+    model["entities"].append({"id": "product", "name": "Product again", "attributes": [attribute("sku", primary=True)]})
+    model["entities"][0]["attributes"].append(attribute("email"))
+    model["relationships"].append(dict(model["relationships"][0]))
+    assert rules(validate_model(model)) == [
+        ("duplicate_attribute_id", "/entities/customer/attributes/email"),
+        ("duplicate_entity_id", "/entities/product"),
+        ("duplicate_relationship_id", "/relationships/places"),
+    ]
+
+
+def test_relationship_to_unknown_entity():
+    model = make_model()
+    model["relationships"].append({"id": "ships", "fromEntity": "order", "toEntity": "shipment", "type": "one-to-one", "name": "ships"})
+    findings = validate_model(model)
+    assert rules(findings) == [("unknown_entity", "/relationships/ships/toEntity")]
+    assert "'shipment'" in findings[0].message
+
+
+def test_missing_primary_key_lists_attributes():
+    model = make_model()
+    model["entities"][2]["attributes"] = [attribute("sku"), attribute("title")]
+    findings = validate_model(model)
+    assert rules(findings) == [("missing_primary_key", "/entities/product")]
+    assert "sku, title" in findings[0].message
+
+
+def test_foreign_key_of_unrelated_entity():
+    model = make_model()
+    model["entities"][2]["attributes"].append(attribute("product_customer", "customer_id", foreign=True))
+    assert rules(validate_model(model)) == [("orphan_foreign_key", "/entities/product/attributes/product_customer")]
+
+
+def test_foreign_key_naming_an_entity_it_is_not_related_to():
+    model = make_model()
+    model["entities"][1]["attributes"].append(attribute("order_product", "product_id", foreign=True))
+    findings = validate_model(model)
+    assert rules(findings) == [("unrelated_foreign_key", "/entities/order/attributes/order_product")]
+    assert findings[0].severity == ERROR
+
+
+def test_foreign_key_matched_through_primary_key_name():
+    model = make_model()
+    model["entities"][0]["attributes"][0]["name"] = "cust_no"
+    model["entities"][1]["attributes"][1]["name"] = "cust_no"
+    assert validate_model(model) == []
+
+
+def test_unmatched_foreign_key_is_a_warning():
+    model = make_model()
+    model["entities"][1]["attributes"][1]["name"] = "buyer_ref"
+    findings = validate_model(model)
+    assert rules(findings) == [("unmatched_foreign_key", "/entities/order/attributes/order_customer")]
+    assert findings[0].severity == WARNING
+    assert errors(findings) == []
+
+
+def test_pointer_escapes_ids():
+    model = make_model()
+    model["entities"][2]["id"] = "a/b~c"
+    model["entities"][2]["attributes"] = []
+    assert rules(validate_model(model)) == [("missing_primary_key", "/entities/a~1b~0c")]
+
+
+def test_index_is_reused():
+    model = make_model()
+    index = ModelIndex(model)
+    assert index.adjacency == {"customer": {"order"}, "order": {"customer"}, "product": set()}
+    assert index.referenced_entities("Customer-ID") == {"customer"}
+    assert validate_model(model, index) == []
@@ -0,0 +1,172 @@
+import copy
+
+from src.agent.versions import ModelVersionStore
+
+
+def attribute(attribute_id, **fields):
+    return {"id": attribute_id, "name": attribute_id, "type": "string", **fields}
+
+
+def base_model():
+    return {
+        "id": "shop",
+        "name": "Shop",
+        "message": "v1",
+        "entities": [
+            {"id": "customer", "name": "Customer", "attributes": [attribute("customer_id", isPrimaryKey=True), attribute("email")]},
+            {"id": "order", "name": "Order", "attributes": [attribute("order_id", isPrimaryKey=True)]},
+        ],
+        "relationships": [{"id": "places", "fromEntity": "customer", "toEntity": "order", "type": "one-to-many", "name": "places"}],
+    }
+
+
+def edited_model():
+    model = copy.deepcopy(base_model())
+    model["message"] = "v2"
+    model["entities"][0]["attributes"][1]["type"] = "email"
+    model["entities"][0]["attributes"].append(attribute("phone"))
+    model["entities"][1]["name"] = "Purchase"
+    model["entities"].append({"id": "product", "name": "Product", "attributes": [attribute("sku", isPrimaryKey=True)]})
+    model["relationships"] = [{"id": "contains", "fromEntity": "order", "toEntity": "product", "type": "many-to-many", "name": "contains"}]
+    return model
+
+
+def committed(model):
+    store = ModelVersionStore()
+    store.commit("u", model)
+    return store
+
+
+def blobs(store):
+    stats = store.stats()
+    return stats["entity_blobs"], stats["attribute_blobs"], stats["relationship_blobs"]
+
+
+def test_commit_and_get_round_trip():
+    store = ModelVersionStore()
+    assert store.commit("u", base_model()) == 1
+    assert store.get("u", "shop", 1) == base_model()
+    assert store.get("u", "shop", 2) is None
+    assert store.latest_version("u", "shop") == 1
+    assert blobs(store) == (2, 3, 1)
+
+
+def test_identical_commit_is_deduplicated():
+    store = ModelVersionStore()
+    store.commit("u", base_model())
+    before = store.stats()
+    assert store.commit("u", base_model()) == 1
+    assert store.stats() == before
+    assert [v["version"] for v in store.versions("u", "shop")] == [1]
+
+
+def test_unchanged_subtrees_are_shared():
+    store = ModelVersionStore()
+    store.commit("u", base_model())
+    model = base_model()
+    model["message"] = "only the message changed"
+    assert store.commit("u", model) == 2
+    assert store.stats()["versions"] == 2
+    assert blobs(store) == (2, 3, 1)
+    # Another user with the same content shares the blobs too
+    store.commit("other", base_model())
+    assert blobs(store) == (2, 3, 1)
+
+
+def test_diff_reports_structural_changes():
+    store = ModelVersionStore()
+    store.commit("u", base_model())
+    store.commit("u", edited_model())
+    assert store.diff("u", "shop", 1, 2) == {
+        "model_id": "shop",
+        "from": 1,
+        "to": 2,
+        "changed_fields": ["message"],
+        "entities": {
+            "added": ["product"],
+            "removed": [],
+            "changed": [
+                {"id": "customer", "fields": [], "attributes": {"added": ["phone"], "removed": [], "changed": [{"id": "email", "fields": ["type"]}]}},
+                {"id": "order", "fields": ["name"], "attributes": {"added": [], "removed": [], "changed": []}},
+            ],
+        },
+        "relationships": {"added": ["contains"], "removed": ["places"], "changed": []},
+    }
+    reverse = store.diff("u", "shop", 2, 1)
+    assert reverse["entities"]["removed"] == ["product"]
+    assert store.diff("u", "shop", 1, 3) is None
+
+
+def test_diff_of_equal_versions_is_empty():
+    store = ModelVersionStore()
+    store.commit("u", base_model())
+    diff = store.diff("u", "shop", 1, 1)
+    assert diff["changed_fields"] == []
+    assert diff["entities"] == {"added": [], "removed": [], "changed": []}
+
+
+def test_undo_walks_back_without_copying():
+    store = ModelVersionStore()
+    store.commit("u", base_model())
+    store.commit("u", edited_model())
+    before = blobs(store)
+    version, model = store.revert("u", "shop")
+    assert (version, model) == (3, base_model())
+    assert blobs(store) == before
+    assert store.versions("u", "shop")[-1]["parent"] is None
+    # Version 3 is version 1 again, whose parent is nothing
+    assert store.revert("u", "shop") is None
+
+
+def test_undo_at_the_first_version():
+    store = ModelVersionStore()
+    assert store.revert("u", "shop") is None
+    store.commit("u", base_model())
+    assert store.revert("u", "shop") is None
+    assert store.stats()["versions"] == 1
+
+
+def test_undo_after_the_parent_was_trimmed():
+    store = ModelVersionStore(max_versions=2)
+    for message in ("v1", "v2", "v3"):
+        store.commit("u", dict(base_model(), message=message))
+    assert [v["version"] for v in store.versions("u", "shop")] == [2, 3]
+    version, model = store.revert("u", "shop")
+    assert (version, model["message"]) == (4, "v2")
+    # Version 4's parent is version 1, which is no longer kept
+    assert store.revert("u", "shop") is None
+    assert store.get("u", "shop", 1) is None
+
+
+def test_model_lru_releases_blobs():
+    store = ModelVersionStore(max_models=1)
+    store.commit("u", base_model())
+    store.commit("u", dict(edited_model(), id="other"))
+    assert store.stats()["models"] == 1
+    assert blobs(store) == blobs(committed(edited_model()))
+
+
+def test_reset_returns_blob_counts_to_zero():
+    store = ModelVersionStore()
+    store.commit("u", base_model())
+    store.commit("u", edited_model())
+    store.revert("u", "shop")
+    store.commit("v", base_model())
+    store.reset("u")
+    assert blobs(store) == (2, 3, 1)
+    store.reset("v")
+    assert store.stats() == {"models": 0, "versions": 0, "entity_blobs": 0, "attribute_blobs": 0,
+                             "relationship_blobs": 0, "cached_models": 0}
+
+
+def test_checkout_keeps_blobs_until_release():
+    store = ModelVersionStore(max_versions=1)
+    ref = store.checkout("u", base_model())
+    store.commit("u", edited_model())
+    assert store.get("u", "shop", 1) is None
+    assert store.materialize(ref) == base_model()
+    assert store.materialize(ref) is store.materialize(ref)
+    store.reset("u")
+    assert blobs(store) == (2, 3, 1)
+    store.release(ref)
+    assert blobs(store) == (0, 0, 0)